@@ -0,0 +1,73 @@
+# measures building the currency graph of a league sized exchange, finding its profitable cycles, and updating it
+# when the rates refresh, both when only some rates improve and when every rate moves
+import random
+from copy import copy
+from dataclasses import replace
+from time import perf_counter
+from typing import Dict
+
+from POE.Trade.CurrencyGraph import CurrencyGraph
+from Tools.API.POE_Ninja import Currency
+
+CURRENCIES = 100
+IMPROVED_RATES = 5  # the rates improved by a refresh which is relaxed incrementally
+REPEATS = 5
+
+
+def _synthetic_currencies(count: int = CURRENCIES, seed: int = 0) -> Dict[str, Currency]:
+    # chaos values spanning fragments to mirrors, each bought and sold with a spread of 1 to 10%
+    rng = random.Random(seed)
+    currencies = {'chaos': Currency(id=1, icon='', name='Chaos Orb', tradeId='chaos', chaos_value=1)}
+    for index in range(1, count):
+        chaos_value, spread = 10 ** rng.uniform(-2, 5), rng.uniform(0.01, 0.1)
+        currencies[f'currency{index}'] = Currency(id=index + 1, icon='', name=f'Currency {index}', tradeId=f'currency{index}', chaos_value=chaos_value,
+                                                  pay_value=1 / (chaos_value * (1 - spread)), receive_value=chaos_value * (1 + spread))
+    return currencies
+
+
+def _fastest(func) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def measure_update(graph: CurrencyGraph, currencies: Dict[str, Currency]) -> float:
+    """
+    :return: The fastest time taken to update a copy of the graph to the currencies, in seconds
+    """
+    timings = []
+    for _ in range(REPEATS):
+        # updates replace the graph's arrays rather than writing into them, so a shallow copy leaves the original intact
+        updated = copy(graph)
+        start = perf_counter()
+        updated.update(currencies)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def run():
+    currencies = _synthetic_currencies()
+    graph = CurrencyGraph(currencies)
+
+    improved = dict(currencies)
+    for code in list(currencies)[1:IMPROVED_RATES + 1]:
+        improved[code] = replace(currencies[code], receive_value=currencies[code].receive_value * 0.99)
+    moved = {code: replace(currency, pay_value=currency.pay_value and currency.pay_value * 1.01) for code, currency in currencies.items()}
+
+    results = {
+        'currencies': len(currencies),
+        'build_s': _fastest(lambda: CurrencyGraph(currencies)),
+        'cycles_s': _fastest(graph.profitable_cycles),
+        'improved_update_s': measure_update(graph, improved),
+        'full_update_s': measure_update(graph, moved),
+    }
+    print(f'{results["currencies"]} currencies   build: {results["build_s"] * 1000:8.2f} ms   cycles: {results["cycles_s"] * 1000:8.2f} ms   '
+          f'improved update: {results["improved_update_s"] * 1000:8.2f} ms   full update: {results["full_update_s"] * 1000:8.2f} ms')
+    return results
+
+
+if __name__ == '__main__':
+    run()
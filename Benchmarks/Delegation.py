@@ -0,0 +1,102 @@
+# compares attribute reads through the class creation time delegation of Tools.Wrapper against the original
+# __getattr__ based wrapper, over upgrade prophecies built like UPGRADE_PROPHECIES
+import csv
+from timeit import repeat
+from typing import List
+
+from Data.Index import PROPHECY_INFO
+from Tools import Wrapper
+from Tools.API.POE.Items import Item
+
+REPEATS = 5
+ROUNDS = 200
+
+
+class _LegacyWrapper(object):
+    # the original wrapper, kept as the baseline for comparison. Its python 2 style __metaclass__ is ignored on
+    # python 3, so every delegated read falls back to __getattr__
+    __wraps__ = None
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __getattr__(self, name):
+        return getattr(self._obj, name)
+
+
+class _LegacyProphecy(_LegacyWrapper):
+    __wraps__ = Item
+
+
+class _LegacyUpgradeProphecy(_LegacyWrapper):
+    __wraps__ = _LegacyProphecy
+
+    def __init__(self, prophecy, base_unique: Item, result_unique: Item):
+        super().__init__(prophecy)
+        self.base_unique = base_unique
+        self.result_unique = result_unique
+
+
+class _Prophecy(Wrapper):
+    __wraps__ = Item
+
+
+class _UpgradeProphecy(Wrapper):
+    __wraps__ = _Prophecy
+
+    def __init__(self, prophecy: _Prophecy, base_unique: Item, result_unique: Item):
+        super().__init__(prophecy)
+        self.base_unique = base_unique
+        self.result_unique = result_unique
+
+
+class _DirectUpgradeProphecy(Item):
+    # the same attributes held directly by the prophecy, as the lower bound of any delegation
+    __slots__ = ('base_unique', 'result_unique')
+
+    def __init__(self, prophecy: Item, base_unique: Item, result_unique: Item):
+        super().__init__(prophecy.type, prophecy.text, prophecy.name, prophecy.flags, prophecy.disc)
+        self.base_unique = base_unique
+        self.result_unique = result_unique
+
+
+def _prophecy_items() -> List[tuple]:
+    # the prophecies are built from the recipe csv rather than the item catalogue, so that no network access is needed
+    with open(PROPHECY_INFO, 'r') as prophecy_file:
+        return [(Item(type='Prophecy', text=prophecy, name=prophecy, flags={'prophecy': True}), Item(type='Unique', text=base, name=base, flags={'unique': True}),
+                 Item(type='Unique', text=result, name=result, flags={'unique': True})) for prophecy, base, result in csv.reader(prophecy_file)]
+
+
+def _read_attributes(prophecies) -> int:
+    # the attributes read when pricing and displaying a prophecy
+    total = 0
+    for _ in range(ROUNDS):
+        for prophecy in prophecies:
+            total += len(prophecy.name) + len(prophecy.type) + len(prophecy.text) + prophecy.unique + len(prophecy.base_unique.name)
+    return total
+
+
+def measure_reads_per_second(prophecies) -> float:
+    """
+    :param prophecies: The objects to read attributes from
+    :return: The number of attribute reads achieved per second, taking the fastest of several repeats
+    """
+    reads = ROUNDS * len(prophecies) * 5
+    return reads / min(repeat(lambda: _read_attributes(prophecies), number=1, repeat=REPEATS))
+
+
+def run():
+    items = _prophecy_items()
+    legacy = measure_reads_per_second([_LegacyUpgradeProphecy(_LegacyProphecy(prophecy), base, result) for prophecy, base, result in items])
+    current = measure_reads_per_second([_UpgradeProphecy(_Prophecy(prophecy), base, result) for prophecy, base, result in items])
+
+    direct = measure_reads_per_second([_DirectUpgradeProphecy(prophecy, base, result) for prophecy, base, result in items])
+
+    results = {'legacy': legacy, 'current': current, 'direct': direct}
+    for name, reads in results.items():
+        print(f'{name:<8} {reads / 1e6:8.2f}M reads/s   ({reads / legacy:.1f}x legacy)')
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,91 @@
+# compares fetching through the shared pooled session against opening a new connection for every request,
+# using a local stub server which returns a gzipped page of fetch results
+import gzip
+import json
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process, Queue
+from time import perf_counter, process_time
+
+import requests
+
+from Tools.API import Http
+from Tools.API.POE import _get_search_result_headers, _search_result_headers
+
+FETCHES = 1000
+BENCHMARK_LEAGUE = 'Standard'
+
+_listing = {'id': '0' * 64, 'listing': {'price': {'type': '~price', 'amount': 1, 'currency': 'chaos'}}, 'item': {'name': 'Tabula Rasa', 'typeLine': 'Simple Robe', 'ilvl': 86}}
+_response_body = json.dumps({'result': [_listing] * 10}).encode('utf-8')
+
+
+class _FetchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # allows connections to be kept alive
+    disable_nagle_algorithm = True  # otherwise the separately written headers and body of a response are delayed on a kept alive connection
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))  # the request body must be consumed before the connection is reused
+        body = _response_body
+        gzipped = 'gzip' in self.headers.get('accept-encoding', '')
+        if gzipped:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        if gzipped:
+            self.send_header('content-encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(port_queue: Queue):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FetchHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _unpooled_fetch(url: str, search_id: str):
+    # the original request path, copying the headers and opening a new connection for every request
+    headers = deepcopy(_search_result_headers)
+    headers['referer'] = headers['referer'].format(league=BENCHMARK_LEAGUE, trade_search_id=search_id)
+    return requests.get(url, json={'query': search_id}, headers=headers).json()
+
+
+def _pooled_fetch(url: str, search_id: str):
+    return Http.get(url, json={'query': search_id}, headers=_get_search_result_headers(search_id, BENCHMARK_LEAGUE)).json()
+
+
+def measure_fetches(fetch, url: str, fetches: int = FETCHES) -> dict:
+    """
+    :param fetch: The function performing a single fetch
+    :param url: The url of the stub server
+    :param fetches: The number of fetches to perform
+    :return: The mean latency and client CPU time of each fetch, in milliseconds
+    """
+    start_time, start_cpu = perf_counter(), process_time()
+    for _ in range(fetches):
+        fetch(url, 'search-id')
+    return {'latency_ms': (perf_counter() - start_time) * 1000 / fetches, 'cpu_ms': (process_time() - start_cpu) * 1000 / fetches}
+
+
+def run():
+    # the server runs in its own process, so that its work is not counted as client CPU time
+    port_queue = Queue()
+    server = Process(target=_serve, args=(port_queue,), daemon=True)
+    server.start()
+    try:
+        url = f'http://127.0.0.1:{port_queue.get()}/api/trade/fetch/ids'
+        results = {'unpooled': measure_fetches(_unpooled_fetch, url), 'pooled': measure_fetches(_pooled_fetch, url)}
+    finally:
+        server.terminate()
+
+    for name, result in results.items():
+        print(f'{name:<10} latency: {result["latency_ms"]:6.3f} ms/request   cpu: {result["cpu_ms"]:6.3f} ms/request')
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,124 @@
+# measures the memory held per catalogue item and per cached listing, comparing the original representations (a
+# dataclass with a flags dict, and the raw listing json) against the slotted, interned Item and Listing types
+import gc
+import json
+import random
+import tempfile
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, List
+
+from Tools.API.POE.ItemCache import ItemCacheFile, write_item_cache
+from Tools.API.POE.Items import Item
+from Tools.API.POE.Listings import parse_listings
+
+CATALOGUE_CATEGORIES = 40
+CATALOGUE_ITEMS = 25_000
+BASE_TYPES = 900
+LISTINGS = 100_000
+
+
+@dataclass(eq=True)
+class _LegacyItem(object):
+    # the original item, kept as the baseline for comparison
+    type: str
+    text: str
+    name: str = field(default=None)
+    flags: dict = field(default=None)
+    disc: str = field(default=None)
+
+
+def _synthetic_catalogue(seed: int = 0) -> List[dict]:
+    # shaped like the 'result' of the trade API's item data endpoint, where thousands of items share a few hundred base types
+    generator = random.Random(seed)
+    base_types = [f'Base Type {index}' for index in range(BASE_TYPES)]
+    categories = [{'label': f'Category {index}', 'entries': []} for index in range(CATALOGUE_CATEGORIES)]
+    for index in range(CATALOGUE_ITEMS):
+        base_type = generator.choice(base_types)
+        if generator.random() < 0.4:
+            entry = {'name': f'Unique {index}', 'type': base_type, 'text': f'Unique {index} {base_type}', 'flags': {'unique': True}}
+        else:
+            entry = {'type': base_type, 'text': base_type}
+        if generator.random() < 0.05:
+            entry['disc'] = generator.choice(['warfortheatlas', 'atlasofworlds', 'theawakening'])
+        generator.choice(categories)['entries'].append(entry)
+    return categories
+
+
+def _synthetic_fetch_response(first_id: int, seed: int) -> str:
+    # shaped like a response of the trade API's fetch endpoint, including the fields which are never used
+    generator = random.Random(seed)
+    result = []
+    for listing_id in range(first_id, first_id + 10):
+        base_type = f'Base Type {generator.randrange(BASE_TYPES)}'
+        result.append({
+            'id': f'{listing_id:064x}',
+            'listing': {
+                'method': 'psapi',
+                'indexed': f'2021-01-{generator.randint(10, 28)}T{generator.randint(10, 23)}:{generator.randint(10, 59)}:{generator.randint(10, 59)}Z',
+                'stash': {'name': f'~price {generator.randint(1, 50)} chaos', 'x': generator.randrange(12), 'y': generator.randrange(12)},
+                'whisper': f'@Seller{listing_id % 5000} Hi, I would like to buy your {base_type} listed for {generator.randint(1, 50)} chaos in Ritual',
+                'account': {'name': f'Seller{listing_id % 5000}', 'lastCharacterName': f'Character{listing_id % 5000}', 'online': {'league': 'Ritual'}, 'language': 'en_US'},
+                'price': {'type': '~price', 'amount': generator.randint(1, 50), 'currency': generator.choice(['chaos', 'exalted', 'alch'])},
+            },
+            'item': {
+                'verified': True, 'w': 2, 'h': 3,
+                'icon': f'https://web.poecdn.com/image/Art/2DItems/Armours/BodyArmours/{base_type.replace(" ", "")}.png?v={listing_id:032x}',
+                'league': 'Ritual', 'id': f'{listing_id:064x}', 'name': '', 'typeLine': base_type, 'identified': True, 'ilvl': generator.randint(60, 86),
+                'sockets': [{'group': 0, 'attr': 'S', 'sColour': 'R'} for _ in range(generator.randint(1, 6))],
+                'properties': [{'name': 'Armour', 'values': [[str(generator.randint(100, 900)), 1]], 'displayMode': 0, 'type': 16}],
+                'requirements': [{'name': 'Level', 'values': [[str(generator.randint(1, 68)), 0]], 'displayMode': 0}],
+                'explicitMods': [f'+{generator.randint(10, 99)} to maximum Life', f'+{generator.randint(10, 45)}% to Fire Resistance'],
+                'descrText': 'Place into an allocated Jewel Socket on the Passive Skill Tree. Right click to remove from the Socket.',
+                'frameType': 2,
+                'extended': {'hashes': {'explicit': [['explicit.stat_3299347043', [0]], ['explicit.stat_3372524247', [1]]]}},
+            },
+        })
+    return json.dumps({'result': result})
+
+
+def measure_retained_bytes(build: Callable[[], object]) -> int:
+    """
+    :param build: Builds and returns the objects to measure
+    :return: The number of bytes still allocated once build returns, while its result is alive
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = Path(directory).joinpath('items.bin')
+        write_item_cache(cache_path, _synthetic_catalogue())
+        cache = ItemCacheFile(cache_path)
+        # both representations are built from the same decoded records, as the catalogue is read from the item cache
+        catalogue_legacy = measure_retained_bytes(lambda: [_LegacyItem(**cache.record(index)) for index in range(len(cache))])
+        catalogue_current = measure_retained_bytes(lambda: [Item(**cache.record(index)) for index in range(len(cache))])
+        item_count = len(cache)
+        cache.close()
+
+    responses = [_synthetic_fetch_response(first_id, seed=first_id) for first_id in range(0, LISTINGS, 10)]
+    listings_legacy = measure_retained_bytes(lambda: [listing for response in responses for listing in json.loads(response)['result']])
+    listings_current = measure_retained_bytes(lambda: [listing for response in responses for listing in parse_listings(json.loads(response)['result'])])
+
+    results = {
+        'catalogue': {'legacy': catalogue_legacy / item_count, 'current': catalogue_current / item_count},
+        'listings': {'legacy': listings_legacy / LISTINGS, 'current': listings_current / LISTINGS},
+    }
+    for name, result in results.items():
+        print(f'{name:<12} legacy: {result["legacy"]:8.0f} bytes each   current: {result["current"]:8.0f} bytes each   ({result["legacy"] / result["current"]:.1f}x smaller)')
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,123 @@
+# measures each stage of the fetch and price pipeline: parsing the item catalogue, fetching search results from a local
+# stub server through the trade API ratelimiter, and pricing the fetched listings
+import json
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from Benchmarks.Memory import _synthetic_catalogue, _synthetic_fetch_response
+from POE.Trade.Pricing import ExchangeRateTable, price_listings
+from Tools.API.POE import MAX_LISTINGS_PER_REQUEST, TRADE_API_NAME, TradeClient
+from Tools.API.POE.ItemCache import write_item_cache
+from Tools.API.POE.Items import ItemCatalogue
+from Tools.API.POE.Listings import parse_listings
+from Tools.API.POE_Ninja import Currency
+from Tools.API.Ratelimiting import _ratelimits
+from Tools.API.Replay import Cassette
+from Tools.API.StubServer import RatelimitEmulator, StubServer
+
+SEARCH_RESULTS = 1000
+FETCH_LATENCIES = (0, 0.02)  # seconds each stub response is delayed by, without and with a realistic round trip
+PRICED_LISTINGS = 100_000
+REPEATS = 3
+BENCHMARK_LEAGUE = 'Standard'  # searched explicitly, so the active leagues are never looked up
+
+_query = {'query': {'status': {'option': 'online'}, 'type': 'Base Type 0'}, 'sort': {'price': 'asc'}}
+_search_id = 'benchmark'
+# generous enough that no request waits, so that the ratelimiter's own overhead is measured rather than its limits
+_stub_rules = ((1_000_000, 1, 1),)
+
+
+def measure_catalogue() -> dict:
+    """
+    :return: The time taken to decode the catalogue json and write the item cache, to open the cache, and to build every item from it, in seconds
+    """
+    body = json.dumps({'result': _synthetic_catalogue()})
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = Path(directory).joinpath('items.bin')
+        start = perf_counter()
+        write_item_cache(cache_path, json.loads(body)['result'])
+        written = perf_counter()
+        catalogue = ItemCatalogue(cache_path)
+        opened = perf_counter()
+        items = [catalogue.item(index) for index in range(len(catalogue))]
+        built = perf_counter()
+        catalogue.close()
+    return {'items': len(items), 'write_s': written - start, 'open_s': opened - written, 'build_s': built - opened}
+
+
+def _search_cassette(results: int = SEARCH_RESULTS) -> Cassette:
+    trade_ids = [f'{listing_id:064x}' for listing_id in range(results)]
+    cassette = Cassette()
+    cassette.add('POST', f'/api/trade/search/{BENCHMARK_LEAGUE}', json.dumps(_query), 200, {}, json.dumps({'id': _search_id, 'result': trade_ids, 'total': results}))
+    for first_id in range(0, results, MAX_LISTINGS_PER_REQUEST):
+        trade_id_string = ','.join(trade_ids[first_id:first_id + MAX_LISTINGS_PER_REQUEST])
+        cassette.add('GET', f'/api/trade/fetch/{trade_id_string}?query={_search_id}', json.dumps({'query': _search_id}), 200, {}, _synthetic_fetch_response(first_id, seed=first_id))
+    return cassette
+
+
+def measure_fetches(latency: float, results: int = SEARCH_RESULTS) -> dict:
+    """
+    Runs a search against the stub server, fetching every result through TradeClient.fetch_query_results
+
+    :param latency: The number of seconds each response of the stub server is delayed by
+    :param results: The number of search results to fetch
+    :return: The number of fetch requests and listings completed per second, taking the fastest of several repeats
+    """
+    cassette = _search_cassette(results)
+    client = TradeClient(BENCHMARK_LEAGUE)
+    timings = []
+    with StubServer(cassette, latency=latency, ratelimit=RatelimitEmulator(_stub_rules)):
+        for _ in range(REPEATS):
+            # the ratelimit is rediscovered from the stub, rather than reusing any rules of the live trade API
+            _ratelimits.pop(TRADE_API_NAME.value, None)
+            start = perf_counter()
+            listings = client.fetch_query_results(_query, use_cache=False)
+            timings.append(perf_counter() - start)
+    _ratelimits.pop(TRADE_API_NAME.value, None)
+
+    requests = -(-len(listings) // MAX_LISTINGS_PER_REQUEST)
+    return {'requests_per_s': requests / min(timings), 'listings_per_s': len(listings) / min(timings)}
+
+
+def _exchange_rate_table() -> ExchangeRateTable:
+    chaos_values = {'chaos': 1.0, 'exalted': 80.0, 'alch': 0.25}
+    return ExchangeRateTable({code: Currency(id=index, icon='', name=code, tradeId=code, chaos_value=value) for index, (code, value) in enumerate(chaos_values.items())})
+
+
+def measure_pricing(listings: int = PRICED_LISTINGS) -> dict:
+    """
+    :param listings: The number of listings to price
+    :return: The number of listings parsed from fetch responses, and priced in chaos, per second
+    """
+    responses = [json.loads(_synthetic_fetch_response(first_id, seed=first_id))['result'] for first_id in range(0, listings, 10)]
+    table = _exchange_rate_table()
+
+    start = perf_counter()
+    parsed = [listing for response in responses for listing in parse_listings(response)]
+    parse_time = perf_counter() - start
+
+    price_time = float('inf')
+    for _ in range(REPEATS):
+        start = perf_counter()
+        price_listings(parsed, table)
+        price_time = min(price_time, perf_counter() - start)
+    return {'parsed_per_s': len(parsed) / parse_time, 'priced_per_s': len(parsed) / price_time}
+
+
+def run():
+    results = {'catalogue': measure_catalogue()}
+    catalogue = results['catalogue']
+    print(f'catalogue    {catalogue["items"]} items   write: {catalogue["write_s"] * 1000:8.2f} ms   open: {catalogue["open_s"] * 1000:8.2f} ms   build: {catalogue["build_s"] * 1000:8.2f} ms')
+
+    for latency in FETCH_LATENCIES:
+        fetches = results[f'fetch_{latency * 1000:g}ms'] = measure_fetches(latency)
+        print(f'fetch        {latency * 1000:4g} ms latency   {fetches["requests_per_s"]:10.1f} requests/s   {fetches["listings_per_s"]:10.1f} listings/s')
+
+    pricing = results['pricing'] = measure_pricing()
+    print(f'pricing      parsed: {pricing["parsed_per_s"]:12.0f} listings/s   priced: {pricing["priced_per_s"]:12.0f} listings/s')
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,151 @@
+# compares the achieved request rate of the slot reserving ratelimiter against the original lock holding ratelimiter
+import tempfile
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Iterable
+
+from Tools.API.RatelimitBackends import SqliteRatelimitBackend
+from Tools.API.Ratelimiting import RatelimitRule, _Ratelimit
+
+# (rules, simulated request latency in seconds, number of requests)
+SCENARIOS = {
+    'single rule, slow requests': ([RatelimitRule(20, 1, buffer_interval=timedelta(0))], 0.2, 60),
+    'stacked rules, slow requests': ([RatelimitRule(10, 1, buffer_interval=timedelta(0)), RatelimitRule(25, 4, buffer_interval=timedelta(0))], 0.2, 40),
+    'unrestricted, instant requests': ([RatelimitRule(1_000_000, 1, buffer_interval=timedelta(0))], 0, 20_000),
+}
+THREADS = 16
+OVERHEAD_CALLS = 20_000
+
+
+class _LegacyRequestTracker(object):
+    # the original tracker, kept as the baseline for comparison
+    def __init__(self, rule: RatelimitRule):
+        self.requests = deque()
+        self.rule = rule
+
+    def clean_requests(self):
+        while self.requests and self.requests[0] + self.rule.interval + self.rule.buffer_interval < datetime.utcnow():
+            self.requests.popleft()
+
+    def request_ratelimited_until(self) -> datetime:
+        self.clean_requests()
+        if len(self.requests) == self.rule.max_executions:
+            return self.requests[0] + self.rule.interval
+        else:
+            return None
+
+    def insert_request_timestamp(self, timestamp: datetime):
+        self.requests.append(timestamp)
+
+
+class _LegacyRatelimit(object):
+    # the original ratelimiter, which holds its lock while sleeping and while the request executes
+    def __init__(self, rules: Iterable[RatelimitRule]):
+        self.trackers = [_LegacyRequestTracker(rule) for rule in rules]
+        self.execution_lock = Lock()
+
+    def execute(self, func, args, kwargs):
+        with self.execution_lock:
+            for tracker in self.trackers:
+                target_time = tracker.request_ratelimited_until()
+                if target_time is not None:
+                    wait_time = target_time - datetime.utcnow()
+                    if wait_time < timedelta(0):
+                        wait_time = tracker.rule.buffer_interval
+                    else:
+                        wait_time = wait_time + tracker.rule.buffer_interval
+                    sleep(wait_time.total_seconds())
+
+            execution_timestamp = datetime.utcnow()
+            result = func(*args, **kwargs)
+
+            for tracker in self.trackers:
+                tracker.insert_request_timestamp(execution_timestamp)
+
+            return result
+
+
+class _QuietRatelimit(_Ratelimit):
+    # the current ratelimiter, without recording metrics for each wait
+    def execute(self, func, args, kwargs):
+        wait_time = self.reserve()
+        if wait_time > 0:
+            sleep(wait_time)
+        return func(*args, **kwargs)
+
+
+def measure_request_rate(ratelimiter, latency: float, requests: int, threads: int = THREADS) -> float:
+    """
+    Sends requests through the ratelimiter from several threads at once
+
+    :param ratelimiter: The ratelimiter to execute each request through
+    :param latency: The number of seconds each simulated request takes to complete
+    :param requests: The total number of requests to execute
+    :param threads: The number of threads sending requests
+    :return: The achieved number of requests per second
+    """
+    def request():
+        if latency:
+            sleep(latency)
+
+    def worker(count: int):
+        for _ in range(count):
+            ratelimiter.execute(request, (), {})
+
+    counts = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(count,)) for count in counts]
+    start = perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return requests / (perf_counter() - start)
+
+
+def measure_call_overhead(ratelimiter, calls: int = OVERHEAD_CALLS) -> float:
+    """
+    Executes calls which are never limited through the ratelimiter, from a single thread
+
+    :param ratelimiter: The ratelimiter to execute each call through
+    :param calls: The number of calls to execute
+    :return: The time the ratelimiter adds to each call, in microseconds
+    """
+    def call():
+        pass
+
+    start = perf_counter()
+    for _ in range(calls):
+        call()
+    direct = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(calls):
+        ratelimiter.execute(call, (), {})
+    return (perf_counter() - start - direct) * 1e6 / calls
+
+
+def run():
+    unlimited = [RatelimitRule(OVERHEAD_CALLS * 10, 1, buffer_interval=timedelta(0))]
+    with tempfile.TemporaryDirectory() as directory:
+        backend = SqliteRatelimitBackend(Path(directory).joinpath('ratelimits.sqlite'))
+        results = {'overhead_us': {
+            'legacy': measure_call_overhead(_LegacyRatelimit(unlimited)),
+            'memory': measure_call_overhead(_Ratelimit(unlimited)),
+            'sqlite': measure_call_overhead(_Ratelimit(unlimited, backend=backend)),
+        }}
+    print('overhead per call                ' + '   '.join(f'{name}: {overhead:8.2f} us' for name, overhead in results['overhead_us'].items()))
+
+    for scenario, (rules, latency, requests) in SCENARIOS.items():
+        legacy = measure_request_rate(_LegacyRatelimit(rules), latency, requests)
+        current = measure_request_rate(_QuietRatelimit(rules), latency, requests)
+        results[scenario] = {'legacy': legacy, 'current': current}
+        print(f'{scenario:<32} legacy: {legacy:10.1f} req/s   current: {current:10.1f} req/s   ({current / legacy:.1f}x)')
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,46 @@
+# measures the cold import time of each API module, each in a fresh interpreter so that no module is cached
+import subprocess
+import sys
+
+from Tools.Files import PROJECT_ROOT
+
+MODULES = [
+    'Tools.API.Ratelimiting',
+    'Tools.API.POE',
+    'Tools.API.POE.Leagues',
+    'Tools.API.POE.Items',
+    'Tools.API.POE_Ninja',
+]
+
+_import_timer = '''
+from time import perf_counter
+start = perf_counter()
+import {module}
+print(perf_counter() - start)
+'''
+
+
+def measure_cold_import(module: str, repeats: int = 5) -> float:
+    """
+    Imports a module in a fresh interpreter several times, returning the fastest import time
+
+    :param module: The dotted name of the module to import
+    :param repeats: The number of fresh interpreters to measure
+    :return: The fastest measured import time, in seconds
+    """
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', _import_timer.format(module=module)], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return min(timings)
+
+
+def run():
+    results = {module: measure_cold_import(module) for module in MODULES}
+    for module, seconds in results.items():
+        print(f'{module:<30} {seconds * 1000:8.2f} ms')
+    return results
+
+
+if __name__ == '__main__':
+    run()
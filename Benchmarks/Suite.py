@@ -0,0 +1,125 @@
+# runs every benchmark and saves the results to json, tagged with the commit they were measured at, so that the effect
+# of a change can be compared against the results of an earlier commit
+#
+#   python -m Benchmarks.Suite                          runs every benchmark
+#   python -m Benchmarks.Suite pipeline ratelimiting    runs the named benchmarks
+#   python -m Benchmarks.Suite --compare <results.json> compares against earlier results
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from importlib import import_module
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from Data.Index import BENCHMARK_PATH
+from Tools.Files import PROJECT_ROOT
+
+# imported only when run, as each benchmark imports the modules it measures
+BENCHMARKS = {
+    'startup': 'Benchmarks.Startup',
+    'ratelimiting': 'Benchmarks.Ratelimiting',
+    'http': 'Benchmarks.Http',
+    'pipeline': 'Benchmarks.Pipeline',
+    'memory': 'Benchmarks.Memory',
+    'delegation': 'Benchmarks.Delegation',
+    'currency_graph': 'Benchmarks.CurrencyGraph',
+}
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(['git', *args], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    """
+    :return: The commit and machine the benchmarks are run on, as results are only comparable on the same machine
+    """
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(status) if status is not None else None,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+
+def run_benchmarks(names: Iterable[str] = BENCHMARKS) -> dict:
+    """
+    :param names: The names of the benchmarks to run, keys of BENCHMARKS
+    :return: The results of every benchmark, alongside the environment they were measured in
+    """
+    results = {}
+    for name in names:
+        print(f'--- {name} ---')
+        results[name] = import_module(BENCHMARKS[name]).run()
+    return {'environment': environment(), 'results': results}
+
+
+def save_results(results: dict, path: Path = None) -> Path:
+    """
+    :param results: The results returned by run_benchmarks
+    :param path: The file to save to, defaults to a file named after the time and commit within BENCHMARK_PATH
+    :return: The path the results were saved to
+    """
+    if path is None:
+        run_environment = results['environment']
+        commit = (run_environment['commit'] or 'unknown')[:10] + ('-dirty' if run_environment['dirty'] else '')
+        path = BENCHMARK_PATH.joinpath(f'{datetime.fromisoformat(run_environment["timestamp"]):%Y%m%d-%H%M%S}-{commit}.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    return path
+
+
+def flatten(results: dict, prefix: str = '') -> Dict[str, float]:
+    """
+    :return: Every numeric result, keyed by its path through the nested results, e.g. 'pipeline.pricing.priced_per_s'
+    """
+    flattened = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flattened.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flattened[f'{prefix}{key}'] = value
+    return flattened
+
+
+def compare(baseline: dict, results: dict):
+    """
+    Prints the ratio of each result to the same result within the baseline. Whether a higher ratio is better depends
+    on the unit of the result: rates (per second) should rise, while times and sizes should fall.
+    """
+    baseline_values, values = flatten(baseline['results']), flatten(results['results'])
+    print(f'--- compared against {baseline["environment"]["commit"]} ({baseline["environment"]["timestamp"]}) ---')
+    for key, value in values.items():
+        if key in baseline_values and baseline_values[key]:
+            print(f'{key:<64} {baseline_values[key]:14.4g} -> {value:14.4g}   ({value / baseline_values[key]:.2f}x)')
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Runs the benchmarks and saves their results to json')
+    parser.add_argument('benchmarks', nargs='*', help=f'the benchmarks to run, any of {", ".join(BENCHMARKS)}, defaults to all of them')
+    parser.add_argument('--output', type=Path, help=f'the file to save the results to, defaults to a new file within {BENCHMARK_PATH}')
+    parser.add_argument('--compare', type=Path, help='a results file of an earlier run to compare against')
+    arguments = parser.parse_args(arguments)
+    unknown = [name for name in arguments.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+
+    results = run_benchmarks(arguments.benchmarks or BENCHMARKS)
+    print(f'Saved results to {save_results(results, arguments.output)}')
+    if arguments.compare is not None:
+        with open(arguments.compare) as baseline_file:
+            compare(json.load(baseline_file), results)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,4 +3,26 @@ from pathlib import Path
 
 DATA_PATH = Path(__file__).parent
 
-PROPHECY_INFO = DATA_PATH.joinpath('CSV/ProphecyRecipes.csv')
\ No newline at end of file
+PROPHECY_INFO = DATA_PATH.joinpath('CSV/ProphecyRecipes.csv')
+
+VENDOR_RECIPE_INFO = DATA_PATH.joinpath('CSV/VendorRecipes.csv')
+
+CACHE_PATH = DATA_PATH.joinpath('Cache')
+
+ITEM_CATALOGUE_CACHE = CACHE_PATH.joinpath('items.bin')
+
+RATELIMIT_DATABASE = CACHE_PATH.joinpath('ratelimits.sqlite')
+
+EXCHANGE_RATE_CACHE = CACHE_PATH.joinpath('ExchangeRates')
+
+HISTORY_PATH = DATA_PATH.joinpath('History')
+
+LISTING_DATABASE = HISTORY_PATH.joinpath('listings.sqlite')
+
+PRICE_SKETCH_PATH = HISTORY_PATH.joinpath('PriceSketches')
+
+CHART_PATH = DATA_PATH.joinpath('Charts')
+
+BENCHMARK_PATH = DATA_PATH.joinpath('Benchmarks')
+
+METRICS_PATH = DATA_PATH.joinpath('Metrics')
@@ -1,5 +1,7 @@
-from Tools.API.POE import fetch_query_results
-from Tools.API.POE_Ninja import get_chaos_equivalent
+from POE.Trade.ListingStore import ListingStore
+from POE.Trade.Pricing import ExchangeRateTable
+from POE.Trade.Statistics import PriceSketches
+from Tools.API.POE import get_trade_client
 
 tabstral_query_json = '''
 {
@@ -85,30 +87,27 @@ beastsplit_query = '''
 }
 '''
 
-tabstral_data = fetch_query_results(tabstral_query_json, 10)
-beastsplit_data = fetch_query_results(beastsplit_query, 10)
+# the current challenge league, as reported by the trade API
+client = get_trade_client()
+tabstral_data = client.fetch_query_results(tabstral_query_json, 10)
+beastsplit_data = client.fetch_query_results(beastsplit_query, 10)
 
-tabstral_prices = []
-for item in tabstral_data:
-    currency_type = item['listing']['price']['currency']
-    currency_amount = item['listing']['price']['amount']
-    currency_value = get_chaos_equivalent(currency_type, 'Ritual') * currency_amount
-    tabstral_prices.append(currency_value)
+exchange_rates = ExchangeRateTable.for_league(client.league)
 
-    # print('Tabstral ', f'{currency_value}c', item['listing']['price'])
+# keep the listings, so that price trends can be analyzed later without refetching
+listing_store = ListingStore()
+listing_store.ingest(tabstral_data, client.league, exchange_rates)
+listing_store.ingest(beastsplit_data, client.league, exchange_rates)
 
-beastsplit_prices = []
-for item in beastsplit_data:
-    currency_type = item['listing']['price']['currency']
-    currency_amount = item['listing']['price']['amount']
-    currency_value = get_chaos_equivalent(currency_type, 'Ritual') * currency_amount
-    beastsplit_prices.append(currency_value)
+# medians over the runs of the last day, counting each listing once and filtering out troll listings and price fixers,
+# rather than a mean of this run's listings
+price_sketches = PriceSketches.for_league(client.league)
+price_sketches.add_listings('Tabstral', tabstral_data, exchange_rates)
+price_sketches.add_listings('Beastsplit', beastsplit_data, exchange_rates)
+price_sketches.save()
 
-    # print('Beastsplit ', f'{currency_value}c', item['listing']['price'])
+tabstral_summary, beastsplit_summary = price_sketches.summary('Tabstral'), price_sketches.summary('Beastsplit')
 
-tabstral_average_value = sum(tabstral_prices) / len(tabstral_prices)
-beastsplit_average_value = sum(beastsplit_prices) / len(beastsplit_prices)
-
-print('Avg Tabstral Price:', tabstral_average_value)
-print('Avg Beastsplit Price:', beastsplit_average_value)
-print('Avg Profit:', tabstral_average_value - beastsplit_average_value)
+print('Median Tabstral Price:', tabstral_summary.median, f'(p10 {tabstral_summary.percentiles[10]}, p90 {tabstral_summary.percentiles[90]})')
+print('Median Beastsplit Price:', beastsplit_summary.median, f'(p10 {beastsplit_summary.percentiles[10]}, p90 {beastsplit_summary.percentiles[90]})')
+print('Median Profit:', tabstral_summary.median - beastsplit_summary.median)
@@ -0,0 +1,246 @@
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+from Tools.API.POE import league_id
+from Tools.API.POE.Leagues import League
+from Tools.API.POE_Ninja import Currency, get_currency_exchange_rates
+
+# log weights within this of each other are treated as equal, so that rounding never reports a break even cycle as profitable
+WEIGHT_TOLERANCE = 1e-9
+
+
+@dataclass
+class ConversionPath(object):
+    codes: List[str]  # the trade ids of each currency converted through, in order, starting and ending with the same currency for cycles
+    rate: float  # the amount of the last currency received for one of the first
+
+    @property
+    def profit(self) -> float:
+        """
+        :return: The proportion gained by converting along the path, which is only meaningful for cycles
+        """
+        return self.rate - 1
+
+
+def exchange_rates(currencies: Mapping[str, Currency]) -> List[Tuple[str, str, float]]:
+    """
+    Lists the direct exchanges between currencies, keeping the buying and selling directions of every pair apart
+
+    :param currencies: A dict of {trade id: Currency}, as returned by get_currency_exchange_rates
+    :return: A list of (trade id sold, trade id bought, amount bought for one of the currency sold)
+    """
+    rates = []
+    for code, currency in currencies.items():
+        if code is None or code == 'chaos':
+            continue
+        if currency.pay_value:
+            rates.append((code, 'chaos', 1 / currency.pay_value))
+        if currency.receive_value:
+            rates.append(('chaos', code, 1 / currency.receive_value))
+    return rates
+
+
+class CurrencyGraph(object):
+    def __init__(self, currencies: Mapping[str, Currency]):
+        """
+        A dense graph of the exchange rates between every pair of currencies, indexed by trade id like ExchangeRateTable.
+        Each rate r is weighted by -log(r), so the rate of a path is the exponent of its negated total weight, the best
+        conversion between two currencies is the lightest path, and a negative cycle is a profitable chain of trades.
+
+        Best paths between every pair are computed by a Floyd-Warshall over the whole matrix, relaxing every pair
+        through one intermediate currency per step. When rates only improve, update relaxes just the changed exchanges
+        rather than repeating it.
+
+        :param currencies: A dict of {trade id: Currency}, as returned by get_currency_exchange_rates
+        """
+        self.codes: List[str] = []
+        self.indices: Dict[str, int] = {}
+        self.weights = np.empty((0, 0))  # -log of the direct rate from each row's currency to each column's, inf where there is none
+        self.currencies = None
+        self._distances = None
+        self._successors = None  # the index of the next currency on the best path from each row's currency to each column's, -1 where there is none
+        self.update(currencies)
+
+    @classmethod
+    def for_league(cls, league: Union[str, League] = None) -> 'CurrencyGraph':
+        """
+        :param league: The league to retrieve the rates of, defaults to the current challenge league
+        """
+        return cls(get_currency_exchange_rates(league_id(league)))
+
+    @property
+    def rates(self) -> np.ndarray:
+        """
+        :return: The direct rate from each row's currency to each column's, 0 where they are not exchanged directly
+        """
+        return np.exp(-self.weights)
+
+    def _weights(self, currencies: Mapping[str, Currency]) -> np.ndarray:
+        weights = np.full((len(self.codes), len(self.codes)), np.inf)
+        np.fill_diagonal(weights, 0)
+        for sold, bought, rate in exchange_rates(currencies):
+            if rate > 0 and sold in self.indices and bought in self.indices:
+                weights[self.indices[sold], self.indices[bought]] = -np.log(rate)
+        return weights
+
+    def update(self, currencies: Mapping[str, Currency]):
+        """
+        Replaces the exchange rates, recomputing only what changed. Exchanges whose rates improved are relaxed into the
+        existing best paths in O(n^2) each, while any rate which worsened, or a new currency, needs every path recomputed.
+
+        :param currencies: A dict of {trade id: Currency}, as returned by get_currency_exchange_rates
+        """
+        self.currencies = currencies
+        codes = [code for code in currencies.keys() if code is not None]
+        if codes != self.codes:
+            self.codes = codes
+            self.indices = {code: index for index, code in enumerate(codes)}
+            self.weights = self._weights(currencies)
+            self._compute_paths()
+            return
+
+        weights = self._weights(currencies)
+        changed = weights != self.weights
+        if not changed.any():
+            return
+        improved_only = (weights[changed] < self.weights[changed]).all()
+        self.weights = weights
+        if improved_only and not self._has_negative_cycle():
+            for sold, bought in zip(*np.nonzero(changed)):
+                self._relax(sold, bought)
+        else:
+            self._compute_paths()
+
+    def _compute_paths(self):
+        distances = self.weights.copy()
+        successors = np.where(np.isfinite(distances), np.arange(len(self.codes))[None, :], -1)
+        for via in range(len(self.codes)):
+            through = distances[:, via, None] + distances[None, via, :]
+            shorter = through < distances - WEIGHT_TOLERANCE
+            distances = np.where(shorter, through, distances)
+            successors = np.where(shorter, successors[:, via, None], successors)
+        self._distances = distances
+        self._successors = successors
+
+    def _relax(self, sold: int, bought: int):
+        # every path from i to j may now run i -> sold -> bought -> j
+        through = self._distances[:, sold, None] + self.weights[sold, bought] + self._distances[None, bought, :]
+        shorter = through < self._distances - WEIGHT_TOLERANCE
+        if not shorter.any():
+            return
+        first_steps = self._successors[:, sold].copy()
+        first_steps[sold] = bought
+        self._distances = np.where(shorter, through, self._distances)
+        self._successors = np.where(shorter, first_steps[:, None], self._successors)
+
+    def _has_negative_cycle(self) -> bool:
+        return bool((np.diagonal(self._distances) < -WEIGHT_TOLERANCE).any())
+
+    def _unbounded(self) -> np.ndarray:
+        # pairs whose best path could loop through a profitable cycle forever, and so have no best path
+        cycling = np.diagonal(self._distances) < -WEIGHT_TOLERANCE
+        if not cycling.any():
+            return np.zeros(self._distances.shape, dtype=bool)
+        reachable = np.isfinite(self._distances)
+        return reachable[:, cycling] @ reachable[cycling, :]
+
+    def rate(self, sold: str, bought: str) -> float:
+        """
+        :return: The amount of the bought currency received for one of the sold currency when exchanged directly, 0 where they are not
+        """
+        return float(np.exp(-self.weights[self.indices[sold], self.indices[bought]]))
+
+    def best_rates(self) -> np.ndarray:
+        """
+        :return: The best rate from each row's currency to each column's through any number of exchanges, 0 where
+                 there is no path, and NaN where the path could pass through a profitable cycle
+        """
+        with np.errstate(over='ignore'):
+            rates = np.exp(-self._distances)
+        rates[self._unbounded()] = np.nan
+        return rates
+
+    def best_path(self, sold: str, bought: str) -> Optional[ConversionPath]:
+        """
+        :param sold: The trade id of the currency held
+        :param bought: The trade id of the currency wanted
+        :return: The exchanges giving the most of the bought currency, or None if the currencies cannot be exchanged, or
+                 the path could pass through a profitable cycle, which profitable_cycles reports instead
+        """
+        start, end = self.indices[sold], self.indices[bought]
+        if self._successors[start, end] < 0 or self._unbounded()[start, end]:
+            return None
+        path = [start]
+        while path[-1] != end:
+            path.append(int(self._successors[path[-1], end]))
+        return self._path(path)
+
+    def _path(self, indices: List[int]) -> ConversionPath:
+        weight = sum(self.weights[current, following] for current, following in zip(indices, indices[1:]))
+        return ConversionPath(codes=[self.codes[index] for index in indices], rate=float(np.exp(-weight)))
+
+    def profitable_cycles(self, min_profit: float = 0) -> List[ConversionPath]:
+        """
+        Finds chains of exchanges returning more of a currency than they started with, by running Bellman-Ford from
+        every currency at once: each step relaxes every exchange as a single matrix reduction, and any currency still
+        improving after n steps has a negative cycle among its predecessors.
+
+        :param min_profit: The proportion a cycle must gain to be reported, e.g. 0.01 to ignore cycles gaining less than 1%
+        :return: The distinct cycles found, most profitable first
+        """
+        count = len(self.codes)
+        distances = np.zeros(count)
+        predecessors = np.full(count, -1)
+        improving = np.zeros(count, dtype=bool)
+        for _ in range(count):
+            through = distances[:, None] + self.weights
+            np.fill_diagonal(through, np.inf)
+            best = through.min(axis=0)
+            improving = best < distances - WEIGHT_TOLERANCE
+            if not improving.any():
+                return []
+            distances = np.where(improving, best, distances)
+            predecessors = np.where(improving, through.argmin(axis=0), predecessors)
+
+        cycles, seen = [], set()
+        for index in np.nonzero(improving)[0]:
+            # walking back n steps from a still improving currency always ends within its cycle
+            for _ in range(count):
+                index = predecessors[index]
+            cycle = [int(index)]
+            while cycle[-1] >= 0 and (len(cycle) == 1 or cycle[-1] != cycle[0]):
+                cycle.append(int(predecessors[cycle[-1]]))
+            if cycle[-1] < 0:
+                continue
+            cycle.reverse()
+            members = frozenset(cycle)
+            if members in seen:
+                continue
+            seen.add(members)
+            path = self._path(cycle)
+            if path.profit > min_profit:
+                cycles.append(path)
+        return sorted(cycles, key=lambda path: path.rate, reverse=True)
+
+
+_graphs: Dict[str, CurrencyGraph] = {}
+_graphs_lock = Lock()
+
+
+def get_currency_graph(league: Union[str, League] = None) -> CurrencyGraph:
+    """
+    Retrieves the currency graph of a league, updating it whenever the exchange rates of the league have been refreshed
+    :param league: The league to retrieve the graph of, defaults to the current challenge league
+    """
+    league = league_id(league)
+    currencies = get_currency_exchange_rates(league)
+    with _graphs_lock:
+        graph = _graphs.get(league)
+        if graph is None:
+            graph = _graphs[league] = CurrencyGraph(currencies)
+        elif graph.currencies is not currencies:
+            graph.update(currencies)
+        return graph
@@ -0,0 +1,177 @@
+# A local history of fetched listings, so that price trends can be analyzed without refetching
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from Data.Index import LISTING_DATABASE
+from POE.Trade.Pricing import ExchangeRateTable
+from Tools.API.POE import league_id
+from Tools.API.POE.Leagues import League
+from Tools.API.POE.Listings import Listing
+
+DEFAULT_BUCKET = timedelta(hours=1)
+
+# listings are never updated once stored, the covering index on (name, type, indexed, chaos_value) lets per-item
+# time range aggregates be answered from the index alone
+_schema = '''
+CREATE TABLE IF NOT EXISTS listings (
+    listing_id TEXT PRIMARY KEY,
+    league TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    ilvl INTEGER,
+    links INTEGER NOT NULL,
+    amount REAL,
+    currency TEXT,
+    chaos_value REAL,
+    indexed INTEGER NOT NULL,
+    seller TEXT,
+    fetched INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS listings_by_item ON listings (name, type, indexed, chaos_value);
+CREATE INDEX IF NOT EXISTS listings_by_time ON listings (indexed);
+'''
+
+_columns = ('listing_id', 'league', 'name', 'type', 'ilvl', 'links', 'amount', 'currency', 'chaos_value', 'indexed', 'seller', 'fetched')
+_insert = f'INSERT INTO listings ({", ".join(_columns)}) VALUES ({", ".join("?" * len(_columns))}) ON CONFLICT (listing_id) DO NOTHING'
+
+
+@dataclass
+class PricePoint(object):
+    start: float  # the unix timestamp at which the bucket starts
+    count: int
+    min: float
+    mean: float
+    max: float
+
+
+def _timestamp(value: Union[datetime, float, None]) -> Optional[float]:
+    return value.timestamp() if isinstance(value, datetime) else value
+
+
+def flatten_listing(listing: Listing, league: str, table: ExchangeRateTable, fetched: int) -> Tuple:
+    """
+    :param listing: A listing as returned by fetch_query_results
+    :param league: The league the listing was fetched from
+    :param table: The exchange rates used to value the price of the listing
+    :param fetched: The unix timestamp at which the listing was fetched
+    :return: The listing as a row of the listings table, with the columns in the order of _columns
+    """
+    index = table.indices.get(listing.currency, -1)
+    chaos_value = float(listing.amount * table.chaos_values[index]) if listing.amount is not None and index >= 0 else None
+    return (listing.id, league, listing.name, listing.type, listing.ilvl, listing.links, listing.amount, listing.currency, chaos_value, listing.indexed, listing.seller, fetched)
+
+
+class ListingStore(object):
+    def __init__(self, path: Union[str, Path] = LISTING_DATABASE):
+        """
+        An append only store of fetched listings, flattened into a single indexed SQLite table. Each listing is stored
+        once, the first time it is ingested, with its price valued in chaos at the exchange rates of the time.
+
+        :param path: The path of the database file
+        """
+        self.path = Path(path)
+        self._connections = threading.local()  # sqlite connections may only be used by the thread which created them
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection.executescript(_schema)
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._connections.connection = connection
+        return connection
+
+    def ingest(self, listings: Iterable[Optional[Listing]], league: Union[str, League] = None, table: ExchangeRateTable = None) -> int:
+        """
+        Stores fetched listings, skipping those which are already stored
+        :param listings: Listings as returned by fetch_query_results, missing (None) listings are skipped
+        :param league: The league the listings were fetched from, defaults to the current challenge league
+        :param table: The exchange rates to value prices with, defaults to the current rates of the league
+        :return: The number of newly stored listings
+        """
+        league = league_id(league)
+        table = ExchangeRateTable.for_league(league) if table is None else table
+        fetched = int(time())
+        rows = [flatten_listing(listing, league, table, fetched) for listing in listings if listing is not None]
+
+        connection = self._connection
+        changes = connection.total_changes
+        connection.execute('BEGIN')
+        try:
+            connection.executemany(_insert, rows)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return connection.total_changes - changes
+
+    @staticmethod
+    def _filters(name: str = None, type: str = None, start: Union[datetime, float] = None, end: Union[datetime, float] = None, league: str = None) -> Tuple[str, list]:
+        # builds a where clause over the indexed columns, with the time range inclusive of start and exclusive of end
+        clauses, parameters = ['chaos_value IS NOT NULL'], []
+        for clause, value in (('name = ?', name), ('type = ?', type), ('indexed >= ?', _timestamp(start)), ('indexed < ?', _timestamp(end)), ('league = ?', league)):
+            if value is not None:
+                clauses.append(clause)
+                parameters.append(value)
+        return ' AND '.join(clauses), parameters
+
+    def prices(self, name: str = None, type: str = None, start: Union[datetime, float] = None, end: Union[datetime, float] = None, league: str = None) -> np.ndarray:
+        """
+        :param name: The name of the items, e.g. 'Tabula Rasa'
+        :param type: The type of the items, e.g. 'Simple Robe'
+        :param start: The earliest time the listings were indexed, as a datetime or unix timestamp
+        :param end: The time before which the listings were indexed, as a datetime or unix timestamp
+        :param league: The league the listings were fetched from
+        :return: The chaos value of every matching priced listing, ready to be passed to summarize_prices
+        """
+        where, parameters = self._filters(name, type, start, end, league)
+        rows = self._connection.execute(f'SELECT chaos_value FROM listings WHERE {where}', parameters).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+
+    def price_history(self, name: str, type: str = None, start: Union[datetime, float] = None, end: Union[datetime, float] = None,
+                      bucket: timedelta = DEFAULT_BUCKET, league: str = None) -> List[PricePoint]:
+        """
+        Aggregates the prices of an item over time
+        :param name: The name of the item
+        :param type: The type of the item
+        :param start: The earliest time the listings were indexed, as a datetime or unix timestamp
+        :param end: The time before which the listings were indexed, as a datetime or unix timestamp
+        :param bucket: The period each point aggregates the listings indexed within
+        :param league: The league the listings were fetched from
+        :return: A point for each period with at least one priced listing, in chronological order
+        """
+        where, parameters = self._filters(name, type, start, end, league)
+        seconds = max(int(bucket.total_seconds()), 1)
+        rows = self._connection.execute(f'SELECT indexed / ? * ? AS bucket, count(*), min(chaos_value), avg(chaos_value), max(chaos_value) '
+                                        f'FROM listings WHERE {where} GROUP BY bucket ORDER BY bucket', [seconds, seconds, *parameters])
+        return [PricePoint(*row) for row in rows]
+
+    def item_summaries(self, start: Union[datetime, float] = None, end: Union[datetime, float] = None, league: str = None) -> Dict[Tuple[str, str], PricePoint]:
+        """
+        Aggregates the prices of every stored item
+        :param start: The earliest time the listings were indexed, as a datetime or unix timestamp
+        :param end: The time before which the listings were indexed, as a datetime or unix timestamp
+        :param league: The league the listings were fetched from
+        :return: A dict of {(name, type): PricePoint}, each point starting at the earliest listing of the item
+        """
+        where, parameters = self._filters(start=start, end=end, league=league)
+        rows = self._connection.execute(f'SELECT name, type, min(indexed), count(*), min(chaos_value), avg(chaos_value), max(chaos_value) '
+                                        f'FROM listings WHERE {where} GROUP BY name, type', parameters)
+        return {(name, type): PricePoint(*aggregates) for name, type, *aggregates in rows}
+
+    def __len__(self):
+        return self._connection.execute('SELECT count(*) FROM listings').fetchone()[0]
+
+    def __str__(self):
+        return f"ListingStore(Path: {self.path}, Listings: {len(self)})"
@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from Tools.API.POE import league_id
+from Tools.API.POE.Leagues import League
+from Tools.API.POE.Listings import Listing
+from Tools.API.POE_Ninja import Currency, get_currency_exchange_rates
+
+DEFAULT_TRIM = 0.1  # the proportion of listings cut from each end of the price range for trimmed means
+DEFAULT_PERCENTILES = (10, 25, 75, 90)
+
+
+class ExchangeRateTable(object):
+    def __init__(self, currencies: Mapping[str, Currency]):
+        """
+        An array backed table of exchange rates, indexed by position rather than by currency name, so that whole
+        batches of listings can be converted to chaos at once
+
+        :param currencies: A dict of {trade id: Currency}, as returned by get_currency_exchange_rates
+        """
+        self.codes = [code for code in currencies.keys() if code is not None]
+        self.indices = {code: index for index, code in enumerate(self.codes)}
+        self.chaos_values = np.array([currencies[code].chaos_value for code in self.codes], dtype=np.float64)
+
+    @classmethod
+    def for_league(cls, league: Union[str, League] = None) -> 'ExchangeRateTable':
+        """
+        :param league: The league to retrieve the rates of, defaults to the current challenge league
+        """
+        return cls(get_currency_exchange_rates(league_id(league)))
+
+    def code_indices(self, codes: Iterable[str]) -> np.ndarray:
+        """
+        :param codes: Trade API currency ids, such as 'chaos' or 'exalted'
+        :return: The index of each currency within the table, or -1 for currencies missing from the table
+        """
+        return np.array([self.indices.get(code, -1) for code in codes], dtype=np.int32)
+
+    def to_chaos(self, amounts: np.ndarray, code_indices: np.ndarray) -> np.ndarray:
+        """
+        :param amounts: The amount of currency of each price
+        :param code_indices: The table index of the currency of each price
+        :return: The chaos value of each price, NaN where the currency is missing from the table
+        """
+        values = amounts * self.chaos_values[code_indices]
+        values[code_indices < 0] = np.nan
+        return values
+
+
+def listings_to_arrays(listings: Iterable[Optional[Listing]], table: ExchangeRateTable) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Extracts the prices of listings returned by the trade API, skipping listings without a price
+
+    :param listings: Listings as returned by fetch_query_results
+    :param table: The table used to index each currency
+    :return: (amounts, code_indices): The amount and currency table index of each priced listing
+    """
+    priced = [listing for listing in listings if listing is not None and listing.priced]
+    amounts = np.fromiter((listing.amount for listing in priced), dtype=np.float64, count=len(priced))
+    return amounts, table.code_indices(listing.currency for listing in priced)
+
+
+def price_listings(listings: Iterable[Optional[Listing]], table: ExchangeRateTable = None) -> np.ndarray:
+    """
+    :param listings: Listings as returned by fetch_query_results
+    :param table: The exchange rates to price with, defaults to the current rates of the trade league
+    :return: The chaos value of each priced listing, with listings priced in unknown currencies removed
+    """
+    table = ExchangeRateTable.for_league() if table is None else table
+    chaos_values = table.to_chaos(*listings_to_arrays(listings, table))
+    return chaos_values[~np.isnan(chaos_values)]
+
+
+@dataclass
+class PriceSummary(object):
+    count: int
+    mean: float
+    median: float
+    trimmed_mean: float
+    percentiles: Dict[int, float]
+
+
+def summarize_prices(price_groups: Sequence[np.ndarray], trim: float = DEFAULT_TRIM, percentiles: Sequence[int] = DEFAULT_PERCENTILES) -> List[PriceSummary]:
+    """
+    Summarizes several groups of prices at once, by padding them into a single matrix and reducing along its rows
+
+    :param price_groups: The chaos values of each group of listings, e.g. one group per item
+    :param trim: The proportion of prices removed from each end of every group before taking the trimmed mean
+    :param percentiles: The percentiles to compute for each group
+    :return: A summary of each group, in the order given. Statistics of empty groups are NaN
+    """
+    counts = np.array([len(group) for group in price_groups], dtype=np.int64)
+    matrix = np.full((len(price_groups), max(counts.max(initial=0), 1)), np.nan)
+    for row, group in enumerate(price_groups):
+        matrix[row, :len(group)] = group
+
+    # NaN padding sorts to the end of each row, leaving each group's prices in the first count columns
+    matrix.sort(axis=1)
+    empty = counts == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(matrix, axis=1) / counts
+        columns = np.arange(matrix.shape[1])
+        trimmed_counts = np.floor(counts * trim).astype(np.int64)
+        kept = (columns >= trimmed_counts[:, None]) & (columns < (counts - trimmed_counts)[:, None])
+        trimmed_means = np.where(kept, matrix, 0).sum(axis=1) / kept.sum(axis=1)
+    quantiles = np.full((len(price_groups), len(percentiles) + 1), np.nan)
+    if not empty.all():
+        quantiles[~empty] = np.nanpercentile(matrix[~empty], [50, *percentiles], axis=1).T
+    means[empty] = np.nan
+
+    return [PriceSummary(count=int(counts[row]), mean=float(means[row]), median=float(quantiles[row, 0]), trimmed_mean=float(trimmed_means[row]),
+                         percentiles={percentile: float(quantiles[row, column + 1]) for column, percentile in enumerate(percentiles)})
+            for row in range(len(price_groups))]
+
+
+def summarize_listings(listing_groups: Mapping[str, Iterable[Optional[Listing]]], table: ExchangeRateTable = None, trim: float = DEFAULT_TRIM, percentiles: Sequence[int] = DEFAULT_PERCENTILES) -> Dict[str, PriceSummary]:
+    """
+    Prices and summarizes the listings of several items
+
+    :param listing_groups: A dict of {item name: listings}
+    :param table: The exchange rates to price with, defaults to the current rates of the trade league
+    :param trim: The proportion of prices removed from each end of every group before taking the trimmed mean
+    :param percentiles: The percentiles to compute for each group
+    :return: A dict of {item name: PriceSummary}
+    """
+    table = ExchangeRateTable.for_league() if table is None else table
+    names = list(listing_groups.keys())
+    summaries = summarize_prices([price_listings(listing_groups[name], table) for name in names], trim=trim, percentiles=percentiles)
+    return dict(zip(names, summaries))
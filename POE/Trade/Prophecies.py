@@ -2,17 +2,15 @@ import csv
 
 from Data.Index import PROPHECY_INFO
 from Tools import Wrapper
-from Tools.API.POE import get_first_page_data
-from Tools.API.POE.Items import Item, CATEGORIZED_ITEMS, ITEMS_BY_NAME
+from Tools.API.POE.Items import Item, get_item_catalogue
+
+PROPHECY_CATEGORY = 'Prophecies'
 
 
 class Prophecy(Wrapper):
     __wraps__ = Item
 
 
-_prophecies = {item.name: Prophecy(item) for item in CATEGORIZED_ITEMS['Prophecies']}
-
-
 class UpgradeProphecy(Wrapper):
     __wraps__ = Prophecy
 
@@ -20,64 +18,40 @@ class UpgradeProphecy(Wrapper):
         super().__init__(prophecy)
         self.base_unique = base_unique
         self.result_unique = result_unique
-        self._value = None
 
     def __str__(self):
         return f'[{self.name}]: {self.base_unique.name} -> {self.result_unique.name}'
 
 
-    # FOR PULLING PROPHECY VALUE FROM POE TRADE API
-    # @property
-    # def value(self):
-    #     if self._value is not None:
-    #         return self._value
-    #     prophecy_query = {
-    #         "query": {
-    #             "status": {
-    #                 "option": "online"
-    #             },
-    #             "name": self.name,
-    #             "type": "Prophecy",
-    #             "stats": [
-    #                 {
-    #                     "type": "and",
-    #                     "filters": []
-    #                 }
-    #             ],
-    #             "filters": {
-    #                 "trade_filters": {
-    #                     "filters": {
-    #                         "indexed": {
-    #                             "option": "1day"
-    #                         }
-    #                     }
-    #                 },
-    #                 "type_filters": {
-    #                     "filters": {
-    #                         "category": {
-    #                             "option": "prophecy"
-    #                         }
-    #                     }
-    #                 }
-    #             }
-    #         },
-    #         "sort": {
-    #             "price": "asc"
-    #         }
-    #     }
-    #     trade_data = get_first_page_data(query_json=prophecy_query)
-    #     for trade in trade_data['result']:
-    #         print(trade['listing']['price'])
-
-
 def _load_upgrade_prophecy_csv():
-    global _prophecies
+    # names are resolved through the catalogue's search index, prophecies within the prophecy category and uniques by
+    # their names, so a misspelling in the csv is only corrected to an item of the right kind, with a logged warning.
+    # Names which are ambiguous or too far from any item raise an UnknownItemException suggesting the closest names
+    catalogue = get_item_catalogue()
     with open(PROPHECY_INFO, 'r') as prophecy_file:
         reader = csv.reader(prophecy_file)
-        prophecies = [UpgradeProphecy(prophecy=_prophecies[prophecy], base_unique=ITEMS_BY_NAME[base], result_unique=ITEMS_BY_NAME[result]) for prophecy, base, result in reader]
+        prophecies = [UpgradeProphecy(prophecy=Prophecy(catalogue.resolve(prophecy, category=PROPHECY_CATEGORY)),
+                                      base_unique=catalogue.resolve(base, fields=('name',)), result_unique=catalogue.resolve(result, fields=('name',)))
+                      for prophecy, base, result in reader]
     return prophecies
 
 
-UPGRADE_PROPHECIES = _load_upgrade_prophecy_csv()
+_upgrade_prophecies = None
+
+
+def get_upgrade_prophecies():
+    """
+    Retrieves the upgrade prophecies, resolving them against the item catalogue the first time they are requested
+    :return: A list of upgrade prophecies, each with the unique it upgrades and the unique it results in
+    """
+    global _upgrade_prophecies
+    if _upgrade_prophecies is None:
+        _upgrade_prophecies = _load_upgrade_prophecy_csv()
+    return _upgrade_prophecies
+
 
-print(UPGRADE_PROPHECIES[0].value)
+def __getattr__(name):
+    # the prophecies are resolved on first access, rather than on import, as resolving them may download the item catalogue
+    if name == 'UPGRADE_PROPHECIES':
+        return get_upgrade_prophecies()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,109 @@
+import csv
+from dataclasses import dataclass, field
+from itertools import zip_longest
+from typing import FrozenSet, List, Optional, Tuple
+
+from Data.Index import PROPHECY_INFO, VENDOR_RECIPE_INFO
+from Tools.API.POE.Items import ItemCatalogue
+
+PROPHECY_FLAG = 'Prophecy'
+CURRENCY_FLAG = 'Currency'
+
+# flags which can be expressed as trade query filters, formatted as {flag: (filter group, filter name, option)}
+_query_flags = {
+    'Not Corrupted': ('misc_filters', 'corrupted', 'false'),
+    'Shaped': ('misc_filters', 'shaper_item', 'true'),
+    'Elder': ('misc_filters', 'elder_item', 'true'),
+}
+SUPPORTED_FLAGS = frozenset([PROPHECY_FLAG, CURRENCY_FLAG, *_query_flags.keys()])
+
+
+def _parse_flags(flags: Optional[str]) -> FrozenSet[str]:
+    return frozenset(flag.strip() for flag in (flags or '').split(',') if flag.strip())
+
+
+@dataclass(frozen=True)
+class RecipeItem(object):
+    name: str
+    flags: FrozenSet[str] = field(default=frozenset())
+
+    @property
+    def is_currency(self) -> bool:
+        return CURRENCY_FLAG in self.flags
+
+    @property
+    def supported(self) -> bool:
+        return self.flags <= SUPPORTED_FLAGS
+
+    def query(self, catalogue: ItemCatalogue = None) -> dict:
+        """
+        Builds a trade search for the cheapest listings of this item
+        :param catalogue: The item catalogue, used to find the base type of named items
+        :return: The search parameters
+        """
+        query = {
+            'query': {
+                'status': {'option': 'online'},
+                'stats': [{'type': 'and', 'filters': []}],
+            },
+            'sort': {'price': 'asc'},
+        }
+
+        item = catalogue.by_name(self.name) if catalogue is not None else None
+        if PROPHECY_FLAG in self.flags:
+            query['query'].update(name=self.name, type='Prophecy')
+        elif item is not None:
+            query['query'].update(name=item.name, type=item.type)
+        else:
+            query['query']['type'] = self.name  # base types, gems and currency are searched by type
+
+        for flag in sorted(self.flags & _query_flags.keys()):
+            group, name, option = _query_flags[flag]
+            query['query'].setdefault('filters', {}).setdefault(group, {'filters': {}})['filters'][name] = {'option': option}
+        return query
+
+    def __str__(self):
+        return f'{self.name} ({", ".join(sorted(self.flags))})' if self.flags else self.name
+
+
+@dataclass(frozen=True)
+class Recipe(object):
+    result: RecipeItem
+    inputs: Tuple[RecipeItem, ...]
+
+    @property
+    def supported(self) -> bool:
+        return self.result.supported and all(recipe_input.supported for recipe_input in self.inputs)
+
+    @property
+    def items(self) -> Tuple[RecipeItem, ...]:
+        return (self.result, *self.inputs)
+
+    def __str__(self):
+        return f'{" + ".join(str(recipe_input) for recipe_input in self.inputs)} -> {self.result}'
+
+
+def load_prophecy_recipes(path=PROPHECY_INFO) -> List[Recipe]:
+    """
+    Loads upgrade prophecies, which turn a base unique into a result unique when the prophecy is sealed and completed
+    :param path: The path of a csv, with rows formatted as: prophecy, base unique, result unique
+    :return: A list of recipes
+    """
+    with open(path, 'r') as recipe_file:
+        return [Recipe(result=RecipeItem(result), inputs=(RecipeItem(prophecy, frozenset([PROPHECY_FLAG])), RecipeItem(base))) for prophecy, base, result in csv.reader(recipe_file)]
+
+
+def load_vendor_recipes(path=VENDOR_RECIPE_INFO) -> List[Recipe]:
+    """
+    Loads vendor recipes. Recipes with flags that cannot be expressed as a trade search, such as quantities, are
+    included but marked as unsupported.
+    :param path: The path of a csv, with rows formatted as: result, result flags, followed by an input and its flags for each input
+    :return: A list of recipes
+    """
+    recipes = []
+    with open(path, 'r') as recipe_file:
+        for row in csv.reader(recipe_file):
+            result, result_flags, *input_columns = row
+            inputs = tuple(RecipeItem(name, _parse_flags(flags)) for name, flags in zip_longest(input_columns[::2], input_columns[1::2]) if name)
+            recipes.append(Recipe(result=RecipeItem(result, _parse_flags(result_flags)), inputs=inputs))
+    return recipes
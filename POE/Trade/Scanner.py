@@ -0,0 +1,126 @@
+import logging
+from collections import Counter
+from concurrent.futures import Future
+from dataclasses import dataclass
+from math import isnan, nan
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+
+from POE.Trade.Pricing import ExchangeRateTable, PriceSummary, price_listings, summarize_prices
+from POE.Trade.Recipes import Recipe, RecipeItem
+from Tools.API.POE import BACKGROUND_PRIORITY, MAX_LISTINGS_PER_REQUEST, get_trade_client, schedule_league_query_results
+from Tools.API.POE.Leagues import League
+from Tools.API.POE.Items import get_item_catalogue
+from Tools.API.POE_Ninja import get_currency_exchange_rates
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RecipeProfit(object):
+    recipe: Recipe
+    cost: float  # the chaos value of all inputs
+    value: float  # the chaos value of the result
+    unpriced: List[RecipeItem]  # items for which no listing could be priced
+
+    @property
+    def profit(self) -> float:
+        return self.value - self.cost
+
+
+def _scan_order(recipes: Iterable[Recipe]) -> List[RecipeItem]:
+    # every distinct item is searched once, with items shared by the most recipes first, so that an interrupted or
+    # partially failed scan has priced as many complete recipes as possible
+    usage = Counter(item for recipe in recipes for item in set(recipe.items))
+    return sorted(usage.keys(), key=lambda item: -usage[item])
+
+
+def _search_prices(search: Future, table: ExchangeRateTable, description: str) -> np.ndarray:
+    # a failed search is logged and priced as having no listings, rather than failing every other search of the scan
+    try:
+        return price_listings(search.result(), table)
+    except Exception:
+        logger.exception('Search for %s failed, leaving it unpriced', description)
+        return np.empty(0)
+
+
+def price_recipe_items(recipes: Iterable[Recipe], listings_per_item: int = MAX_LISTINGS_PER_REQUEST, priority: int = BACKGROUND_PRIORITY, league: Union[str, League] = None) -> Dict[RecipeItem, float]:
+    """
+    Prices every distinct item used by the recipes, at the median of its cheapest listings. Currency is priced from
+    poe.ninja exchange rates, and every other item costs one search and one fetch, queued on the trade scheduler.
+
+    :param recipes: The recipes to price the items of
+    :param listings_per_item: The number of cheapest listings to price each item from, at most one fetch worth by default
+    :param priority: The priority the searches are queued with
+    :param league: The league to price the items in, defaults to the current challenge league
+    :return: A dict of {item: chaos value}, NaN for items without any priced listing, or whose search failed
+    """
+    recipes = [recipe for recipe in recipes if recipe.supported]
+    client = get_trade_client(league)
+    exchange_rates = get_currency_exchange_rates(client.league)
+    currency_values = {currency.name: currency.chaos_value for currency in exchange_rates.values()}
+    table = ExchangeRateTable(exchange_rates)
+    catalogue = get_item_catalogue()
+
+    prices = {}
+    traded_items = []
+    for item in _scan_order(recipes):
+        if item.is_currency or item.name in currency_values:
+            prices[item] = currency_values.get(item.name, nan)
+        else:
+            traded_items.append(item)
+
+    # searches are queued at background priority, so that interactive lookups are not stuck behind the scan. Queued
+    # searches of equal priority start in submission order, which follows the scan priority
+    searches = [client.schedule_query_results(item.query(catalogue), listings_per_item, priority=priority) for item in traded_items]
+    summaries = summarize_prices([_search_prices(search, table, item.name) for item, search in zip(traded_items, searches)])
+
+    for item, summary in zip(traded_items, summaries):
+        prices[item] = summary.median
+    return prices
+
+
+def scan_recipes(recipes: Iterable[Recipe], listings_per_item: int = MAX_LISTINGS_PER_REQUEST, priority: int = BACKGROUND_PRIORITY, league: Union[str, League] = None) -> List[RecipeProfit]:
+    """
+    Prices every supported recipe, ranking them by profit
+    :param recipes: The recipes to scan
+    :param listings_per_item: The number of cheapest listings to price each item from
+    :param priority: The priority the searches are queued with
+    :param league: The league to scan, defaults to the current challenge league
+    :return: The profit of each supported recipe, from most to least profitable, with recipes missing prices last
+    """
+    recipes = [recipe for recipe in recipes if recipe.supported]
+    prices = price_recipe_items(recipes, listings_per_item=listings_per_item, priority=priority, league=league)
+
+    profits = []
+    for recipe in recipes:
+        cost = sum(prices[item] for item in recipe.inputs)
+        unpriced = [item for item in recipe.items if isnan(prices[item])]
+        profits.append(RecipeProfit(recipe=recipe, cost=cost, value=prices[recipe.result], unpriced=unpriced))
+
+    return sorted(profits, key=lambda profit: (bool(profit.unpriced), -profit.profit if not profit.unpriced else 0))
+
+
+def compare_league_prices(query_json, leagues: Iterable[Union[str, League]] = None, listings: int = MAX_LISTINGS_PER_REQUEST, priority: int = BACKGROUND_PRIORITY) -> Dict[str, PriceSummary]:
+    """
+    Prices the same search in several leagues within one scan, each in chaos at the exchange rates of its own league
+    :param query_json: The search parameters, typically sorted by price
+    :param leagues: The leagues to compare, defaults to every active league
+    :param listings: The number of listings to price the search from in each league
+    :param priority: The priority the searches are queued with
+    :return: A dict of {league id: PriceSummary}, in the order the leagues were given, with NaN statistics for leagues whose search failed
+    """
+    searches = schedule_league_query_results(query_json, leagues, listings, priority=priority)
+    prices = [_search_prices(search, ExchangeRateTable.for_league(league), f'league {league}') for league, search in searches.items()]
+    return dict(zip(searches.keys(), summarize_prices(prices)))
+
+
+def format_profit_table(profits: Iterable[RecipeProfit]) -> str:
+    lines = [f'{"Profit":>10} {"Cost":>10} {"Value":>10}  Recipe']
+    for profit in profits:
+        line = f'{profit.profit:>10.1f} {profit.cost:>10.1f} {profit.value:>10.1f}  {profit.recipe}'
+        if profit.unpriced:
+            line += f'  [unpriced: {", ".join(str(item) for item in profit.unpriced)}]'
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,412 @@
+# Price statistics kept in bounded memory per item, built up from every scan rather than from a single fetch, so that
+# troll listings and price fixers can be filtered against the recent prices of the item
+import json
+import os
+import random
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote
+
+import numpy as np
+
+from Data.Index import PRICE_SKETCH_PATH
+from POE.Trade.Pricing import DEFAULT_PERCENTILES, ExchangeRateTable, price_listings
+from Tools.API.POE import league_id
+from Tools.API.POE.Leagues import League
+from Tools.API.POE.Listings import Listing
+
+DEFAULT_K = 200  # the capacity of a sketch's top level, quantiles are within about 1.7 / k of their true rank
+CAPACITY_DECAY = 2 / 3  # the capacity of each level relative to the level above it
+MIN_CAPACITY = 2
+
+DEFAULT_FENCE = 1.5  # Tukey's fences, applied to log prices as prices vary by ratios rather than differences
+MIN_LOG_SPREAD = np.log(1.25)  # the narrowest interquartile range fences are placed around, so identical prices do not reject every other price
+
+DEFAULT_WINDOW = timedelta(hours=1)
+DEFAULT_RECENT = timedelta(days=1)  # prices are filtered against, and summarized over, the windows within this age
+DEFAULT_RETENTION = timedelta(days=30)
+MAX_SEEN_IDS = 10_000  # the trade ids remembered per item, to add each listing once
+
+
+class KLLSketch(object):
+    def __init__(self, k: int = DEFAULT_K):
+        """
+        A KLL quantile sketch: a stack of levels, each holding values standing for 2^level of the values added. When a
+        level outgrows its capacity it is sorted and every other value is promoted to the level above, starting from a
+        random offset, so memory grows with log(count) while every quantile stays within a bounded rank error.
+        Sketches of the same values split across processes can be merged into one with the same guarantee.
+
+        :param k: The capacity of the top level, trading memory for accuracy
+        """
+        self.k = k
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _capacity(self, level: int) -> int:
+        return max(int(np.ceil(self.k * CAPACITY_DECAY ** (len(self.levels) - level - 1))), MIN_CAPACITY)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                values = np.sort(self.levels[level])
+                # an odd value out stays behind, so that every promoted value stands for exactly two
+                kept, paired = values[:len(values) % 2], values[len(values) % 2:]
+                self.levels[level] = kept
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], paired[random.getrandbits(1)::2]))
+            level += 1
+
+    def update(self, values: Union[float, Iterable[float], np.ndarray]):
+        """
+        :param values: One or more values to add, NaN values are ignored
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compress()
+
+    def merge(self, other: 'KLLSketch'):
+        """
+        Adds every value added to another sketch, as if they had been added to this one
+        """
+        self.k = min(self.k, other.k)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, values in enumerate(other.levels):
+            self.levels[level] = np.concatenate((self.levels[level], values))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def copy(self) -> 'KLLSketch':
+        sketch = KLLSketch(self.k)
+        sketch.levels = list(self.levels)  # levels are replaced rather than written into, so they can be shared
+        sketch.count, sketch.min, sketch.max = self.count, self.min, self.max
+        return sketch
+
+    def _weighted_values(self) -> Tuple[np.ndarray, np.ndarray]:
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_values), 2 ** level, dtype=np.int64) for level, level_values in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
+
+    def quantiles(self, quantiles: Union[float, Sequence[float]]) -> np.ndarray:
+        """
+        :param quantiles: One or more quantiles between 0 and 1, e.g. 0.5 for the median
+        :return: The estimated value at each quantile, NaN if no values have been added
+        """
+        quantiles = np.asarray(quantiles, dtype=np.float64)
+        if not self.count:
+            return np.full(quantiles.shape, np.nan)
+        values, cumulative_weights = self._weighted_values()
+        indices = np.searchsorted(cumulative_weights, quantiles * self.count, side='left')
+        estimates = values[np.minimum(indices, len(values) - 1)]
+        # the extremes are tracked exactly
+        return np.where(quantiles <= 0, self.min, np.where(quantiles >= 1, self.max, estimates))
+
+    def rank(self, value: float) -> float:
+        """
+        :return: The estimated proportion of the values added which are at most the value
+        """
+        if not self.count:
+            return np.nan
+        values, cumulative_weights = self._weighted_values()
+        index = np.searchsorted(values, value, side='right')
+        return float(cumulative_weights[index - 1]) / self.count if index else 0.0
+
+    def __len__(self):
+        """
+        :return: The number of values held, rather than the number added
+        """
+        return sum(len(values) for values in self.levels)
+
+    def to_json(self) -> dict:
+        return {'k': self.k, 'count': self.count, 'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'levels': [values.tolist() for values in self.levels]}
+
+    @classmethod
+    def from_json(cls, sketch_json: dict) -> 'KLLSketch':
+        sketch = cls(sketch_json['k'])
+        sketch.levels = [np.array(values, dtype=np.float64) for values in sketch_json['levels']] or [np.empty(0)]
+        sketch.count = sketch_json['count']
+        if sketch.count:
+            sketch.min, sketch.max = sketch_json['min'], sketch_json['max']
+        return sketch
+
+
+class OutlierFilter(object):
+    def __init__(self, fence: float = DEFAULT_FENCE, min_spread: float = MIN_LOG_SPREAD):
+        """
+        Rejects prices outside Tukey's fences of the log prices seen recently, together with the prices being added, so
+        that the first batch of an item is filtered against itself. Bait listings priced far below an item's worth, and
+        listings priced far above it which no one buys, both fall outside the fences.
+
+        :param fence: The number of interquartile ranges beyond the quartiles at which prices are rejected
+        :param min_spread: The narrowest interquartile range of log prices fences are placed around
+        """
+        self.fence = fence
+        self.min_spread = min_spread
+
+    def bounds(self, sketch: KLLSketch, prices: np.ndarray) -> Tuple[float, float]:
+        """
+        :param sketch: The prices seen recently
+        :param prices: The prices being added
+        :return: (low, high): The lowest and highest prices accepted
+        """
+        reference = sketch.copy()
+        reference.update(prices[prices > 0])
+        if not reference.count:
+            return np.inf, -np.inf
+        lower_quartile, upper_quartile = np.log(reference.quantiles([0.25, 0.75]))
+        spread = max(upper_quartile - lower_quartile, self.min_spread)
+        return float(np.exp(lower_quartile - self.fence * spread)), float(np.exp(upper_quartile + self.fence * spread))
+
+    def accepted(self, sketch: KLLSketch, prices: np.ndarray) -> np.ndarray:
+        """
+        :return: A mask of the prices accepted, never accepting prices which are not positive
+        """
+        low, high = self.bounds(sketch, prices)
+        return (prices > 0) & (prices >= low) & (prices <= high)
+
+
+@dataclass
+class SketchSummary(object):
+    count: int  # the number of prices accepted into the windows summarized
+    rejected: int  # the number of prices rejected as outliers within the windows summarized
+    median: float
+    percentiles: Dict[int, float]
+
+
+class _ItemPrices(object):
+    def __init__(self):
+        self.windows: Dict[int, KLLSketch] = {}  # to be formatted as {window start unix timestamp: sketch of the prices accepted within it}
+        # to be formatted as {window start unix timestamp: sketch of every price seen within it, accepted or not}. Outliers
+        # are filtered against these, so a price move rejected at first is accepted once it is most of what is listed
+        self.observed: Dict[int, KLLSketch] = {}
+        # to be formatted as {trade id: (unix timestamp added, amount, currency)}, from least to most recently added
+        self.seen: 'OrderedDict[str, Tuple[float, Optional[float], Optional[str]]]' = OrderedDict()
+
+
+class PriceSketches(object):
+    def __init__(self, path: Union[str, Path] = None, k: int = DEFAULT_K, outlier_filter: OutlierFilter = None, window: timedelta = DEFAULT_WINDOW,
+                 recent: timedelta = DEFAULT_RECENT, retention: timedelta = DEFAULT_RETENTION, league: Union[str, League] = None):
+        """
+        Quantile sketches of the chaos prices of each item, fed incrementally with every fetch and filtered for
+        outliers as they are fed. Prices are sketched per time window, so statistics describe recent prices rather
+        than every price ever seen, and old windows are dropped, keeping each item to a few kilobytes per window.
+        Listings are added once per price, however many scans they are still listed for. Sketches filled by separate
+        processes can be merged, and are saved to and loaded from JSON between runs.
+
+        :param path: The file the sketches are loaded from if it exists, and saved to
+        :param k: The capacity of each new sketch, see KLLSketch
+        :param outlier_filter: The filter prices pass before being added, defaults to OutlierFilter()
+        :param window: The length of time each sketch holds the prices of
+        :param recent: The age of the windows which prices are filtered against and summaries are taken over by default
+        :param retention: The age after which windows, and the trade ids added within them, are dropped
+        :param league: The league the prices are from, whose exchange rates listings are priced with, defaults to the current challenge league
+        """
+        self.path = Path(path) if path is not None else None
+        self.k = k
+        self.outlier_filter = OutlierFilter() if outlier_filter is None else outlier_filter
+        self.window = window.total_seconds()
+        self.recent = recent.total_seconds()
+        self.retention = retention.total_seconds()
+        self.league = league_id(league) if league is not None else None
+        self.items: Dict[str, _ItemPrices] = {}
+        self._lock = Lock()
+        if self.path is not None and self.path.exists():
+            self.load(self.path)
+
+    @classmethod
+    def for_league(cls, league: Union[str, League] = None, **kwargs) -> 'PriceSketches':
+        """
+        :param league: The league the prices are from, each league's sketches are saved to their own file within PRICE_SKETCH_PATH
+        """
+        league = league_id(league)
+        return cls(PRICE_SKETCH_PATH.joinpath(f'{quote(league, safe="")}.json'), league=league, **kwargs)
+
+    def _window_start(self, now: float) -> int:
+        return int(now // self.window * self.window)
+
+    def _merged(self, windows: Dict[int, KLLSketch], age: float, now: float) -> KLLSketch:
+        # the windows overlapping the age, merged into one sketch
+        merged = KLLSketch(self.k)
+        for start, sketch in windows.items():
+            if start + self.window > now - age:
+                merged.merge(sketch)
+        return merged
+
+    def _prune(self, item: _ItemPrices, now: float):
+        cutoff = now - self.retention
+        for windows in (item.windows, item.observed):
+            for start in [start for start in windows if start + self.window <= cutoff]:
+                del windows[start]
+        while item.seen and (next(iter(item.seen.values()))[0] <= cutoff or len(item.seen) > MAX_SEEN_IDS):
+            item.seen.popitem(last=False)
+
+    def add(self, name: str, prices: Union[Iterable[float], np.ndarray], now: float = None) -> np.ndarray:
+        """
+        :param name: The item the prices are for
+        :param prices: Chaos prices, e.g. as returned by price_listings
+        :param now: The unix timestamp the prices were seen at, defaults to now
+        :return: The prices accepted by the outlier filter, which compares them against every price seen within the recent windows
+        """
+        now = time() if now is None else now
+        prices = np.asarray(prices, dtype=np.float64).ravel()
+        prices = prices[~np.isnan(prices)]
+        with self._lock:
+            item = self.items.get(name)
+            if item is None:
+                item = self.items[name] = _ItemPrices()
+            accepted = prices[self.outlier_filter.accepted(self._merged(item.observed, self.recent, now), prices)]
+            start = self._window_start(now)
+            for windows, added in ((item.windows, accepted), (item.observed, prices)):
+                if start not in windows:
+                    windows[start] = KLLSketch(self.k)
+                windows[start].update(added)
+            self._prune(item, now)
+        return accepted
+
+    def add_listings(self, name: str, listings: Iterable[Optional[Listing]], table: ExchangeRateTable = None, now: float = None) -> np.ndarray:
+        """
+        Adds the prices of listings which have not been added before at their current price, so listings which stay
+        listed across many scans are only counted again when they are repriced
+
+        :param name: The item the listings are for
+        :param listings: Listings as returned by fetch_query_results
+        :param table: The exchange rates to price with, defaults to the current rates of the sketches' league
+        :param now: The unix timestamp the listings were fetched at, defaults to now
+        :return: The chaos prices accepted by the outlier filter
+        """
+        now = time() if now is None else now
+        with self._lock:
+            item = self.items.get(name)
+            if item is None:
+                item = self.items[name] = _ItemPrices()
+            unseen = []
+            for listing in listings:
+                if listing is None:
+                    continue
+                seen = item.seen.get(listing.id)
+                if seen is not None and seen[1:] == (listing.amount, listing.currency):
+                    continue
+                item.seen.pop(listing.id, None)
+                item.seen[listing.id] = (now, listing.amount, listing.currency)
+                unseen.append(listing)
+        table = ExchangeRateTable.for_league(self.league) if table is None else table
+        return self.add(name, price_listings(unseen, table), now)
+
+    def summary(self, name: str, percentiles: Sequence[int] = DEFAULT_PERCENTILES, age: timedelta = None, now: float = None) -> SketchSummary:
+        """
+        :param name: The item to summarize, statistics of items without any recent prices are NaN
+        :param percentiles: The percentiles to estimate
+        :param age: The age of the prices to summarize, defaults to the recent age the sketches were created with
+        :param now: The unix timestamp to summarize up to, defaults to now
+        """
+        now = time() if now is None else now
+        age = self.recent if age is None else age.total_seconds()
+        with self._lock:
+            item = self.items.get(name, _ItemPrices())
+            sketch = self._merged(item.windows, age, now)
+            rejected = self._merged(item.observed, age, now).count - sketch.count
+        estimates = sketch.quantiles([0.5, *(percentile / 100 for percentile in percentiles)])
+        return SketchSummary(count=sketch.count, rejected=rejected, median=float(estimates[0]),
+                             percentiles={percentile: float(estimate) for percentile, estimate in zip(percentiles, estimates[1:])})
+
+    def summaries(self, percentiles: Sequence[int] = DEFAULT_PERCENTILES, age: timedelta = None, now: float = None) -> Dict[str, SketchSummary]:
+        return {name: self.summary(name, percentiles, age, now) for name in list(self.items)}
+
+    def merge(self, other: 'PriceSketches'):
+        """
+        Adds every price accepted by another set of sketches, e.g. one filled by another worker process. Windows are
+        merged by their start, so both sets should share the same window length
+        """
+        with self._lock:
+            for name, other_item in other.items.items():
+                item = self.items.get(name)
+                if item is None:
+                    item = self.items[name] = _ItemPrices()
+                for windows, other_windows in ((item.windows, other_item.windows), (item.observed, other_item.observed)):
+                    for start, sketch in other_windows.items():
+                        if start in windows:
+                            windows[start].merge(sketch)
+                        else:
+                            windows[start] = sketch.copy()
+                for trade_id, seen in other_item.seen.items():
+                    if trade_id not in item.seen or item.seen[trade_id][0] < seen[0]:
+                        item.seen[trade_id] = seen
+                item.seen = OrderedDict(sorted(item.seen.items(), key=lambda entry: entry[1][0]))
+
+    def __getstate__(self):
+        # locks cannot be pickled, so sketches are sent between processes without theirs
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {name: {'windows': {str(start): sketch.to_json() for start, sketch in item.windows.items()},
+                           'observed': {str(start): sketch.to_json() for start, sketch in item.observed.items()},
+                           'seen': {trade_id: list(seen) for trade_id, seen in item.seen.items()}}
+                    for name, item in self.items.items()}
+
+    def load(self, path: Union[str, Path]):
+        """
+        Merges the sketches saved to a file into these sketches
+        """
+        with open(path, 'r') as sketch_file:
+            persisted = json.load(sketch_file)
+        loaded = PriceSketches(k=self.k, window=timedelta(seconds=self.window))
+        for name, item_json in persisted.items():
+            item = loaded.items[name] = _ItemPrices()
+            item.windows = {int(start): KLLSketch.from_json(sketch_json) for start, sketch_json in item_json['windows'].items()}
+            item.observed = {int(start): KLLSketch.from_json(sketch_json) for start, sketch_json in item_json['observed'].items()}
+            item.seen = OrderedDict((trade_id, tuple(seen)) for trade_id, seen in item_json['seen'].items())
+        self.merge(loaded)
+
+    def save(self, path: Union[str, Path] = None):
+        """
+        :param path: The file to save to, defaults to the file the sketches were loaded from
+        """
+        path = Path(path) if path is not None else self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w') as sketch_file:
+                json.dump(self.to_json(), sketch_file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+def merge_sketches(sketches: Iterable[PriceSketches]) -> PriceSketches:
+    """
+    :param sketches: Sketches filled separately, e.g. returned by each worker of a process pool
+    :return: A single set of sketches holding every price of every one of them
+    """
+    sketches = list(sketches)
+    merged = PriceSketches(window=timedelta(seconds=sketches[0].window), league=sketches[0].league) if sketches else PriceSketches()
+    for other in sketches:
+        merged.merge(other)
+    return merged
@@ -0,0 +1,273 @@
+# Renders trade data to static chart files, re-rendering only the charts whose data changed since they were last rendered
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from hashlib import sha1
+from pathlib import Path
+from typing import Callable, Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from Data.Index import CHART_PATH
+from POE.Trade.ListingStore import DEFAULT_BUCKET, ListingStore
+from POE.Trade.Scanner import RecipeProfit
+
+DEFAULT_MAX_POINTS = 1000  # series longer than this are downsampled before plotting
+DEFAULT_BINS = 50
+DEFAULT_FIGURE_SIZE = (8, 4.5)
+_manifest_name = 'manifest.json'
+_margins = {'left': 0.1, 'right': 0.97, 'top': 0.92, 'bottom': 0.15}
+
+
+def downsample(values: np.ndarray, max_points: int = DEFAULT_MAX_POINTS) -> np.ndarray:
+    """
+    Selects the points of a series to plot, keeping the minimum and maximum of each of max_points / 2 equally sized
+    buckets, so that spikes remain visible however much the series is reduced
+
+    :param values: The values of the series, in plotting order
+    :param max_points: The maximum number of points to keep
+    :return: The sorted indices of the points to keep
+    """
+    count = len(values)
+    if count <= max_points:
+        return np.arange(count)
+
+    size = -(-count // max(max_points // 2, 1))
+    buckets = -(-count // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:count] = values
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    kept = np.concatenate([offsets + np.nanargmin(padded, axis=1), offsets + np.nanargmax(padded, axis=1), [0, count - 1]])
+    return np.unique(kept)
+
+
+def _fingerprint(*parts) -> str:
+    digest = sha1()
+    for part in parts:
+        digest.update(part.tobytes() if isinstance(part, np.ndarray) else repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def chart_name(*parts: str) -> str:
+    """
+    :return: A file name built from the parts, e.g. the name and type of an item, safe to use on any platform
+    """
+    return re.sub(r'[^A-Za-z0-9]+', '_', ' '.join(part for part in parts if part)).strip('_')
+
+
+def _draw_histogram(axes, title: str, prices: np.ndarray, bins: int):
+    if len(prices):
+        # the long tail of overpriced listings is clipped, so that it does not flatten the rest of the distribution
+        axes.hist(prices, bins=bins, range=(prices[0], np.percentile(prices, 99)))
+    axes.set_title(title)
+    axes.set_xlabel('Price (chaos)')
+    axes.set_ylabel('Listings')
+
+
+def _draw_time_series(axes, title: str, timestamps: np.ndarray, values: np.ndarray, low: np.ndarray, high: np.ndarray):
+    times = timestamps.astype('datetime64[s]')
+    if low is not None and high is not None:
+        axes.fill_between(times, low, high, alpha=0.2, linewidth=0)
+    axes.plot(times, values)
+    axes.set_title(title)
+    axes.set_ylabel('Price (chaos)')
+    axes.figure.autofmt_xdate()
+
+
+def _draw_recipe_profits(axes, title: str, labels: List[str], values: np.ndarray):
+    positions = np.arange(len(labels))
+    axes.barh(positions, values, color=np.where(values >= 0, 'tab:green', 'tab:red'))
+    axes.set_yticks(positions)
+    axes.set_yticklabels(labels, fontsize=6)
+    axes.invert_yaxis()
+    axes.figure.subplots_adjust(left=0.45)  # leaves room for the recipe labels
+    axes.set_title(title)
+    axes.set_xlabel('Profit (chaos)')
+
+
+def _render_chart(chart_path: Path, figure_size: Tuple[float, float], dpi: int, draw: Callable, args: tuple):
+    # a module level function, so that charts can be rendered in worker processes
+    # fixed margins avoid the extra draw which tight_layout needs to measure the labels
+    figure = Figure(figsize=figure_size, dpi=dpi)
+    FigureCanvasAgg(figure)
+    figure.subplots_adjust(**_margins)
+    draw(figure.add_subplot(), *args)
+
+    chart_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = chart_path.with_suffix('.tmp.png')
+    figure.savefig(temp_path)
+    os.replace(temp_path, chart_path)
+
+
+class ChartRenderer(object):
+    def __init__(self, path: Union[str, Path] = CHART_PATH, max_points: int = DEFAULT_MAX_POINTS, figure_size: Tuple[float, float] = DEFAULT_FIGURE_SIZE, dpi: int = 100,
+                 max_workers: int = 1):
+        """
+        Renders charts to png files. The data each chart was last rendered from is fingerprinted in a manifest, and
+        charts are skipped while their data is unchanged and their file still exists, so regenerating a dashboard only
+        costs as much as the charts which changed.
+
+        Figures are drawn directly onto an Agg canvas rather than through pyplot, which avoids its global figure
+        registry and any interactive backend. Rasterizing and encoding each chart is CPU bound, so with more than one
+        worker charts are rendered in a pool of processes, and the manifest only records them once they are written.
+
+        :param path: The folder the charts are rendered into
+        :param max_points: The maximum number of points plotted for each series
+        :param figure_size: The size of each chart, in inches
+        :param dpi: The resolution of each chart
+        :param max_workers: The number of processes rendering charts, charts are rendered in the calling thread when 1
+        """
+        self.path = Path(path)
+        self.max_points = max_points
+        self.figure_size = figure_size
+        self.dpi = dpi
+        self.max_workers = max_workers
+        self.rendered = 0
+        self.skipped = 0
+        self._manifest = self._load_manifest()  # to be formatted as {chart name: fingerprint}
+        self._pending = []  # to be formatted as [(chart name, fingerprint, Future)], for charts submitted to the pool
+        self._executor = None
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self.path.joinpath(_manifest_name), 'r') as manifest_file:
+                return json.load(manifest_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def wait(self):
+        """
+        Waits for every chart submitted to the worker processes to be written
+        """
+        pending, self._pending = self._pending, []
+        for name, fingerprint, future in pending:
+            future.result()
+            self._manifest[name] = fingerprint
+
+    def save_manifest(self):
+        self.wait()
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.path.joinpath(_manifest_name)
+        temp_path = manifest_path.with_suffix('.tmp')
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(self._manifest, manifest_file)
+        os.replace(temp_path, manifest_path)
+
+    def close(self):
+        self.save_manifest()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _is_current(self, name: str, fingerprint: str) -> bool:
+        if self._manifest.get(name) == fingerprint and self.path.joinpath(f'{name}.png').exists():
+            self.skipped += 1
+            return True
+        return False
+
+    def _render(self, name: str, fingerprint: str, draw: Callable, *args) -> bool:
+        if self._is_current(name, fingerprint):
+            return False
+
+        self.rendered += 1
+        if self.max_workers <= 1:
+            _render_chart(self.path.joinpath(f'{name}.png'), self.figure_size, self.dpi, draw, args)
+            self._manifest[name] = fingerprint
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._pending.append((name, fingerprint, self._executor.submit(_render_chart, self.path.joinpath(f'{name}.png'), self.figure_size, self.dpi, draw, args)))
+        return True
+
+    def histogram(self, name: str, prices: np.ndarray, title: str = None, bins: int = DEFAULT_BINS) -> bool:
+        """
+        Renders the distribution of a set of prices
+        :param name: The name of the chart file, without an extension
+        :param prices: The chaos value of each listing
+        :param title: The title of the chart
+        :param bins: The number of bars in the histogram
+        :return: Whether the chart was rendered, False if it was unchanged
+        """
+        prices = np.sort(np.asarray(prices, dtype=np.float64))
+        return self._render(name, _fingerprint('histogram', title, bins, prices), _draw_histogram, title or name, prices, bins)
+
+    def time_series(self, name: str, timestamps: np.ndarray, values: np.ndarray, low: np.ndarray = None, high: np.ndarray = None, title: str = None) -> bool:
+        """
+        Renders a series of prices over time, downsampled to at most max_points points
+        :param name: The name of the chart file, without an extension
+        :param timestamps: The unix timestamp of each point
+        :param values: The price at each point
+        :param low: The lower edge of a band drawn around the series at each point, e.g. the cheapest listing
+        :param high: The upper edge of the band at each point
+        :param title: The title of the chart
+        :return: Whether the chart was rendered, False if it was unchanged
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        low = np.asarray(low, dtype=np.float64) if low is not None else None
+        high = np.asarray(high, dtype=np.float64) if high is not None else None
+        fingerprint = _fingerprint('time series', title, self.max_points, timestamps, values, low, high)
+        if self._is_current(name, fingerprint):
+            return False
+
+        # only the downsampled series is drawn, which also keeps the data sent to worker processes small
+        kept = downsample(values, self.max_points)
+        return self._render(name, fingerprint, _draw_time_series, title or name, timestamps[kept], values[kept],
+                            low[kept] if low is not None else None, high[kept] if high is not None else None)
+
+    def recipe_profits(self, name: str, profits: Sequence[RecipeProfit], title: str = None, limit: int = 30) -> bool:
+        """
+        Renders the profit of the most profitable recipes
+        :param name: The name of the chart file, without an extension
+        :param profits: Recipe profits as returned by scan_recipes, from most to least profitable
+        :param title: The title of the chart
+        :param limit: The number of recipes shown
+        :return: Whether the chart was rendered, False if it was unchanged
+        """
+        shown = [profit for profit in profits if not profit.unpriced][:limit]
+        labels = [str(profit.recipe) for profit in shown]
+        values = np.array([profit.profit for profit in shown], dtype=np.float64)
+        return self._render(name, _fingerprint('recipe profits', title, labels, values), _draw_recipe_profits, title or name, labels, values)
+
+    def __str__(self):
+        return f"ChartRenderer(Path: {self.path}, Rendered: {self.rendered}, Skipped: {self.skipped})"
+
+
+def render_item_dashboard(store: ListingStore, items: Iterable[Tuple[str, str]] = None, renderer: ChartRenderer = None, start: Union[datetime, float] = None,
+                          end: Union[datetime, float] = None, bucket: timedelta = DEFAULT_BUCKET, league: str = None) -> ChartRenderer:
+    """
+    Renders a price histogram and price history chart for each item in the listing store
+    :param store: The listing store to read prices from
+    :param items: The (name, type) of each item to chart, defaults to every stored item
+    :param renderer: The renderer to draw with, defaults to one rendering into CHART_PATH in the calling thread
+    :param start: The earliest time the charted listings were indexed, as a datetime or unix timestamp
+    :param end: The time before which the charted listings were indexed, as a datetime or unix timestamp
+    :param bucket: The period each point of the price histories aggregates
+    :param league: The league the charted listings were fetched from
+    :return: The renderer, which counts the charts rendered and skipped
+    """
+    renderer = ChartRenderer() if renderer is None else renderer
+    items = store.item_summaries(start=start, end=end, league=league).keys() if items is None else items
+
+    for item_name, item_type in items:
+        title = f'{item_name} {item_type}'.strip()
+        renderer.histogram(chart_name(item_name, item_type, 'prices'), store.prices(item_name, item_type, start, end, league), title=title)
+
+        history = store.price_history(item_name, item_type, start, end, bucket=bucket, league=league)
+        columns = np.array([(point.start, point.mean, point.min, point.max) for point in history], dtype=np.float64).reshape(-1, 4)
+        renderer.time_series(chart_name(item_name, item_type, 'history'), columns[:, 0], columns[:, 1], low=columns[:, 2], high=columns[:, 3], title=title)
+
+    renderer.save_manifest()
+    return renderer
@@ -0,0 +1,21 @@
+from Data.Index import METRICS_PATH
+from POE.Trade.Recipes import load_prophecy_recipes, load_vendor_recipes
+from POE.Trade.Scanner import format_profit_table, scan_recipes
+from POE.Trade.Visualization import ChartRenderer
+from Tools.API.Metrics import metrics
+
+recipes = load_prophecy_recipes() + load_vendor_recipes()
+
+for recipe in recipes:
+    if not recipe.supported:
+        print('Skipping unsupported recipe:', recipe)
+
+profits = scan_recipes(recipes)
+print(format_profit_table(profits))
+
+renderer = ChartRenderer()
+renderer.recipe_profits('recipe_profits', profits, title='Most profitable recipes')
+renderer.save_manifest()
+
+# where the scan spent its time, e.g. waiting on each ratelimit rule rather than on requests
+metrics.write(METRICS_PATH.joinpath('scan_recipe_profits.prom'))
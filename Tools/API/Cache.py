@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from datetime import timedelta
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable, Union
+
+from Tools.API.Metrics import metrics
+
+_missing = object()
+
+_cache_hits = metrics.counter('cache_hits_total', 'Lookups which found a valid entry', ('cache',))
+_cache_misses = metrics.counter('cache_misses_total', 'Lookups which found no entry, or an expired one', ('cache',))
+_cache_entries = metrics.gauge('cache_entries', 'The number of entries held, including expired entries not yet evicted', ('cache',))
+
+
+class TTLCache(object):
+    def __init__(self, max_size: int, ttl: Union[int, timedelta], name: str = None):
+        """
+        A thread safe cache which evicts entries once they are older than the ttl, or once the cache is full and the
+        entry is the least recently used
+
+        :param max_size: The maximum number of entries held in the cache
+        :param ttl: The time an entry remains valid for. Can be represented as a timedelta, or an integer representing the number of seconds
+        :param name: The name the cache's hits and misses are exported under in Tools.API.Metrics, unnamed caches are not exported
+        """
+        if isinstance(ttl, int):
+            ttl = timedelta(seconds=ttl)
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._exported_hits = 0
+        self._exported_misses = 0
+        self._entries = OrderedDict()  # to be formatted as {key: (expiry time, value)}, from least to most recently used
+        self._lock = Lock()
+        if name is not None:
+            # the hit and miss counts are already kept, so the counters are only advanced by them when exported
+            metrics.add_collector(self._collect_metrics)
+        self.name = name
+
+    def _collect_metrics(self):
+        hits, misses = self.hits, self.misses
+        _cache_hits.labels(self.name).inc(hits - self._exported_hits)
+        _cache_misses.labels(self.name).inc(misses - self._exported_misses)
+        self._exported_hits, self._exported_misses = hits, misses
+        _cache_entries.labels(self.name).set(len(self._entries))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _missing)
+            if entry is not _missing and entry[0] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _missing:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key, _missing)
+            return entry is not _missing and entry[0] > monotonic()
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl.total_seconds(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def __str__(self):
+        return f"TTLCache(Entries: {len(self)}/{self.max_size}, TTL: {self.ttl}, Hits: {self.hits}, Misses: {self.misses})"
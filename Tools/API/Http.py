@@ -0,0 +1,152 @@
+# A shared HTTP client for all API modules, keeping connections alive between requests rather than opening a new
+# TLS connection for each one
+import re
+from threading import Lock
+from time import perf_counter
+from typing import Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from requests import Response, Session
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+from Tools.API import API_Names
+from Tools.API.Metrics import metrics
+
+DEFAULT_TIMEOUT = (5, 30)  # seconds to wait for a connection, and for a response once connected
+DEFAULT_POOL_SIZE = 10  # connections kept alive per host
+
+# the server each API is reached at, which can be pointed at a local stub server to run without network access
+DEFAULT_BASE_URLS = {
+    API_Names.PATH_OF_EXILE: 'https://www.pathofexile.com',
+    API_Names.PATH_OF_EXILE_TRADE: 'https://www.pathofexile.com',
+    API_Names.POE_NINJA: 'https://poe.ninja',
+}
+
+_request_seconds = metrics.histogram('api_request_seconds', 'Time from sending a request to receiving its full response', ('method', 'endpoint'))
+_responses = metrics.counter('api_responses_total', 'Responses received, by status code', ('method', 'endpoint', 'status'))
+_response_bytes = metrics.counter('api_response_bytes_total', 'Bytes of response bodies received, after decompression', ('method', 'endpoint'))
+_request_bytes = metrics.counter('api_request_bytes_total', 'Bytes of request bodies sent', ('method', 'endpoint'))
+_request_errors = metrics.counter('api_request_errors_total', 'Requests which failed without a response, by exception', ('method', 'endpoint', 'error'))
+# path segments naming an endpoint, rather than identifying a league, search or listing within it
+_endpoint_segment = re.compile(r'^[a-z]{1,24}$')
+
+_session = None
+_session_lock = Lock()
+_timeout = DEFAULT_TIMEOUT
+_pool_size = DEFAULT_POOL_SIZE
+_adapter = None
+_base_urls = dict(DEFAULT_BASE_URLS)
+
+
+def configure(timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT, pool_size: int = DEFAULT_POOL_SIZE, adapter: BaseAdapter = None):
+    """
+    Configures the shared session, replacing any session created with the previous configuration
+
+    :param timeout: The default timeout of each request, as either a single number of seconds or a (connect, read) tuple
+    :param pool_size: The number of connections kept alive per host, this should be at least the number of threads sending requests
+    :param adapter: The transport adapter used for every request in place of a pooled HTTPAdapter, e.g. to record or replay responses
+    """
+    global _session, _timeout, _pool_size, _adapter
+    with _session_lock:
+        _timeout = timeout
+        _pool_size = pool_size
+        _adapter = adapter
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def set_adapter(adapter: BaseAdapter = None):
+    """
+    Replaces the transport adapter of the shared session, keeping the rest of its configuration
+
+    :param adapter: The transport adapter used for every request, or None to restore the pooled HTTPAdapter
+    """
+    configure(timeout=_timeout, pool_size=_pool_size, adapter=adapter)
+
+
+def get_timeout() -> Union[float, Tuple[float, float]]:
+    """
+    :return: The default timeout of each request, as either a single number of seconds or a (connect, read) tuple
+    """
+    return _timeout
+
+
+def get_adapter() -> Optional[BaseAdapter]:
+    """
+    :return: The transport adapter installed in place of the pooled HTTPAdapter, or None if requests are sent over the network
+    """
+    return _adapter
+
+
+def set_base_url(api: API_Names, base_url: str = None):
+    """
+    :param api: The API to redirect
+    :param base_url: The scheme and host the API is reached at, e.g. 'http://127.0.0.1:8080', or None to restore the default
+    """
+    _base_urls[api] = (base_url or DEFAULT_BASE_URLS[api]).rstrip('/')
+
+
+def api_url(api: API_Names, path: str) -> str:
+    """
+    :param api: The API the request is sent to
+    :param path: The path of the endpoint, including any query string, e.g. '/api/trade/data/leagues'
+    :return: The full url of the endpoint, on the currently configured server of the API
+    """
+    return _base_urls[api] + path
+
+
+def get_session() -> Session:
+    """
+    Retrieves the session shared by all API modules, creating it the first time it is requested
+    :return: A session with connection pooling and gzip negotiation
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = Session()
+                adapter = _adapter if _adapter is not None else HTTPAdapter(pool_connections=_pool_size, pool_maxsize=_pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['accept-encoding'] = 'gzip, deflate'
+                _session = session
+    return _session
+
+
+def endpoint_name(url: str) -> str:
+    """
+    :param url: The url of a request
+    :return: The endpoint the request was sent to, without the ids within its path or its query, e.g. '/api/trade/fetch'
+    """
+    segments = []
+    for segment in urlsplit(url).path.split('/')[1:]:
+        if not _endpoint_segment.match(segment):
+            break
+        segments.append(segment)
+    return '/' + '/'.join(segments)
+
+
+def request(method: str, url: str, **kwargs) -> Response:
+    kwargs.setdefault('timeout', _timeout)
+    endpoint = endpoint_name(url)
+    start = perf_counter()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except Exception as exception:
+        _request_errors.labels(method, endpoint, type(exception).__name__).inc()
+        raise
+    _request_seconds.labels(method, endpoint).observe(perf_counter() - start)
+    _responses.labels(method, endpoint, response.status_code).inc()
+    _response_bytes.labels(method, endpoint).inc(len(response.content))
+    if response.request.body:
+        _request_bytes.labels(method, endpoint).inc(len(response.request.body))
+    return response
+
+
+def get(url: str, **kwargs) -> Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> Response:
+    return request('POST', url, **kwargs)
@@ -0,0 +1,306 @@
+# Metrics recorded across Tools.API, showing where the wall clock time of a scan goes: request latency per endpoint,
+# time blocked by each ratelimit rule, ratelimit budget utilization, cache hit rates and bytes transferred.
+#
+# Metrics are held in memory and exported on demand, as JSON or in the Prometheus text format, either to a file or
+# from a local HTTP endpoint. Listeners may be added to receive every observation as it is made, e.g. for tracing.
+import json
+import weakref
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# seconds, spanning a cached lookup to a ratelimit restriction
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# to be formatted as listener(metric name, {label: value}, observed value)
+Listener = Callable[[str, Dict[str, str], float], None]
+
+
+class _Sample(object):
+    __slots__ = ('metric', 'labels', 'value', 'counts', 'sum')
+
+    def __init__(self, metric: '_Metric', labels: Tuple[str, ...]):
+        self.metric = metric
+        self.labels = labels
+        self.value = 0.0
+        self.counts = [0] * (len(metric.buckets) + 1) if metric.type == HISTOGRAM else None  # the last count is for the +Inf bucket
+        self.sum = 0.0
+
+    def _notify(self, value: float):
+        listeners = self.metric.registry.listeners
+        if listeners:
+            labels = dict(zip(self.metric.label_names, self.labels))
+            for listener in listeners:
+                listener(self.metric.name, labels, value)
+
+    def inc(self, amount: float = 1):
+        with self.metric.lock:
+            self.value += amount
+        self._notify(amount)
+
+    def set(self, value: float):
+        with self.metric.lock:
+            self.value = value
+        self._notify(value)
+
+    def observe(self, value: float):
+        index = bisect_left(self.metric.buckets, value)
+        with self.metric.lock:
+            self.counts[index] += 1
+            self.sum += value
+        self._notify(value)
+
+    def _reset(self):
+        # called with the metric's lock held
+        self.value = 0.0
+        if self.counts is not None:
+            self.counts = [0] * len(self.counts)
+        self.sum = 0.0
+
+
+class _Metric(object):
+    def __init__(self, registry: 'MetricsRegistry', name: str, type: str, help: str, label_names: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.type = type
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) if type == HISTOGRAM else ()
+        self.lock = Lock()
+        self._samples: Dict[Tuple[str, ...], _Sample] = {}
+
+    def labels(self, *values) -> _Sample:
+        """
+        :param values: The value of each label, in the order the label names were given
+        :return: The sample of the labels, which is best kept by callers recording it often
+        """
+        values = tuple(str(value) for value in values)
+        sample = self._samples.get(values)
+        if sample is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} has labels {self.label_names}, but was given {values}')
+            with self.lock:
+                sample = self._samples.setdefault(values, _Sample(self, values))
+        return sample
+
+    def samples(self) -> List[_Sample]:
+        with self.lock:
+            return list(self._samples.values())
+
+    def clear(self):
+        # samples are reset rather than dropped, as callers keep the samples they record often
+        with self.lock:
+            for sample in self._samples.values():
+                sample._reset()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{labels}}}' if labels else ''
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        """
+        Holds a set of metrics, each created once by name and shared by every caller which asks for it
+        """
+        self.listeners: List[Listener] = []
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Optional[Callable[[], None]]]] = []  # references to each collector, returning None once it is garbage collected
+        self._lock = Lock()
+
+    def _metric(self, name: str, type: str, help: str, label_names: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS) -> _Metric:
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, _Metric(self, name, type, help, label_names, buckets))
+        if metric.type != type or metric.label_names != tuple(label_names):
+            raise ValueError(f'{name} is already registered as a {metric.type} with labels {metric.label_names}')
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> _Metric:
+        """
+        :return: A metric which only increases, such as a number of requests or bytes
+        """
+        return self._metric(name, COUNTER, help, label_names)
+
+    def gauge(self, name: str, help: str, label_names: Sequence[str] = ()) -> _Metric:
+        """
+        :return: A metric which is set to its current value, such as the number of queued jobs
+        """
+        return self._metric(name, GAUGE, help, label_names)
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> _Metric:
+        """
+        :return: A metric counting observations into buckets of upper bounds, such as request latencies in seconds
+        """
+        return self._metric(name, HISTOGRAM, help, label_names, buckets)
+
+    def add_collector(self, collector: Callable[[], None]):
+        """
+        :param collector: Called before every export, to set metrics which are cheaper to read when exported than to record as they change.
+                          Bound methods are held by weak reference, so registering one never keeps its object alive
+        """
+        reference = weakref.WeakMethod(collector) if hasattr(collector, '__self__') and hasattr(collector, '__func__') else (lambda: collector)
+        with self._lock:
+            self._collectors.append(reference)
+
+    def remove_collector(self, collector: Callable[[], None]):
+        with self._lock:
+            self._collectors = [reference for reference in self._collectors if reference() is not None and reference() != collector]
+
+    def add_listener(self, listener: Listener):
+        """
+        :param listener: Called with every observation as it is recorded, from the thread recording it
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Listener):
+        self.listeners.remove(listener)
+
+    def clear(self):
+        """
+        Discards every recorded value, keeping the metrics themselves, e.g. to measure a single scan
+        """
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def _collect(self) -> Iterator[_Metric]:
+        with self._lock:
+            self._collectors = [reference for reference in self._collectors if reference() is not None]
+            collectors = [reference() for reference in self._collectors]
+        for collector in collectors:
+            if collector is not None:
+                collector()
+        return iter(sorted(self._metrics.values(), key=lambda metric: metric.name))
+
+    def to_json(self) -> dict:
+        """
+        :return: Every metric, formatted as {name: {'type', 'help', 'samples': [{'labels', 'value'} or {'labels', 'count', 'sum', 'buckets'}]}}
+        """
+        metrics = {}
+        for metric in self._collect():
+            samples = []
+            for sample in metric.samples():
+                labels = dict(zip(metric.label_names, sample.labels))
+                if metric.type == HISTOGRAM:
+                    cumulative, buckets = 0, {}
+                    for bound, count in zip((*metric.buckets, float('inf')), sample.counts):
+                        cumulative += count
+                        buckets[_format_number(bound)] = cumulative
+                    samples.append({'labels': labels, 'count': cumulative, 'sum': sample.sum, 'buckets': buckets})
+                else:
+                    samples.append({'labels': labels, 'value': sample.value})
+            metrics[metric.name] = {'type': metric.type, 'help': metric.help, 'samples': samples}
+        return metrics
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Every metric, in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._collect():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for sample in metric.samples():
+                if metric.type == HISTOGRAM:
+                    cumulative = 0
+                    for bound, count in zip((*metric.buckets, float('inf')), sample.counts):
+                        cumulative += count
+                        lines.append(f'{metric.name}_bucket{_format_labels((*metric.label_names, "le"), (*sample.labels, _format_number(bound)))} {cumulative}')
+                    lines.append(f'{metric.name}_sum{_format_labels(metric.label_names, sample.labels)} {_format_number(sample.sum)}')
+                    lines.append(f'{metric.name}_count{_format_labels(metric.label_names, sample.labels)} {cumulative}')
+                else:
+                    lines.append(f'{metric.name}{_format_labels(metric.label_names, sample.labels)} {_format_number(sample.value)}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Union[str, Path]):
+        """
+        Writes every metric to a file, as JSON when the file name ends in .json, and in the Prometheus text format otherwise
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as metrics_file:
+            if path.suffix == '.json':
+                json.dump(self.to_json(), metrics_file, indent=2)
+            else:
+                metrics_file.write(self.to_prometheus())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: 'MetricsServer'
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            body, content_type = self.server.registry.to_prometheus(), 'text/plain; version=0.0.4'
+        elif self.path.split('?')[0] == '/metrics.json':
+            body, content_type = json.dumps(self.server.registry.to_json()), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        encoded = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int):
+        super().__init__((host, port), _MetricsHandler)
+        self.registry = registry
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# the registry every module of Tools.API records into
+metrics = MetricsRegistry()
+
+
+def serve_metrics(port: int = 0, host: str = '127.0.0.1', registry: MetricsRegistry = metrics) -> MetricsServer:
+    """
+    Serves the metrics from a background thread, in the Prometheus text format at /metrics, and as JSON at /metrics.json
+    :param port: The port to listen on, a free port is chosen by default
+    :param host: The address to listen on, only the local machine by default
+    :param registry: The metrics to serve
+    :return: The running server, stopped with its stop method
+    """
+    server = MetricsServer(registry, host, port)
+    Thread(target=server.serve_forever, name='Metrics server', daemon=True).start()
+    return server
@@ -0,0 +1,188 @@
+import asyncio
+from collections import deque
+from functools import partial
+from itertools import chain
+from json import loads
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Union
+from urllib.parse import quote
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from Tools import to_chunks
+from Tools.API import Http
+from Tools.API.Http import api_url
+from Tools.API.POE import MAX_LISTINGS_PER_REQUEST, TRADE_API_NAME, TooManyListingsException, _get_search_headers, _get_search_result_headers, league_id, is_priced
+from Tools.API.POE.Leagues import League
+from Tools.API.POE.Listings import Listing, parse_listings
+from Tools.API.Ratelimiting import get_ratelimit, ratelimit, update_ratelimit_from_response
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_PREFETCH_CHUNKS = 2
+
+
+def _client_timeout(timeout) -> ClientTimeout:
+    # the shared session's timeout, given as a number of seconds or a (connect, read) tuple like requests accepts
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return ClientTimeout(sock_connect=connect, sock_read=read)
+
+
+class AsyncTradeClient(object):
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS, league: Union[str, League] = None):
+        """
+        An asyncio based client for the trade API, which reuses connections and runs searches and fetches concurrently.
+        All requests share the TRADE_API_NAME ratelimit with the synchronous clients in Tools.API.POE, so the client
+        never exceeds the trade API's rules, but requests are sent as soon as the rules allow instead of one at a time.
+
+        Requests are sent to the servers configured in Tools.API.Http, with its timeout. While a transport adapter is
+        installed there, e.g. to replay recorded responses, requests are sent through the shared session instead, on
+        the event loop's default executor.
+
+        Intended to be used as an async context manager, so that the underlying connections are closed when finished.
+
+        :param max_connections: The maximum number of simultaneously open connections to the trade API
+        :param league: The league to search, by id or as returned by get_active_leagues, defaults to the current challenge league,
+                       which is looked up when the client is entered
+        """
+        self.max_connections = max_connections
+        self.league = league_id(league) if league is not None else None
+        self._session = None
+
+    async def __aenter__(self):
+        # discovering the ratelimit rules and the default league are blocking requests, so they are resolved outside of the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, get_ratelimit, TRADE_API_NAME)
+        if self.league is None:
+            self.league = await loop.run_in_executor(None, league_id, None)
+        if Http.get_adapter() is None:
+            self._session = ClientSession(connector=TCPConnector(limit=self.max_connections), timeout=_client_timeout(Http.get_timeout()))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, url: str, **kwargs) -> dict:
+        if self._session is None:
+            response = await asyncio.get_running_loop().run_in_executor(None, partial(Http.request, method, url, **kwargs))
+            update_ratelimit_from_response(response.status_code, response.headers, name=TRADE_API_NAME)
+            return response.json()
+
+        async with self._session.request(method, url, **kwargs) as response:
+            update_ratelimit_from_response(response.status, response.headers, name=TRADE_API_NAME)
+            return await response.json()
+
+    @ratelimit(TRADE_API_NAME)
+    async def send_search_request(self, query_json):
+        """
+        Runs a search using the supplied JSON as query parameters, returning all listings that matched said search
+        :param query_json: The search parameters
+        :return: (id, results): A tuple containing the Search ID and Trade IDs resulting from the search
+        """
+        if isinstance(query_json, str):
+            query_json = loads(query_json)
+
+        results = await self._request('POST', api_url(TRADE_API_NAME, f'/api/trade/search/{quote(self.league)}'), json=query_json, headers=_get_search_headers(self.league))
+        return results['id'], results['result']
+
+    @ratelimit(TRADE_API_NAME)
+    async def get_search_results(self, search_id: str, trade_ids: Iterable[str]):
+        """
+        Retrieves listing information from search results, by trade id.
+
+        :param search_id: The search if returned by the send_search_request function
+        :param trade_ids: Up to 10 ids returned by the send_search_request function
+        :return:
+        """
+        if len(trade_ids) > MAX_LISTINGS_PER_REQUEST:
+            raise TooManyListingsException()
+
+        headers = _get_search_result_headers(search_id, self.league)
+
+        trade_id_string = ','.join(trade_ids)
+        URL = api_url(TRADE_API_NAME, f'/api/trade/fetch/{trade_id_string}?query={search_id}')
+        return await self._request('GET', URL, headers=headers)
+
+    async def iter_query_results(self, query_json, num_trades: int = -1, max_priced_listings: int = None, stop_when: Callable[[Listing], bool] = None, prefetch_chunks: int = DEFAULT_PREFETCH_CHUNKS) -> AsyncIterator[Optional[Listing]]:
+        """
+        Performs a trade search and yields the results as each chunk of listings arrives. Up to prefetch_chunks chunks
+        are fetched ahead of the one being consumed, and any which are still pending are cancelled when iteration stops.
+        :param query_json: The search parameters
+        :param num_trades: Restrict the fetch to only pull the first n trades, negative values will pull the first page.
+        :param max_priced_listings: Stop after this many listings with a price have been yielded
+        :param stop_when: Stop before yielding the first listing for which this returns True, e.g. when the price exceeds a threshold on a search sorted by price
+        :param prefetch_chunks: The number of chunks fetched concurrently with the chunk being consumed
+        :return: An async iterator over the listings, in the order returned by the search
+        """
+        id, trades = await self.send_search_request(query_json)
+        if num_trades >= 0:
+            trades = trades[:num_trades]
+
+        trade_chunks = iter(to_chunks(trades, MAX_LISTINGS_PER_REQUEST))
+        pending = deque()
+
+        def schedule_chunks():
+            while len(pending) <= prefetch_chunks:
+                chunk = next(trade_chunks, None)
+                if chunk is None:
+                    return
+                pending.append(asyncio.ensure_future(self.get_search_results(id, chunk)))
+
+        priced_listings = 0
+        try:
+            schedule_chunks()
+            while pending:
+                chunk_result = await pending.popleft()
+                schedule_chunks()
+                for listing in parse_listings(chunk_result['result']):
+                    if stop_when is not None and listing is not None and stop_when(listing):
+                        return
+                    yield listing
+                    if is_priced(listing):
+                        priced_listings += 1
+                        if max_priced_listings is not None and priced_listings >= max_priced_listings:
+                            return
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def fetch_query_results(self, query_json, num_trades: int = -1) -> List[Optional[Listing]]:
+        """
+        Performs a trade search and returns the results, fetching all chunks of listings concurrently.
+        :param query_json: The search parameters
+        :param num_trades: Restrict the fetch to only pull the first n trades, negative values will pull the first page.
+        :return: A list of listings, in the order returned by the search
+        """
+        id, trades = await self.send_search_request(query_json)
+        if num_trades >= 0:
+            trades = trades[:num_trades]
+
+        trade_chunks = to_chunks(trades, MAX_LISTINGS_PER_REQUEST)
+
+        chunk_results = await asyncio.gather(*[self.get_search_results(id, chunk) for chunk in trade_chunks])
+        return parse_listings(chain.from_iterable(chunk_result['result'] for chunk_result in chunk_results))
+
+    async def fetch_many_query_results(self, queries: Iterable, num_trades: int = -1) -> List[List[Optional[Listing]]]:
+        """
+        Performs several trade searches concurrently, pipelining the searches and fetches of every query
+        :param queries: The search parameters of each query
+        :param num_trades: Restrict each fetch to only pull the first n trades, negative values will pull the first page.
+        :return: A list holding the listings of each query, in the order the queries were given
+        """
+        return list(await asyncio.gather(*[self.fetch_query_results(query, num_trades) for query in queries]))
+
+
+def fetch_many_query_results(queries: Iterable, num_trades: int = -1, max_connections: int = DEFAULT_MAX_CONNECTIONS, league: Union[str, League] = None) -> List[List[Optional[Listing]]]:
+    """
+    Performs several trade searches concurrently, for use from synchronous code
+    :param queries: The search parameters of each query
+    :param num_trades: Restrict each fetch to only pull the first n trades, negative values will pull the first page.
+    :param max_connections: The maximum number of simultaneously open connections to the trade API
+    :param league: The league to search, defaults to the current challenge league
+    :return: A list holding the listings of each query, in the order the queries were given
+    """
+    async def run():
+        async with AsyncTradeClient(max_connections=max_connections, league=league) as client:
+            return await client.fetch_many_query_results(queries, num_trades)
+
+    return asyncio.run(run())
@@ -0,0 +1,231 @@
+# A compact, memory-mapped file format for the trade API item catalogue.
+#
+# Layout (little endian):
+#   header        magic, version, fetched timestamp, metadata length, record count, named record count
+#   metadata      utf-8 json holding the response validators (etag, last-modified) and the category ranges
+#   name index    one uint32 per named record, holding record indices sorted by item name
+#   record table  ten uint32 per record, an (offset, length) pair into the string blob for each item field
+#   string blob   utf-8 encoded field values
+#
+# Records are stored grouped by category, so each category is a contiguous range of records. Nothing is parsed on
+# load beyond the header and metadata, so opening the cache is near instant and every process opening the same file
+# shares the operating system's page cache rather than holding its own copy of the catalogue.
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from time import time
+from typing import Iterable, Optional, Union
+
+ITEM_CACHE_MAGIC = b'POEITEMS'
+ITEM_CACHE_VERSION = 1
+
+ITEM_FIELDS = ('type', 'text', 'name', 'flags', 'disc')
+
+_header = struct.Struct('<8sHdIII')
+_fetched_at = struct.Struct('<d')
+_fetched_at_offset = 10  # magic (8) + version (2)
+_missing = 0xFFFFFFFF
+
+
+class InvalidItemCacheException(Exception):
+    pass
+
+
+def _align(offset: int, alignment: int = 4) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def write_item_cache(path: Union[str, Path], items_json: Iterable[dict], etag: str = None, last_modified: str = None, fetched_at: float = None):
+    """
+    Writes the item catalogue to the cache file. The file is replaced atomically, so processes which have the previous
+    version mapped keep a consistent view of it.
+
+    :param path: The path of the cache file
+    :param items_json: The 'result' list of the trade API's item data endpoint
+    :param etag: The ETag header of the response the catalogue was read from
+    :param last_modified: The Last-Modified header of the response the catalogue was read from
+    :param fetched_at: The unix timestamp the catalogue was fetched at, defaults to now
+    """
+    path = Path(path)
+    fetched_at = time() if fetched_at is None else fetched_at
+
+    blob = bytearray()
+    records = []
+    categories = []
+    for category in items_json:
+        start = len(records)
+        for item in category['entries']:
+            record = []
+            for field in ITEM_FIELDS:
+                value = item.get(field)
+                if value is None:
+                    record.extend((_missing, 0))
+                    continue
+                encoded = (json.dumps(value, separators=(',', ':')) if field == 'flags' else value).encode('utf-8')
+                record.extend((len(blob), len(encoded)))
+                blob.extend(encoded)
+            records.append((item.get('name'), record))
+        # the api may split a label across several entries, these are merged into one range when read
+        categories.append([category['label'], start, len(records)])
+
+    name_index = sorted((index for index, (name, _) in enumerate(records) if name is not None), key=lambda index: records[index][0])
+
+    metadata = json.dumps({'etag': etag, 'last_modified': last_modified, 'categories': categories}).encode('utf-8')
+    header = _header.pack(ITEM_CACHE_MAGIC, ITEM_CACHE_VERSION, fetched_at, len(metadata), len(records), len(name_index))
+    padding = b'\x00' * (_align(len(header) + len(metadata)) - len(header) - len(metadata))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as cache_file:
+            cache_file.write(header)
+            cache_file.write(metadata)
+            cache_file.write(padding)
+            cache_file.write(struct.pack(f'<{len(name_index)}I', *name_index))
+            cache_file.write(struct.pack(f'<{len(records) * 2 * len(ITEM_FIELDS)}I', *(value for _, record in records for value in record)))
+            cache_file.write(blob)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def touch_item_cache(path: Union[str, Path], fetched_at: float = None):
+    """
+    Marks the cache as freshly validated, used when the server reports the catalogue has not been modified
+
+    :param path: The path of the cache file
+    :param fetched_at: The unix timestamp the catalogue was validated at, defaults to now
+    """
+    with open(path, 'r+b') as cache_file:
+        cache_file.seek(_fetched_at_offset)
+        cache_file.write(_fetched_at.pack(time() if fetched_at is None else fetched_at))
+
+
+class ItemCacheFile(object):
+    def __init__(self, path: Union[str, Path]):
+        """
+        A read-only, memory-mapped view of an item cache file
+
+        :param path: The path of the cache file
+        """
+        self.path = Path(path)
+        with open(self.path, 'rb') as cache_file:
+            try:
+                self._map = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file cannot be mapped
+                raise InvalidItemCacheException(f'Item cache {self.path} is empty') from None
+        try:
+            self._read_layout()
+        except BaseException:
+            self._map.close()
+            raise
+
+    def _read_layout(self):
+        if len(self._map) < _header.size:
+            raise InvalidItemCacheException(f'Item cache {self.path} is truncated')
+        magic, version, _, metadata_length, self._record_count, named_count = _header.unpack_from(self._map)
+        if magic != ITEM_CACHE_MAGIC or version != ITEM_CACHE_VERSION:
+            raise InvalidItemCacheException(f'Item cache {self.path} is not a version {ITEM_CACHE_VERSION} item cache')
+
+        metadata_end = _header.size + metadata_length
+        try:
+            metadata = json.loads(self._map[_header.size:metadata_end].decode('utf-8'))
+            self.etag = metadata['etag']
+            self.last_modified = metadata['last_modified']
+            self._categories = {}
+            for label, start, end in metadata['categories']:
+                self._categories.setdefault(label, []).append(range(start, end))
+        except (ValueError, KeyError, TypeError) as e:
+            raise InvalidItemCacheException(f'Item cache {self.path} has invalid metadata') from e
+
+        name_index_start = _align(metadata_end)
+        record_table_start = name_index_start + named_count * 4
+        self._strings_start = record_table_start + self._record_count * 2 * len(ITEM_FIELDS) * 4
+        if len(self._map) < self._strings_start:
+            raise InvalidItemCacheException(f'Item cache {self.path} is truncated')
+        self._view = memoryview(self._map)
+        self._name_index = self._view[name_index_start:record_table_start].cast('I')
+        self._record_table = self._view[record_table_start:self._strings_start].cast('I')
+
+    @property
+    def fetched_at(self) -> float:
+        return _fetched_at.unpack_from(self._map, _fetched_at_offset)[0]
+
+    @property
+    def age(self) -> float:
+        """The number of seconds since the catalogue was last fetched or validated"""
+        return time() - self.fetched_at
+
+    @property
+    def categories(self) -> Iterable[str]:
+        return list(self._categories.keys())
+
+    def __len__(self):
+        return self._record_count
+
+    def _field(self, index: int, field: int) -> Optional[str]:
+        offset, length = self._record_table[(index * len(ITEM_FIELDS) + field) * 2:(index * len(ITEM_FIELDS) + field) * 2 + 2]
+        if offset == _missing:
+            return None
+        start = self._strings_start + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def field(self, index: int, field: str) -> Optional[str]:
+        """
+        Reads a single field of an item from the cache, without decoding the rest of its record
+
+        :param index: The record index of the item
+        :param field: The name of the field, one of ITEM_FIELDS. Flags are returned as their json encoding
+        :return: The value of the field, or None if the item does not have it
+        """
+        return self._field(index, ITEM_FIELDS.index(field))
+
+    def record(self, index: int) -> dict:
+        """
+        Reads a single item from the cache
+
+        :param index: The record index of the item
+        :return: A dict of the item's fields, in the format returned by the trade API
+        """
+        record = {}
+        for field_index, field in enumerate(ITEM_FIELDS):
+            value = self._field(index, field_index)
+            if value is not None:
+                record[field] = json.loads(value) if field == 'flags' else value
+        return record
+
+    def category_indices(self, label: str) -> Iterable[int]:
+        return [index for index_range in self._categories.get(label, []) for index in index_range]
+
+    def name_indices(self, name: str) -> Iterable[int]:
+        """
+        Finds all records with the given item name, using a binary search over the sorted name index
+
+        :param name: The exact name of the item
+        :return: The record indices of every item with that name
+        """
+        name_field = ITEM_FIELDS.index('name')
+        low, high = 0, len(self._name_index)
+        while low < high:
+            middle = (low + high) // 2
+            if self._field(self._name_index[middle], name_field) < name:
+                low = middle + 1
+            else:
+                high = middle
+
+        indices = []
+        while low < len(self._name_index) and self._field(self._name_index[low], name_field) == name:
+            indices.append(self._name_index[low])
+            low += 1
+        return indices
+
+    def close(self):
+        self._name_index.release()
+        self._record_table.release()
+        self._view.release()
+        self._map.close()
@@ -0,0 +1,207 @@
+# A search index over the item catalogue, for prefix (autocomplete) and fuzzy (misspelling tolerant) item lookups
+import logging
+import re
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
+from typing import Container, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from Tools.API.POE.ItemCache import ItemCacheFile
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ('name', 'type')
+DEFAULT_LIMIT = 10
+DEFAULT_MIN_SCORE = 0.3  # the minimum trigram similarity of a fuzzy match
+CONFIDENT_SCORE = 0.75  # fuzzy matches scoring at least this are close enough to be used in place of an exact match
+
+# match kinds, ordered from strongest to weakest
+EXACT = 'exact'
+PREFIX = 'prefix'
+FUZZY = 'fuzzy'
+_kind_ranks = {EXACT: 0, PREFIX: 1, FUZZY: 2}
+
+
+def normalize(text: str) -> str:
+    """
+    :return: The text as it is indexed, lower case with punctuation removed, so that "Kaom's Heart" matches "kaoms heart"
+    """
+    return ' '.join(re.sub(r"[^\w\s]", '', text.casefold()).split())
+
+
+def trigrams(term: str) -> List[str]:
+    # terms are padded so that their first and last letters form trigrams of their own, weighting the ends of a word
+    padded = f'  {term} '
+    return [padded[index:index + 3] for index in range(len(padded) - 2)]
+
+
+class UnknownItemException(KeyError):
+    def __init__(self, name: str, suggestions: Sequence[str]):
+        """
+        Raised when an item name matches no item closely enough to be used
+
+        :param name: The name which was looked up
+        :param suggestions: The names of the closest matching items
+        """
+        super().__init__(f'Unknown item {name!r}' + (f', did you mean {", ".join(repr(suggestion) for suggestion in suggestions)}?' if suggestions else ''))
+        self.name = name
+        self.suggestions = list(suggestions)
+
+
+@dataclass
+class SearchResult(object):
+    index: int  # the record index of the item within the catalogue
+    field: str  # the field which matched, 'name' or 'type'
+    text: str  # the value of the field which matched
+    kind: str  # EXACT, PREFIX or FUZZY
+    score: float  # 1 for exact matches, the similarity of the match otherwise
+
+
+class ItemSearchIndex(object):
+    def __init__(self, catalogue: ItemCacheFile):
+        """
+        Indexes the names and types of every item in the catalogue. Each distinct normalized term is stored once, in
+        sorted order, so prefix lookups are a binary search to the first match followed by a scan over the consecutive
+        matches, giving trie-like lookups without a node per character. Fuzzy lookups rank terms by the proportion of
+        trigrams they share with the query, using an inverted index from each trigram to the terms containing it.
+
+        :param catalogue: The item catalogue to index
+        """
+        self.catalogue = catalogue
+
+        entries = {}  # to be formatted as {normalized term: [(record index, field, text), ...]}
+        self._discs = {}  # to be formatted as {record index: disc}, for the few items with a discriminator
+        for index in range(len(catalogue)):
+            for field in SEARCH_FIELDS:
+                text = catalogue.field(index, field)
+                if text:
+                    entries.setdefault(normalize(text), []).append((index, field, text))
+            disc = catalogue.field(index, 'disc')
+            if disc is not None:
+                self._discs[index] = disc
+
+        self._terms = sorted(entries.keys())
+        self._entries = [entries[term] for term in self._terms]
+        self._term_ids = {term: term_id for term_id, term in enumerate(self._terms)}
+
+        postings = {}
+        self._trigram_counts = []
+        for term_id, term in enumerate(self._terms):
+            term_trigrams = set(trigrams(term))
+            self._trigram_counts.append(len(term_trigrams))
+            for trigram in term_trigrams:
+                postings.setdefault(trigram, []).append(term_id)
+        self._postings: Dict[str, Tuple[int, ...]] = {trigram: tuple(term_ids) for trigram, term_ids in postings.items()}
+
+    def __len__(self):
+        return len(self._terms)
+
+    def _results(self, term_id: int, kind: str, score: float, fields: Iterable[str], disc: Optional[str], indices: Optional[Container[int]] = None) -> List[SearchResult]:
+        return [SearchResult(index, field, text, kind, score) for index, field, text in self._entries[term_id]
+                if field in fields and (disc is None or self._discs.get(index) == disc) and (indices is None or index in indices)]
+
+    def exact(self, text: str, fields: Iterable[str] = SEARCH_FIELDS, disc: str = None, indices: Container[int] = None) -> List[SearchResult]:
+        """
+        Finds the items whose name or type equals the text, ignoring case and punctuation
+        :param text: The name or type to look up
+        :param fields: The fields to match against, 'name' and/or 'type'
+        :param disc: Only match items with this discriminator, e.g. 'warfortheatlas'
+        :param indices: Only match items with these record indices, e.g. the items of one category
+        :return: The matching items, in catalogue order
+        """
+        term_id = self._term_ids.get(normalize(text))
+        return self._results(term_id, EXACT, 1.0, fields, disc, indices) if term_id is not None else []
+
+    def prefix(self, text: str, limit: int = DEFAULT_LIMIT, fields: Iterable[str] = SEARCH_FIELDS, disc: str = None, indices: Container[int] = None) -> List[SearchResult]:
+        """
+        Finds the items whose name or type starts with the text, for autocompletion
+        :param text: The start of the name or type
+        :param limit: The maximum number of results
+        :param fields: The fields to match against, 'name' and/or 'type'
+        :param disc: Only match items with this discriminator
+        :param indices: Only match items with these record indices
+        :return: The matching items, from the shortest to the longest completion
+        """
+        query = normalize(text)
+        term_ids = []
+        term_id = bisect_left(self._terms, query)
+        while term_id < len(self._terms) and self._terms[term_id].startswith(query):
+            term_ids.append(term_id)
+            term_id += 1
+
+        results = []
+        for term_id in sorted(term_ids, key=lambda term_id: len(self._terms[term_id])):
+            kind = EXACT if self._terms[term_id] == query else PREFIX
+            results.extend(self._results(term_id, kind, len(query) / len(self._terms[term_id]), fields, disc, indices))
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    def fuzzy(self, text: str, limit: int = DEFAULT_LIMIT, min_score: float = DEFAULT_MIN_SCORE, fields: Iterable[str] = SEARCH_FIELDS, disc: str = None,
+              indices: Container[int] = None) -> List[SearchResult]:
+        """
+        Finds the items whose name or type is most similar to the text, tolerating misspellings
+        :param text: The approximate name or type
+        :param limit: The maximum number of results
+        :param min_score: The minimum similarity of a match, between 0 and 1
+        :param fields: The fields to match against, 'name' and/or 'type'
+        :param disc: Only match items with this discriminator
+        :param indices: Only match items with these record indices
+        :return: The matching items, from the most to the least similar
+        """
+        query_trigrams = set(trigrams(normalize(text)))
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._postings.get(trigram, ()))
+
+        # the dice coefficient of the two trigram sets, 1 when the query and term share every trigram
+        scores = ((2 * count / (len(query_trigrams) + self._trigram_counts[term_id]), term_id) for term_id, count in shared.items())
+        results = []
+        for score, term_id in sorted((candidate for candidate in scores if candidate[0] >= min_score), key=lambda candidate: (-candidate[0], self._terms[candidate[1]])):
+            results.extend(self._results(term_id, EXACT if score == 1 else FUZZY, score, fields, disc, indices))
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    def search(self, text: str, limit: int = DEFAULT_LIMIT, fields: Iterable[str] = SEARCH_FIELDS, disc: str = None, indices: Container[int] = None) -> List[SearchResult]:
+        """
+        Finds the items best matching the text, ranking exact matches first, then completions, then fuzzy matches
+        :param text: The name or type to search for, in full or in part
+        :param limit: The maximum number of results
+        :param fields: The fields to match against, 'name' and/or 'type'
+        :param disc: Only match items with this discriminator
+        :param indices: Only match items with these record indices, e.g. the items of one category
+        :return: The matching items, from the best to the worst match
+        """
+        matches = self.prefix(text, limit, fields, disc, indices)
+        if len(matches) < limit:
+            # fuzzy matches rank below every completion, so they are only needed when there are too few completions
+            matches += self.fuzzy(text, limit, fields=fields, disc=disc, indices=indices)
+
+        results = {}
+        for result in matches:
+            key = (result.index, result.field)
+            if key not in results or (_kind_ranks[result.kind], -result.score) < (_kind_ranks[results[key].kind], -results[key].score):
+                results[key] = result
+        return sorted(results.values(), key=lambda result: (_kind_ranks[result.kind], -result.score, result.text))[:limit]
+
+    def resolve(self, text: str, fields: Iterable[str] = SEARCH_FIELDS, disc: str = None, indices: Container[int] = None) -> int:
+        """
+        Finds the single item a name refers to, e.g. when validating names read from a CSV. A misspelled name resolves
+        to its closest match, as long as that match is confident and unambiguous, and the correction is logged as a warning.
+        :param text: The name or type of the item
+        :param fields: The fields to match against, 'name' and/or 'type'
+        :param disc: Only match items with this discriminator
+        :param indices: Only match items with these record indices, e.g. the items of one category
+        :return: The record index of the item, the last in catalogue order when several items share the name
+        :raises UnknownItemException: When no item matches confidently, listing the closest matches
+        """
+        exact = self.exact(text, fields, disc, indices)
+        if exact:
+            return exact[-1].index
+
+        matches = self.fuzzy(text, limit=3, fields=fields, disc=disc, indices=indices)
+        if matches and matches[0].score >= CONFIDENT_SCORE and (len(matches) == 1 or matches[1].score < matches[0].score or matches[1].text == matches[0].text):
+            logger.warning(f'Resolved the unknown item {text!r} to {matches[0].text!r}')
+            return matches[0].index
+        raise UnknownItemException(text, list(dict.fromkeys(match.text for match in matches)))
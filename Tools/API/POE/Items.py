@@ -1,44 +1,239 @@
-from requests import get
-from dataclasses import dataclass, field
+from datetime import timedelta
 from itertools import chain
+from sys import intern
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, List, Optional, Union
 
-from Tools.API.POE import _search_headers
+from Data.Index import ITEM_CATALOGUE_CACHE
+from Tools.API.Http import api_url, get
+from Tools.API.POE import TRADE_API_NAME, _search_headers
+from Tools.API.POE.ItemCache import ItemCacheFile, InvalidItemCacheException, touch_item_cache, write_item_cache
+from Tools.API.POE.ItemIndex import SEARCH_FIELDS, ItemSearchIndex
+
+
+_flag_sets = {}  # interned flag sets, as nearly every item shares one of a handful of flag combinations
+
+
+def _intern_flags(flags: Optional[Union[dict, Iterable[str]]]) -> FrozenSet[str]:
+    # the trade API represents flags as {flag: True}, only the flags which are set are kept
+    flags = frozenset(flag for flag, value in flags.items() if value) if isinstance(flags, dict) else frozenset(flags or ())
+    return _flag_sets.setdefault(flags, flags)
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return intern(value) if value is not None else None
 
 
-@dataclass(eq=True)
 class Item(object):
-    type: str
-    text: str
-    name: str = field(default=None)
-    flags: dict = field(default=None)
-    disc: str = field(default=None)
+    """
+    An item of the trade API catalogue. Items are slotted, and their types, discriminators and flag sets are interned,
+    as the same few hundred base types are shared by thousands of items
+    """
+    __slots__ = ('type', 'text', 'name', 'flags', 'disc')
+
+    def __init__(self, type: str, text: str, name: str = None, flags: Union[dict, Iterable[str]] = None, disc: str = None):
+        self.type = intern(type)
+        self.text = text
+        self.name = name
+        self.flags = _intern_flags(flags)
+        self.disc = _intern(disc)
 
     @property
     def unique(self) -> bool:
-        return self.flags is not None and 'unique' in self.flags and self.flags['unique']
+        return 'unique' in self.flags
+
+    def __eq__(self, other):
+        return isinstance(other, Item) and all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.type, self.text, self.name, self.disc))
+
+    def __repr__(self):
+        return f"Item({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
 
     def __str__(self):
-        field_list = [attribute for attribute in dir(self) if not attribute.startswith('__')]
+        field_list = [field for field in self.__slots__ if field != 'flags' or self.flags] + ['unique']
         return ', '.join([f'{field.replace("_", " ").title()}: {getattr(self, field)}' for field in field_list if getattr(self, field) is not None])
 
 
-def _load_items_json(items_json):
-    '''
-    Formats the incoming JSON data coming from the POE API
-    :param json: A parsed json object from the POE data site
+ITEM_CATALOGUE_PATH = '/api/trade/data/items'
+ITEM_CATALOGUE_TTL = timedelta(days=1)
+
+
+class ItemCatalogue(ItemCacheFile):
+    """The trade API item catalogue, read on demand from the memory-mapped item cache"""
+    _search_index = None
+    _category_index_sets = None
+
+    def item(self, index: int) -> Item:
+        return Item(**self.record(index))
+
+    def category(self, label: str) -> List[Item]:
+        return [self.item(index) for index in self.category_indices(label)]
+
+    def by_name(self, name: str) -> Optional[Item]:
+        """
+        Looks up an item by its exact name
+        :param name: The name of the item
+        :return: The item of that name, or None if no such item exists
+        """
+        indices = self.name_indices(name)
+        return self.item(indices[-1]) if indices else None
+
+    def categorized_items(self) -> Dict[str, List[Item]]:
+        return {label: self.category(label) for label in self.categories}
+
+    def _category_index_set(self, label: str) -> FrozenSet[int]:
+        # the record indices of each category searched within, kept for repeated searches of the same category
+        if self._category_index_sets is None:
+            self._category_index_sets = {}
+        indices = self._category_index_sets.get(label)
+        if indices is None:
+            indices = self._category_index_sets[label] = frozenset(self.category_indices(label))
+        return indices
+
+    @property
+    def search_index(self) -> ItemSearchIndex:
+        """The name and type search index of the catalogue, built the first time it is needed"""
+        if self._search_index is None:
+            self._search_index = ItemSearchIndex(self)
+        return self._search_index
+
+    def search(self, text: str, limit: int = 10, category: str = None, disc: str = None) -> List[Item]:
+        """
+        Finds the items best matching a name or type, tolerating partial and misspelled names, e.g. for autocompletion
+        :param text: The name or type to search for, in full or in part
+        :param limit: The maximum number of items returned
+        :param category: Only return items of this category, e.g. 'Prophecies'
+        :param disc: Only return items with this discriminator, e.g. 'warfortheatlas'
+        :return: The matching items, from the best to the worst match
+        """
+        indices = self._category_index_set(category) if category is not None else None
+        return [self.item(result.index) for result in self.search_index.search(text, limit, disc=disc, indices=indices)]
+
+    def resolve(self, text: str, fields: Iterable[str] = SEARCH_FIELDS, disc: str = None, category: str = None) -> Item:
+        """
+        Finds the single item a name refers to, correcting confident misspellings
+        :param text: The name or type of the item
+        :param fields: The fields to match against, 'name' and/or 'type'
+        :param disc: Only match items with this discriminator
+        :param category: Only match items of this category, so that a misspelling is never corrected to an item of another kind
+        :return: The item
+        :raises UnknownItemException: When no item matches confidently, listing the closest matches
+        """
+        indices = self._category_index_set(category) if category is not None else None
+        return self.item(self.search_index.resolve(text, fields, disc, indices))
+
+
+def _refresh_item_cache(max_age: timedelta):
+    """
+    Ensures the item cache exists and is no older than the given age. A stale cache is revalidated against the
+    trade API using its ETag and Last-Modified validators, so the catalogue is only downloaded again when it has changed.
+    """
+    try:
+        cache = ItemCacheFile(ITEM_CATALOGUE_CACHE)
+    except (FileNotFoundError, InvalidItemCacheException, ValueError):
+        cache = None
+
+    if cache is not None and cache.age < max_age.total_seconds():
+        cache.close()
+        return
+
+    headers = dict(_search_headers)
+    if cache is not None:
+        if cache.etag is not None:
+            headers['if-none-match'] = cache.etag
+        if cache.last_modified is not None:
+            headers['if-modified-since'] = cache.last_modified
+        cache.close()
+
+    response = get(api_url(TRADE_API_NAME, ITEM_CATALOGUE_PATH), headers=headers)
+    if response.status_code == 304:
+        touch_item_cache(ITEM_CATALOGUE_CACHE)
+        return
+
+    response.raise_for_status()
+    write_item_cache(ITEM_CATALOGUE_CACHE, response.json()['result'], etag=response.headers.get('etag'), last_modified=response.headers.get('last-modified'))
+
+
+_item_catalogue = None
+_categorized_items = None
+_items_by_name = None
+_item_catalogue_lock = Lock()
+
+
+def _open_item_catalogue() -> Optional[ItemCatalogue]:
+    try:
+        return ItemCatalogue(ITEM_CATALOGUE_CACHE)
+    except (FileNotFoundError, InvalidItemCacheException, ValueError):
+        return None
+
+
+def _current_item_catalogue(max_age: timedelta) -> ItemCatalogue:
+    # called with _item_catalogue_lock held, so that a refresh never races with building the derived snapshots
+    global _item_catalogue, _categorized_items, _items_by_name
+    if _item_catalogue is None or _item_catalogue.age >= max_age.total_seconds():
+        # the stale catalogue is not closed, as callers may still be reading it or its search index. Only the reference
+        # held here is dropped before the refresh replaces the file, and the map is released with the last reference
+        _item_catalogue = None
+        _categorized_items = _items_by_name = None
+        try:
+            _refresh_item_cache(max_age)
+        except BaseException:
+            # a failed refresh keeps serving the previous catalogue, and is retried on the next request
+            _item_catalogue = _open_item_catalogue()
+            raise
+        _item_catalogue = ItemCatalogue(ITEM_CATALOGUE_CACHE)
+    return _item_catalogue
+
+
+def _current_categorized_items() -> Dict[str, List[Item]]:
+    global _categorized_items
+    catalogue = _current_item_catalogue(ITEM_CATALOGUE_TTL)
+    if _categorized_items is None:
+        _categorized_items = catalogue.categorized_items()
+    return _categorized_items
+
+
+def get_item_catalogue(max_age: timedelta = ITEM_CATALOGUE_TTL) -> ItemCatalogue:
+    """
+    Retrieves the item catalogue of the trade API, from the local item cache. The cache is refreshed the first time
+    the catalogue is requested, or when it becomes older than max_age, which also discards the categorized items and
+    items by name built from the previous catalogue. Catalogues returned before a refresh remain readable.
+    :param max_age: The maximum age of the cached catalogue before it is revalidated against the trade API
+    :return: The memory-mapped item catalogue
+    """
+    with _item_catalogue_lock:
+        return _current_item_catalogue(max_age)
+
+
+def get_categorized_items():
+    """
+    Retrieves the item catalogue of the trade API as item objects, loading it the first time it is requested, and
+    again whenever the catalogue is refreshed
     :return: A dict of categories, each with individual item objects
-    '''
-    categories = {}
-    for category in items_json:
-        category_items = []
-        for item in category['entries']:
-            category_items.append(Item(**item))
-        if category['label'] in categories:
-            categories[category['label']].extend(category_items)
-        else:
-            categories[category['label']] = category_items
-    return categories
-
-
-CATEGORIZED_ITEMS = _load_items_json(get('https://www.pathofexile.com/api/trade/data/items', headers=_search_headers).json()['result'])
-ITEMS_BY_NAME = {item.name: item for item in chain.from_iterable(CATEGORIZED_ITEMS.values())}
+    """
+    with _item_catalogue_lock:
+        return _current_categorized_items()
+
+
+def get_items_by_name():
+    """
+    Retrieves the item catalogue of the trade API, indexed by item name
+    :return: A dict of item names, each with the item object of that name
+    """
+    global _items_by_name
+    with _item_catalogue_lock:
+        categorized_items = _current_categorized_items()
+        if _items_by_name is None:
+            _items_by_name = {item.name: item for item in chain.from_iterable(categorized_items.values())}
+        return _items_by_name
+
+
+def __getattr__(name):
+    # the catalogue is loaded on first access, rather than on import
+    if name == 'CATEGORIZED_ITEMS':
+        return get_categorized_items()
+    if name == 'ITEMS_BY_NAME':
+        return get_items_by_name()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
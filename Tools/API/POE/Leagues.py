@@ -1,6 +1,10 @@
-import requests
 from urllib.parse import quote
 
+from Tools.API import API_Names
+from Tools.API.Http import api_url, get
+
+TRADE_API_NAME = API_Names.PATH_OF_EXILE_TRADE
+
 
 class League(object):
     def __init__(self, id: str, text: str):
@@ -20,12 +24,27 @@ def get_active_leagues():
     This method pulls all public leagues currently available in Path of Exile
     :return: A list containing league objects, representing each currently active league
     """
-    response = requests.get(url="https://www.pathofexile.com/api/trade/data/leagues")
+    response = get(api_url(TRADE_API_NAME, '/api/trade/data/leagues'))
     response_data = response.json()
-    for item in response.headers.items():
-        print(item)
-
     return [League(league_data['id'], league_data['text']) for league_data in response_data['result']]
 
 
-DEFAULT_LEAGUE = get_active_leagues()[0]
+_default_league = None
+
+
+def get_default_league():
+    """
+    Retrieves the first active league, looking up the active leagues the first time it is requested
+    :return: A league object, representing the default league
+    """
+    global _default_league
+    if _default_league is None:
+        _default_league = get_active_leagues()[0]
+    return _default_league
+
+
+def __getattr__(name):
+    # the default league is looked up on first access, rather than on import
+    if name == 'DEFAULT_LEAGUE':
+        return get_default_league()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,72 @@
+from collections import Counter
+from datetime import datetime
+from sys import intern
+from typing import Iterable, List, Optional
+
+
+def _parse_indexed(indexed: str) -> int:
+    # the trade api reports the time a listing was indexed in UTC, e.g. '2021-01-24T03:41:08Z'
+    return int(datetime.fromisoformat(indexed.replace('Z', '+00:00')).timestamp())
+
+
+def _links(sockets: Iterable[dict]) -> int:
+    groups = Counter(socket['group'] for socket in sockets)
+    return max(groups.values(), default=0)
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # item names, types, currencies and sellers repeat across many listings, so each distinct value is stored once
+    return intern(value) if value is not None else None
+
+
+class Listing(object):
+    """
+    A listing returned by the trade API, reduced to the fields used for pricing and tracking. The full listing JSON
+    holds dozens of unused fields, such as icons, mods and descriptions, which are dropped when it is parsed.
+    """
+    __slots__ = ('id', 'name', 'type', 'ilvl', 'links', 'amount', 'currency', 'indexed', 'seller')
+
+    def __init__(self, id: str, name: str, type: str, ilvl: Optional[int], links: int, amount: Optional[float], currency: Optional[str], indexed: int, seller: Optional[str]):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.ilvl = ilvl
+        self.links = links
+        self.amount = amount
+        self.currency = currency
+        self.indexed = indexed  # the unix timestamp at which the listing was indexed
+        self.seller = seller
+
+    @classmethod
+    def from_json(cls, listing_json: dict) -> 'Listing':
+        """
+        :param listing_json: A listing as returned by the trade API's fetch endpoint
+        :return: The listing, keeping only the fields in Listing.__slots__
+        """
+        details = listing_json['listing']
+        item = listing_json['item']
+        price = details.get('price') or {}
+        return cls(id=listing_json['id'], name=_intern(item.get('name', '')), type=_intern(item.get('typeLine', '')), ilvl=item.get('ilvl'),
+                   links=_links(item.get('sockets', [])), amount=price.get('amount'), currency=_intern(price.get('currency')),
+                   indexed=_parse_indexed(details['indexed']), seller=_intern(details.get('account', {}).get('name')))
+
+    @property
+    def priced(self) -> bool:
+        return self.amount is not None and self.currency is not None
+
+    def __eq__(self, other):
+        return isinstance(other, Listing) and all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"Listing({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
+
+
+def parse_listings(listings_json: Iterable[Optional[dict]]) -> List[Optional[Listing]]:
+    """
+    :param listings_json: The 'result' list of the trade API's fetch endpoint
+    :return: The parsed listings, with listings missing from the response left as None
+    """
+    return [Listing.from_json(listing) if listing is not None else None for listing in listings_json]
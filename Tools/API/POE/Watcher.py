@@ -0,0 +1,257 @@
+# Watches saved searches for listings which appear, disappear or change price, fetching only the listings which changed
+from bisect import bisect_left
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import timedelta
+from math import ceil
+from queue import Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+from Tools import to_chunks
+from Tools.API.Metrics import metrics
+from Tools.API.POE import INTERACTIVE_PRIORITY, MAX_LISTINGS_PER_REQUEST, MAX_LISTINGS_PER_SEARCH, TradeClient, get_trade_client, get_trade_scheduler, listing_cache
+from Tools.API.POE.Leagues import League
+from Tools.API.POE.Listings import Listing, parse_listings
+
+DEFAULT_POLL_INTERVAL = timedelta(seconds=30)
+
+# kinds of ListingEvent
+NEW = 'new'
+REMOVED = 'removed'
+PRICE_CHANGED = 'price_changed'
+
+_polls = metrics.counter('watcher_polls_total', 'Searches run by the watcher', ('query',))
+_fetches = metrics.counter('watcher_fetches_total', 'Fetch requests made by the watcher, at most one per ten changed listings', ('query',))
+_events = metrics.counter('watcher_events_total', 'Listing events emitted by the watcher', ('query', 'kind'))
+_errors = metrics.counter('watcher_errors_total', 'Polls which failed', ('query',))
+
+
+@dataclass
+class WatchedQuery(object):
+    name: str  # identifies the query in events, and must be unique within a watcher
+    query_json: Union[str, dict]  # the search parameters, typically sorted by price
+    league: Union[str, League] = None  # the league to search, defaults to the current challenge league
+    num_trades: int = -1  # only watch the first n results, negative values will watch the first page
+    # price changes which keep a listing's place in the results are not seen by comparing trade ids, so the first n
+    # results are fetched again every refetch_every polls to catch them, at the cost of a fetch per ten listings
+    refetch_top: int = 0
+    refetch_every: int = 10
+
+
+@dataclass
+class ListingEvent(object):
+    kind: str  # NEW, REMOVED or PRICE_CHANGED
+    query: str  # the name of the watched query
+    listing: Listing  # the listing as it is now, or as it was last seen for removed listings
+    previous: Optional[Listing] = None  # the listing before its price changed
+    rank: Optional[int] = None  # the position of the listing within the search results, None for removed listings
+
+
+def moved_ids(previous_ranks: Dict[str, int], trade_ids: Sequence[str]) -> List[str]:
+    """
+    Finds the listings which moved relative to the other listings of a search, rather than only shifting as listings
+    were added or removed around them. In a search sorted by price, these are the listings whose price changed.
+
+    :param previous_ranks: The rank of each listing in the previous results of the search, formatted as {trade id: rank}
+    :param trade_ids: The current results of the search
+    :return: The trade ids which were in both results, but are out of their previous order
+    """
+    # the listings kept in order are the longest subsequence whose previous ranks are still increasing
+    known = [trade_id for trade_id in trade_ids if trade_id in previous_ranks]
+    ranks = [previous_ranks[trade_id] for trade_id in known]
+    tails = []  # tails[length - 1] is the smallest final rank of any increasing subsequence of that length
+    tail_indices = []
+    predecessors = [-1] * len(ranks)
+    for index, rank in enumerate(ranks):
+        length = bisect_left(tails, rank)
+        if length == len(tails):
+            tails.append(rank)
+            tail_indices.append(index)
+        else:
+            tails[length] = rank
+            tail_indices[length] = index
+        predecessors[index] = tail_indices[length - 1] if length else -1
+
+    in_order = set()
+    index = tail_indices[-1] if tail_indices else -1
+    while index >= 0:
+        in_order.add(index)
+        index = predecessors[index]
+    return [trade_id for index, trade_id in enumerate(known) if index not in in_order]
+
+
+def _price(listing: Optional[Listing]):
+    return (listing.amount, listing.currency) if listing is not None else None
+
+
+class _QueryState(object):
+    def __init__(self):
+        self.listings: Dict[str, Optional[Listing]] = {}  # every listing in the last results, None for listings which could not be fetched
+        self.ranks: Dict[str, int] = {}  # the rank of each listing in the last results
+        self.initialized = False
+        self.polls = 0
+        self.lock = Lock()  # held for a whole poll, so that polls of the same query never overlap
+
+
+class ListingWatcher(object):
+    def __init__(self, queries: Iterable[WatchedQuery], interval: Union[float, timedelta] = DEFAULT_POLL_INTERVAL, callback: Callable[[ListingEvent], None] = None,
+                 priority: int = INTERACTIVE_PRIORITY, emit_initial: bool = False):
+        """
+        Polls saved searches on a schedule, comparing the trade ids each search returns against those it returned
+        before. Only listings which are new, which moved within the results, or which could not be fetched before are
+        fetched, so once the results are known a poll costs a single search request unless listings changed. Queries
+        with refetch_top set also fetch their first results periodically, to catch price changes which kept the order
+        of the results. Polls are queued on the trade scheduler, sharing the trade API's ratelimit with every other search.
+
+        Events are passed to the callback from a scheduler thread, or put on the events queue when there is no callback.
+
+        :param queries: The searches to watch
+        :param interval: The time between the start of each poll of a search, as a timedelta or a number of seconds
+        :param callback: Called with every ListingEvent
+        :param priority: The priority polls are queued with, interactive by default so that new listings are reported within one interval
+        :param emit_initial: Whether to report the listings found by the first poll as new
+        """
+        self.queries = {query.name: query for query in queries}
+        self.interval = interval.total_seconds() if isinstance(interval, timedelta) else interval
+        self.callback = callback
+        self.priority = priority
+        self.emit_initial = emit_initial
+        self.events: 'Queue[ListingEvent]' = Queue()
+        self.errors: Dict[str, BaseException] = {}  # the last exception raised by the polls of each query
+        self._states = {name: _QueryState() for name in self.queries}
+        self._polls: Dict[str, Future] = {}  # the last queued poll of each query
+        self._stop = Event()
+        self._thread = None
+
+    def _emit(self, event: ListingEvent):
+        _events.labels(event.query, event.kind).inc()
+        if self.callback is not None:
+            self.callback(event)
+        else:
+            self.events.put(event)
+
+    @staticmethod
+    def _fetch(client: TradeClient, query: WatchedQuery, search_id: str, trade_ids: List[str]) -> Dict[str, Optional[Listing]]:
+        listings = {}
+        for chunk in to_chunks(trade_ids, MAX_LISTINGS_PER_REQUEST):
+            _fetches.labels(query.name).inc()
+            for trade_id, listing in zip(chunk, parse_listings(client.get_search_results(search_id, chunk)['result'])):
+                listings[trade_id] = listing
+                if listing is not None:
+                    listing_cache.set(trade_id, listing)
+        return listings
+
+    def poll(self, name: str) -> List[ListingEvent]:
+        """
+        Runs a watched search once, emitting an event for every listing which appeared, disappeared or changed price
+        since the last poll
+        :param name: The name of the watched query
+        :return: The events emitted
+        """
+        query = self.queries[name]
+        state = self._states[name]
+        client = get_trade_client(query.league)
+        with state.lock:
+            _polls.labels(name).inc()
+            state.polls += 1
+            search_id, trade_ids = client.send_search_request(query.query_json)
+            if query.num_trades >= 0:
+                trade_ids = trade_ids[:query.num_trades]
+
+            # listings which could not be fetched are fetched again, as they are usually only briefly unavailable
+            new = [trade_id for trade_id in trade_ids if state.listings.get(trade_id) is None]
+            moved = moved_ids(state.ranks, trade_ids) if state.initialized else []
+            refetched = trade_ids[:query.refetch_top] if state.initialized and query.refetch_top > 0 and state.polls % query.refetch_every == 0 else []
+            fetched = self._fetch(client, query, search_id, list(dict.fromkeys(new + moved + refetched)))
+
+            events = []
+            for rank, trade_id in enumerate(trade_ids):
+                if trade_id not in fetched:
+                    continue
+                listing, previous = fetched[trade_id], state.listings.get(trade_id)
+                state.listings[trade_id] = listing
+                if listing is None:
+                    continue
+                if previous is None and (state.initialized or self.emit_initial):
+                    events.append(ListingEvent(NEW, name, listing, rank=rank))
+                elif previous is not None and _price(listing) != _price(previous):
+                    events.append(ListingEvent(PRICE_CHANGED, name, listing, previous=previous, rank=rank))
+
+            current = set(trade_ids)
+            for trade_id in [trade_id for trade_id in state.listings if trade_id not in current]:
+                listing = state.listings.pop(trade_id)
+                if listing is not None:
+                    events.append(ListingEvent(REMOVED, name, listing))
+
+            state.ranks = {trade_id: rank for rank, trade_id in enumerate(trade_ids)}
+            state.initialized = True
+
+        for event in events:
+            self._emit(event)
+        return events
+
+    def _record_error(self, name: str, poll: Future):
+        exception = poll.exception() if not poll.cancelled() else None
+        if exception is not None:
+            _errors.labels(name).inc()
+            self.errors[name] = exception
+
+    def _expected_requests(self, name: str) -> int:
+        # the search, and a fetch for every ten listings the next poll is known to fetch. Listings which changed since
+        # the last poll cannot be known in advance, and reserve their own slots as they are fetched
+        query, state = self.queries[name], self._states[name]
+        if not state.initialized:
+            listings = query.num_trades if query.num_trades >= 0 else MAX_LISTINGS_PER_SEARCH
+        elif query.refetch_top > 0 and (state.polls + 1) % query.refetch_every == 0:
+            listings = query.refetch_top
+        else:
+            listings = 0
+        return 1 + ceil(listings / MAX_LISTINGS_PER_REQUEST)
+
+    def schedule_polls(self):
+        """
+        Queues a poll of every watched search on the trade scheduler, skipping searches whose last poll has not finished
+        """
+        for name in self.queries:
+            poll = self._polls.get(name)
+            if poll is None or poll.done():
+                poll = get_trade_scheduler().submit(self.poll, name, priority=self.priority, key=('watch', id(self), name), requests=self._expected_requests(name))
+                poll.add_done_callback(lambda poll, name=name: self._record_error(name, poll))
+                self._polls[name] = poll
+
+    def _run(self):
+        next_poll = monotonic()
+        while not self._stop.is_set():
+            self.schedule_polls()
+            next_poll += self.interval
+            # a poll interval which was missed entirely is skipped, rather than polling several times to catch up
+            next_poll = max(next_poll, monotonic())
+            self._stop.wait(next_poll - monotonic())
+
+    def start(self):
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='Listing watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """
+        Stops scheduling polls
+        :param wait: Whether to wait for polls which are already queued or running to finish
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if wait:
+            for poll in list(self._polls.values()):
+                if not poll.cancelled():
+                    poll.exception()
+
+    def __enter__(self) -> 'ListingWatcher':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -1,114 +1,390 @@
-from requests import post, get
-from copy import deepcopy
-from json import loads
+from concurrent.futures import Future
+from datetime import timedelta
+from functools import lru_cache
+from hashlib import sha1
+from json import dumps, loads
+from math import ceil
+from threading import Lock
+from time import sleep
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+from urllib.parse import quote
+
+from requests import RequestException
 
-from typing import Iterable
-from itertools import chain
-from Tools import to_chunks
 from Tools.API import API_Names
-from Tools.API.Ratelimiting import RatelimitRule, create_ratelimit, ratelimit
+from Tools.API.Cache import TTLCache
+from Tools.API.Http import api_url, get, post
+from Tools.API.POE.Leagues import League, get_active_leagues, get_default_league
+from Tools.API.POE.Listings import Listing, parse_listings
+from Tools.API.Ratelimiting import DEFAULT_RETRY_BACKOFF, RatelimitRule, RatelimitScheduler, create_lazy_ratelimit, create_ratelimit_from_headers, get_ratelimit, parse_ratelimit_headers, \
+    ratelimit, update_ratelimit_from_response
 
 # extract related enums for convenience
 POE_API_NAME = API_Names.PATH_OF_EXILE
 TRADE_API_NAME = API_Names.PATH_OF_EXILE_TRADE
 
-LEAGUE = 'Ritual'
 MAX_LISTINGS_PER_REQUEST = 10
+MAX_LISTINGS_PER_SEARCH = 100  # the trade ids returned by a search, its first page of results
+
+# the permanent league searched to discover the trade API's ratelimit rules, which are shared by every league
+RATELIMIT_DISCOVERY_LEAGUE = 'Standard'
+RATELIMIT_DISCOVERY_ATTEMPTS = 3
+# the strictest rules the trade API has announced for searches, used when discovery fails rather than leaving requests unlimited
+TRADE_API_FALLBACK_RULES = (RatelimitRule(8, 10, timeout=60), RatelimitRule(15, 60, timeout=120), RatelimitRule(60, 300, timeout=1800))
+
+# priorities of jobs queued on the trade scheduler, interactive lookups are started ahead of any queued background scan
+INTERACTIVE_PRIORITY = 10
+BACKGROUND_PRIORITY = 0
+
+SEARCH_CACHE_TTL = timedelta(minutes=1)
+LISTING_CACHE_TTL = timedelta(minutes=10)
+
+# searches cached by query fingerprint, and listings cached by trade id
+search_cache = TTLCache(max_size=1024, ttl=SEARCH_CACHE_TTL, name='search')
+listing_cache = TTLCache(max_size=100_000, ttl=LISTING_CACHE_TTL, name='listing')
 
 _search_headers = {
     'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.141 Safari/537.36',
     'content-type': 'application/json',
     'origin': 'https://www.pathofexile.com',
-    'referer': f'https://www.pathofexile.com/trade/search/{LEAGUE}'
+    'referer': 'https://www.pathofexile.com/trade'
 }
 
 _search_result_headers = {
     'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.141 Safari/537.36',
     'content-type': 'application/json',
     'origin': 'https://www.pathofexile.com',
-    'referer': f'https://www.pathofexile.com/trade/search/{LEAGUE}/{{trade_search_id}}'
+    'referer': 'https://www.pathofexile.com/trade/search/{league}/{trade_search_id}'
 }
 
 
+_trade_scheduler = None
+_trade_scheduler_lock = Lock()
+_trade_clients = {}  # to be formatted as {league id: TradeClient}
+_trade_clients_lock = Lock()
+
+
 class TooManyListingsException(Exception):
     pass
 
 
-def _get_trade_api_ratelimit_rules():
-    generic_trade_json = '{"query":{"status":{"option":"online"},"stats":[{"type":"and","filters":[]}]},"sort":{"price":"asc"}}'
-    response = post(f'https://www.pathofexile.com/api/trade/search/{LEAGUE}', json=generic_trade_json, headers=_search_headers)
+def league_id(league: Union[str, League, None]) -> str:
+    """
+    :param league: A league id, a league as returned by get_active_leagues, or None for the current challenge league
+    :return: The id of the league, as used in trade API urls
+    """
+    if league is None:
+        league = get_default_league()
+    return league.id if isinstance(league, League) else league
+
+
+@lru_cache(maxsize=16)
+def _get_search_headers(league: str) -> dict:
+    # the headers of each league are only built once, and must not be modified by callers
+    return dict(_search_headers, referer=f'{_search_headers["referer"]}/search/{quote(league)}')
+
 
-    rule_types = response.headers['X-Rate-Limit-Rules'].split(',')
+@lru_cache(maxsize=256)
+def _get_search_result_headers(search_id: str, league: str) -> dict:
+    # the headers of each search are only built once, and must not be modified by callers
+    return dict(_search_result_headers, referer=_search_result_headers['referer'].format(league=quote(league), trade_search_id=search_id))
 
-    rule_data = [response.headers[f'X-Rate-Limit-{rule_type}'] for rule_type in rule_types]
-    rule_data = ','.join(rule_data).split(',')
-    rule_data = set(rule_data)  # remove duplicates
 
-    rules = [[int(ruleitem) for ruleitem in rule.split(':')] for rule in rule_data]
+def _create_trade_api_ratelimit():
+    # the trade api announces its rules and their current state on every response, so a generic search is used to discover them
+    generic_trade_json = '{"query":{"status":{"option":"online"},"stats":[{"type":"and","filters":[]}]},"sort":{"price":"asc"}}'
+    headers = {}
+    for attempt in range(RATELIMIT_DISCOVERY_ATTEMPTS):
+        try:
+            response = post(api_url(TRADE_API_NAME, f'/api/trade/search/{quote(RATELIMIT_DISCOVERY_LEAGUE)}'), json=loads(generic_trade_json), headers=_get_search_headers(RATELIMIT_DISCOVERY_LEAGUE))
+        except RequestException:
+            response = None
+        if response is not None:
+            headers = response.headers
+            # a rejected search is not retried, its restriction is waited out by the ratelimit instead
+            if parse_ratelimit_headers(headers)[0] or response.status_code == 429:
+                break
+        if attempt + 1 < RATELIMIT_DISCOVERY_ATTEMPTS:
+            sleep(DEFAULT_RETRY_BACKOFF.total_seconds() * 2 ** attempt)
+
+    # without announced rules the conservative fallback rules apply, until a later response announces the real ones
+    create_ratelimit_from_headers(headers, name=TRADE_API_NAME, fallback_rules=TRADE_API_FALLBACK_RULES)
+
+
+def get_trade_api_ratelimit_rules():
+    """
+    Retrieves the ratelimit rules of the trade API, discovering them from the server the first time they are requested
+    :return: A list of RatelimitRules currently enforced by the trade API
+    """
+    return get_ratelimit(TRADE_API_NAME).rules
 
-    rules = [RatelimitRule(max_executions=max_requests - 1, interval=interval) for max_requests, interval, timeout in rules]
 
-    return rules
+create_lazy_ratelimit(_create_trade_api_ratelimit, name=TRADE_API_NAME)
 
 
-TRADE_API_RATELIMIT_RULES = _get_trade_api_ratelimit_rules()
+def __getattr__(name):
+    # module level constants which require network access are resolved on first access, rather than on import
+    if name == 'TRADE_API_RATELIMIT_RULES':
+        return get_trade_api_ratelimit_rules()
+    if name == 'LEAGUE':
+        return get_default_league().id
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
-create_ratelimit(TRADE_API_RATELIMIT_RULES, name=TRADE_API_NAME)
 
+def is_priced(listing: Optional[Listing]) -> bool:
+    """
+    :param listing: A listing returned by the fetch_query_results function
+    :return: Whether the listing has a price set by its seller
+    """
+    return listing is not None and listing.priced
 
-@ratelimit(TRADE_API_NAME)
-def send_search_request(query_json):
+
+def query_fingerprint(query_json, league: Union[str, League] = None) -> str:
     """
-    Runs a search using the supplied JSON as query parameters, returning all listings that matched said search
+    Creates a key identifying a search, which is the same for equivalent queries regardless of formatting or key order
     :param query_json: The search parameters
-    :return: (id, results): A tuple containing the Search ID and Trade IDs resulting from the search
+    :param league: The league the search is run in, defaults to the current challenge league
+    :return: A hex digest identifying the search
     """
-
     if isinstance(query_json, str):
         query_json = loads(query_json)
+    canonical_query = dumps(query_json, sort_keys=True, separators=(',', ':'))
+    return sha1(f'{league_id(league)}\n{canonical_query}'.encode('utf-8')).hexdigest()
 
-    response = post(f'https://www.pathofexile.com/api/trade/search/{LEAGUE}', json=query_json, headers=_search_headers)
-    results = response.json()
-    return results['id'], results['result']
 
+def get_trade_scheduler() -> RatelimitScheduler:
+    """
+    :return: The scheduler shared by every job queued against the trade API's ratelimit, created the first time it is needed
+    """
+    global _trade_scheduler
+    with _trade_scheduler_lock:
+        if _trade_scheduler is None:
+            _trade_scheduler = RatelimitScheduler(TRADE_API_NAME)
+        return _trade_scheduler
+
+
+class TradeClient(object):
+    def __init__(self, league: Union[str, League] = None):
+        """
+        A client for the trade API, scoped to a single league. Every client shares the TRADE_API_NAME ratelimit, the
+        pooled connections of Tools.API.Http, the search and listing caches, and the trade scheduler, so any number of
+        leagues can be searched concurrently within the one budget the trade API allows each client address.
+
+        :param league: The league to search, by id or as returned by get_active_leagues, defaults to the current challenge league
+        """
+        self.league = league_id(league)
+        self._search_path = f'/api/trade/search/{quote(self.league)}'
+        self._search_headers = _get_search_headers(self.league)
+
+    @ratelimit(TRADE_API_NAME)
+    def send_search_request(self, query_json):
+        """
+        Runs a search using the supplied JSON as query parameters, returning all listings that matched said search
+        :param query_json: The search parameters
+        :return: (id, results): A tuple containing the Search ID and Trade IDs resulting from the search
+        """
+
+        if isinstance(query_json, str):
+            query_json = loads(query_json)
+
+        response = post(api_url(TRADE_API_NAME, self._search_path), json=query_json, headers=self._search_headers)
+        update_ratelimit_from_response(response.status_code, response.headers, name=TRADE_API_NAME)
+        results = response.json()
+        return results['id'], results['result']
+
+    @ratelimit(TRADE_API_NAME)
+    def get_search_results(self, search_id: str, trade_ids: Iterable[str]):
+        """
+        Retrieves listing information from search results, by trade id.
+
+        :param search_id: The search if returned by the send_search_request function
+        :param trade_ids: Up to 10 ids returned by the send_search_request function
+        :return:
+        """
+        if len(trade_ids) > 10:
+            raise TooManyListingsException()
+
+        headers = _get_search_result_headers(search_id, self.league)
+
+        trade_id_string = ','.join(trade_ids)
+        URL = api_url(TRADE_API_NAME, f'/api/trade/fetch/{trade_id_string}?query={search_id}')
+        response = get(URL, json={'query': search_id}, headers=headers)
+        update_ratelimit_from_response(response.status_code, response.headers, name=TRADE_API_NAME)
+
+        results = response.json()
+        return results
+
+    def cached_search_request(self, query_json):
+        """
+        Runs a search like send_search_request, reusing the results of an equivalent search run within SEARCH_CACHE_TTL
+        :param query_json: The search parameters
+        :return: (id, results): A tuple containing the Search ID and Trade IDs resulting from the search
+        """
+        fingerprint = query_fingerprint(query_json, self.league)
+        search = search_cache.get(fingerprint)
+        if search is None:
+            search = self.send_search_request(query_json)
+            search_cache.set(fingerprint, search)
+        return search
+
+    def _iter_listing_windows(self, search_id: str, trades: List[str], use_cache: bool) -> Iterator[List[Optional[Listing]]]:
+        # yields the listings of consecutive runs of trade ids, each run containing at most one fetch worth of uncached ids
+        start = 0
+        while start < len(trades):
+            end = start
+            listings = {}
+            uncached = []
+            while end < len(trades) and len(uncached) < MAX_LISTINGS_PER_REQUEST:
+                listing = listing_cache.get(trades[end]) if use_cache else None
+                if listing is None:
+                    uncached.append(trades[end])
+                else:
+                    listings[trades[end]] = listing
+                end += 1
+
+            if uncached:
+                for trade_id, listing in zip(uncached, parse_listings(self.get_search_results(search_id, uncached)['result'])):
+                    listings[trade_id] = listing
+                    if listing is not None:
+                        listing_cache.set(trade_id, listing)
+
+            yield [listings[trade_id] for trade_id in trades[start:end]]
+            start = end
+
+    def iter_query_results(self, query_json, num_trades: int = -1, max_priced_listings: int = None, stop_when: Callable[[Listing], bool] = None, use_cache: bool = True) -> Iterator[Optional[Listing]]:
+        """
+        Performs a trade search and yields the results as each chunk of listings is fetched. Chunks are only fetched once
+        the previous chunk has been consumed, so stopping early saves both memory and ratelimit budget.
+        When caching is enabled, searches are reused from search_cache, and only listings missing from listing_cache are fetched.
+        :param query_json: The search parameters
+        :param num_trades: Restrict the fetch to only pull the first n trades, negative values will pull the first page.
+        :param max_priced_listings: Stop after this many listings with a price have been yielded
+        :param stop_when: Stop before yielding the first listing for which this returns True, e.g. when the price exceeds a threshold on a search sorted by price
+        :param use_cache: Whether to reuse cached searches and listings
+        :return: An iterator over the listings, in the order returned by the search, with None for listings which are no longer available
+        """
+        id, trades = self.cached_search_request(query_json) if use_cache else self.send_search_request(query_json)
+        if num_trades >= 0:
+            trades = trades[:num_trades]
+
+        priced_listings = 0
+        for listings in self._iter_listing_windows(id, trades, use_cache):
+            for listing in listings:
+                if stop_when is not None and listing is not None and stop_when(listing):
+                    return
+                yield listing
+                if is_priced(listing):
+                    priced_listings += 1
+                    if max_priced_listings is not None and priced_listings >= max_priced_listings:
+                        return
+
+    def fetch_query_results(self, query_json, num_trades: int = -1, use_cache: bool = True) -> List[Optional[Listing]]:
+        """
+        Performs a trade search and returns the results.
+        :param query_json: The search parameters
+        :param num_trades: Restrict the fetch to only pull the first n trades, negative values will pull the first page.
+        :param use_cache: Whether to reuse cached searches and listings
+        :return: A list of listings, in the order returned by the search
+        """
+        return list(self.iter_query_results(query_json, num_trades, use_cache=use_cache))
+
+    def schedule_query_results(self, query_json, num_trades: int = -1, priority: int = BACKGROUND_PRIORITY, deadline: Union[float, timedelta] = None, use_cache: bool = True) -> Future:
+        """
+        Queues a search on the trade scheduler, rather than competing for the ratelimit with every other caller.
+        Equivalent searches of the same league which are still queued are only run once.
+        :param query_json: The search parameters
+        :param num_trades: Restrict the fetch to only pull the first n trades, negative values will pull the first page.
+        :param priority: Searches with a higher priority are started first, e.g. INTERACTIVE_PRIORITY or BACKGROUND_PRIORITY
+        :param deadline: The time within which the search must start, as a timedelta or a number of seconds, after which it fails with a DeadlineExceededException
+        :param use_cache: Whether to reuse cached searches and listings
+        :return: A future which resolves to the results of fetch_query_results
+        """
+        key = ('fetch', query_fingerprint(query_json, self.league), num_trades, use_cache)
+        # the search, and a fetch for every ten listings, unless they are cached
+        requests = 1 + ceil((num_trades if num_trades >= 0 else MAX_LISTINGS_PER_SEARCH) / MAX_LISTINGS_PER_REQUEST)
+        return get_trade_scheduler().submit(self.fetch_query_results, query_json, num_trades, use_cache, priority=priority, deadline=deadline, key=key, requests=requests)
+
+    def __str__(self):
+        return f"TradeClient(League: '{self.league}')"
+
+
+def get_trade_client(league: Union[str, League] = None) -> TradeClient:
+    """
+    :param league: The league to search, by id or as returned by get_active_leagues, defaults to the current challenge league
+    :return: The client of the league, created the first time it is requested
+    """
+    league = league_id(league)
+    with _trade_clients_lock:
+        if league not in _trade_clients:
+            _trade_clients[league] = TradeClient(league)
+        return _trade_clients[league]
 
-@ratelimit(TRADE_API_NAME)
-def get_search_results(search_id: str, trade_ids: Iterable[str]):
+
+def get_league_clients(leagues: Iterable[Union[str, League]] = None) -> Dict[str, TradeClient]:
+    """
+    :param leagues: The leagues to search, defaults to every active league
+    :return: A dict of {league id: TradeClient}, in the order the leagues were given
     """
-    Retrieves listing information from search results, by trade id.
+    leagues = get_active_leagues() if leagues is None else leagues
+    return {client.league: client for client in (get_trade_client(league) for league in leagues)}
 
-    :param search_id: The search if returned by the send_search_request function
-    :param trade_ids: Up to 10 ids returned by the send_search_request function
-    :return:
+
+def schedule_league_query_results(query_json, leagues: Iterable[Union[str, League]] = None, num_trades: int = -1, priority: int = BACKGROUND_PRIORITY,
+                                  deadline: Union[float, timedelta] = None, use_cache: bool = True) -> Dict[str, Future]:
+    """
+    Queues the same search in several leagues at once, e.g. to compare the price of an item across leagues in one scan.
+    The searches share the trade API's ratelimit, so searching n leagues takes n times the budget of a single search.
+    :param query_json: The search parameters
+    :param leagues: The leagues to search, defaults to every active league
+    :param num_trades: Restrict each fetch to only pull the first n trades, negative values will pull the first page.
+    :param priority: Searches with a higher priority are started first
+    :param deadline: The time within which each search must start
+    :param use_cache: Whether to reuse cached searches and listings
+    :return: A dict of {league id: future resolving to the results of fetch_query_results}
     """
-    if len(trade_ids) > 10:
-        raise TooManyListingsException()
+    return {league: client.schedule_query_results(query_json, num_trades, priority=priority, deadline=deadline, use_cache=use_cache)
+            for league, client in get_league_clients(leagues).items()}
 
-    headers = deepcopy(_search_result_headers)
-    headers['referer'] = headers['referer'].format(trade_search_id=search_id)
 
-    trade_id_string = ','.join(trade_ids)
-    URL = f'https://www.pathofexile.com/api/trade/fetch/{trade_id_string}?query={search_id}'
-    response = get(URL, json={'query': search_id}, headers=headers)
+# the functions below search the current challenge league, through its shared client
 
-    results = response.json()
-    return results
+def send_search_request(query_json):
+    """
+    Runs a search in the current challenge league, see TradeClient.send_search_request
+    """
+    return get_trade_client().send_search_request(query_json)
 
 
-def fetch_query_results(query_json, num_trades: int = -1):
+def get_search_results(search_id: str, trade_ids: Iterable[str]):
     """
-    Performs a trade search and returns the results.
-    :param query_json: The number of trades to pull
-    :param num_trades: Restrict the fetch to only pull the first n trades, negative values will pull the first page.
-    :return:
+    Retrieves listing information from search results of the current challenge league, see TradeClient.get_search_results
     """
-    id, trades = send_search_request(query_json)
-    if num_trades >= 0:
-        trades = trades[:num_trades]
+    return get_trade_client().get_search_results(search_id, trade_ids)
 
-    trade_chunks = to_chunks(trades, MAX_LISTINGS_PER_REQUEST)
 
-    chunk_results = [get_search_results(id, chunk)['result'] for chunk in trade_chunks]  # get results for all chunks
-    results = list(chain.from_iterable(chunk_results))  # condense all results into list
+def cached_search_request(query_json):
+    """
+    Runs a search in the current challenge league, see TradeClient.cached_search_request
+    """
+    return get_trade_client().cached_search_request(query_json)
 
-    return results
+
+def iter_query_results(query_json, num_trades: int = -1, max_priced_listings: int = None, stop_when: Callable[[Listing], bool] = None, use_cache: bool = True) -> Iterator[Optional[Listing]]:
+    """
+    Performs a trade search in the current challenge league, see TradeClient.iter_query_results
+    """
+    return get_trade_client().iter_query_results(query_json, num_trades, max_priced_listings=max_priced_listings, stop_when=stop_when, use_cache=use_cache)
+
+
+def fetch_query_results(query_json, num_trades: int = -1, use_cache: bool = True):
+    """
+    Performs a trade search in the current challenge league, see TradeClient.fetch_query_results
+    """
+    return get_trade_client().fetch_query_results(query_json, num_trades, use_cache)
+
+
+def schedule_query_results(query_json, num_trades: int = -1, priority: int = BACKGROUND_PRIORITY, deadline: Union[float, timedelta] = None, use_cache: bool = True) -> Future:
+    """
+    Queues a search in the current challenge league, see TradeClient.schedule_query_results
+    """
+    return get_trade_client().schedule_query_results(query_json, num_trades, priority=priority, deadline=deadline, use_cache=use_cache)
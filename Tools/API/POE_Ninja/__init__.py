@@ -1,9 +1,19 @@
-from dataclasses import dataclass
-from typing import Dict
-
-from requests import get
-
+import json
+import os
+import tempfile
+from bisect import bisect_right
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from pathlib import Path
+from threading import Lock, Thread
+from time import time
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from Data.Index import EXCHANGE_RATE_CACHE
 from Tools.API import API_Names
+from Tools.API.Http import api_url, get
+from Tools.API.Metrics import metrics
 
 POE_NINJA_API_NAME = API_Names.PATH_OF_EXILE
 
@@ -15,20 +25,23 @@ class Currency(object):
     name: str
     tradeId: str  # the name of the currency used in POE Trade API
     chaos_value: float  # the amount of chaos that this currency is worth
+    # poe.ninja's pay and receive rates against chaos, which differ by the spread between buying and selling. Each is
+    # the amount of the paid currency offered for one of the currency received, so pay_value is this currency paid per
+    # chaos and receive_value is chaos paid per one of this currency. None where poe.ninja has no trades in that direction
+    pay_value: Optional[float] = None
+    receive_value: Optional[float] = None
 
 
-_currency_data = {}
+EXCHANGE_RATE_TTL = timedelta(minutes=15)
 
+_refreshes = metrics.counter('exchange_rate_refreshes_total', 'Exchange rates retrieved from poe.ninja', ('league',))
+_rate_age = metrics.gauge('exchange_rate_age_seconds', 'The age of the exchange rates in use', ('league',))
 
-def update_exchange_rates(league: str):
-    global _currency_data
-    print('Retrieving currency exchange rates from poe.ninja')
-    result = get(f'https://poe.ninja/api/data/currencyoverview?league={league}&type=Currency')
+
+def _fetch_exchange_rates(league: str) -> Dict[str, Currency]:
+    result = get(api_url(API_Names.POE_NINJA, f'/api/data/currencyoverview?league={quote(league)}&type=Currency'))
     result_body = result.json()
-    currency_worth_amounts = {line['currencyTypeName']: line['chaosEquivalent'] for line in result_body['lines']}
-    for line in result_body['lines']:
-        if line['currencyTypeName'] == 'Chaos Orb':
-            print(line)
+    lines = {line['currencyTypeName']: line for line in result_body['lines']}
 
     currency_details = result_body['currencyDetails']
 
@@ -36,20 +49,159 @@ def update_exchange_rates(league: str):
     for currency in currency_details:
         if currency['tradeId'] == 'chaos':
             currency_data[currency['tradeId']] = Currency(chaos_value=1, **currency)
-        elif not (currency['name'] in currency_worth_amounts.keys()):
+        elif not (currency['name'] in lines.keys()):
             currency_data[currency['tradeId']] = Currency(chaos_value=0, **currency)
         else:
-            currency_data[currency['tradeId']] = Currency(chaos_value=currency_worth_amounts[currency['name']], **currency)
+            line = lines[currency['name']]
+            currency_data[currency['tradeId']] = Currency(chaos_value=line['chaosEquivalent'], pay_value=(line.get('pay') or {}).get('value'),
+                                                          receive_value=(line.get('receive') or {}).get('value'), **currency)
+
+    return currency_data
+
+
+class ExchangeRateStore(object):
+    def __init__(self, ttl: timedelta = EXCHANGE_RATE_TTL, path: Union[str, Path] = EXCHANGE_RATE_CACHE):
+        """
+        Holds the exchange rates of each league, refreshing them from poe.ninja once they are older than the ttl.
+        Stale rates are returned immediately while they are refreshed on a background thread, so only the very first
+        lookup of a league ever waits on poe.ninja. Rates are persisted to disk, so restarts reuse them, and every
+        refresh is appended to a history log, so prices computed with past rates can be reproduced.
+
+        :param ttl: The age after which the rates of a league are refreshed
+        :param path: The folder in which the rates and history of each league are stored
+        """
+        self.ttl = ttl
+        self.path = Path(path)
+        self._rates = {}  # to be formatted as {league: (fetched unix timestamp, {trade id: Currency})}
+        self._refreshing = set()  # leagues with a refresh in progress
+        self._lock = Lock()
+        self._history_indices = {}  # to be formatted as {league: ([fetched unix timestamp], [byte offset of the entry], bytes indexed)}
+        self._history_lock = Lock()
+        metrics.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        now = time()
+        for league, (fetched_at, _) in list(self._rates.items()):
+            _rate_age.labels(league).set(now - fetched_at)
+
+    def _league_path(self, league: str, suffix: str) -> Path:
+        return self.path.joinpath(f'{quote(league, safe="")}{suffix}')
+
+    def _load(self, league: str):
+        try:
+            with open(self._league_path(league, '.json'), 'r') as rate_file:
+                persisted = json.load(rate_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        return persisted['fetched_at'], {currency['tradeId']: Currency(**currency) for currency in persisted['currencies']}
+
+    def _save(self, league: str, fetched_at: float, currency_data: Dict[str, Currency]):
+        self.path.mkdir(parents=True, exist_ok=True)
+        rate_path = self._league_path(league, '.json')
+        persisted = {'fetched_at': fetched_at, 'currencies': [asdict(currency) for currency in currency_data.values()]}
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.path, prefix=rate_path.name, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w') as rate_file:
+                json.dump(persisted, rate_file)
+            os.replace(temp_path, rate_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        with open(self._league_path(league, '.history.jsonl'), 'a') as history_file:
+            history_file.write(json.dumps(persisted) + '\n')
+
+    def refresh(self, league: str) -> Dict[str, Currency]:
+        """
+        Retrieves the current exchange rates of a league from poe.ninja, regardless of the age of the stored rates
+        :param league: The league to retrieve the rates of
+        :return: A dict of {trade id: Currency}
+        """
+        try:
+            currency_data = _fetch_exchange_rates(league)
+            _refreshes.labels(league).inc()
+            fetched_at = time()
+            with self._lock:
+                self._rates[league] = (fetched_at, currency_data)
+                self._save(league, fetched_at, currency_data)
+            return currency_data
+        finally:
+            with self._lock:
+                self._refreshing.discard(league)
+
+    def _refresh_in_background(self, league: str):
+        with self._lock:
+            if league in self._refreshing:
+                return
+            self._refreshing.add(league)
+        Thread(target=self.refresh, args=(league,), name=f'Exchange rate refresh ({league})', daemon=True).start()
+
+    def get(self, league: str) -> Dict[str, Currency]:
+        """
+        Retrieves the exchange rates of a league, without waiting on poe.ninja unless no rates have ever been retrieved
+        :param league: The league to retrieve the rates of
+        :return: A dict of {trade id: Currency}
+        """
+        entry = self._rates.get(league)
+        if entry is None:
+            entry = self._load(league)
+            if entry is None:
+                return self.refresh(league)
+            with self._lock:
+                entry = self._rates.setdefault(league, entry)
+
+        fetched_at, currency_data = entry
+        if time() - fetched_at >= self.ttl.total_seconds():
+            self._refresh_in_background(league)
+        return currency_data
+
+    def _index_history(self, league: str, history_file: BinaryIO) -> Tuple[List[float], List[int]]:
+        # the history is only ever appended to, so each lookup indexes just the entries appended since the last one
+        timestamps, offsets, indexed = self._history_indices.get(league, ([], [], 0))
+        if os.fstat(history_file.fileno()).st_size < indexed:
+            # the history was truncated or replaced, so it is indexed again from the start
+            timestamps, offsets, indexed = [], [], 0
+        history_file.seek(indexed)
+        for line in history_file:
+            if not line.endswith(b'\n'):
+                # an entry which is still being appended is indexed by a later lookup
+                break
+            timestamps.append(json.loads(line)['fetched_at'])
+            offsets.append(indexed)
+            indexed += len(line)
+        self._history_indices[league] = (timestamps, offsets, indexed)
+        return timestamps, offsets
+
+    def get_historical(self, league: str, timestamp: float) -> Optional[Dict[str, Currency]]:
+        """
+        Retrieves the exchange rates of a league as they were at a point in time, from the history log. The log is
+        indexed by time as it is read, so only the entry in use at the timestamp is parsed in full.
+        :param league: The league to retrieve the rates of
+        :param timestamp: The unix timestamp at which the rates were in use
+        :return: A dict of {trade id: Currency}, with the most recent rates retrieved at or before the timestamp, or None if there are no such rates
+        """
+        try:
+            with open(self._league_path(league, '.history.jsonl'), 'rb') as history_file, self._history_lock:
+                timestamps, offsets = self._index_history(league, history_file)
+                position = bisect_right(timestamps, timestamp)
+                if position == 0:
+                    return None
+                history_file.seek(offsets[position - 1])
+                entry = json.loads(history_file.readline())
+        except FileNotFoundError:
+            return None
+        return {currency['tradeId']: Currency(**currency) for currency in entry['currencies']}
+
+
+exchange_rate_store = ExchangeRateStore()
 
-    _currency_data[league] = currency_data
 
+def update_exchange_rates(league: str):
+    exchange_rate_store.refresh(league)
 
-def get_currency_exchange_rates(league: str):
-    global _currency_data
-    if not league in _currency_data:
-        update_exchange_rates(league)
 
-    return _currency_data[league]
+def get_currency_exchange_rates(league: str):
+    return exchange_rate_store.get(league)
 
 
 def get_chaos_equivalent(currency_id: str, league: str):
@@ -0,0 +1,127 @@
+# Ratelimit backends which share a single ratelimit budget between several processes on the same machine
+import sqlite3
+import threading
+from pathlib import Path
+from time import time
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from Data.Index import RATELIMIT_DATABASE
+from Tools.API.Ratelimiting import PENALTY, RatelimitBackend, RatelimitRule
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS slots (
+    name TEXT NOT NULL,
+    interval REAL NOT NULL,
+    slot REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slots_by_rule ON slots (name, interval, slot);
+CREATE TABLE IF NOT EXISTS penalties (
+    name TEXT PRIMARY KEY,
+    blocked_until REAL NOT NULL
+);
+'''
+
+
+class SqliteRatelimitBackend(RatelimitBackend):
+    def __init__(self, path: Union[str, Path] = RATELIMIT_DATABASE, busy_timeout: float = 30):
+        """
+        Stores ratelimit state in an SQLite database, so that every process using the same database file coordinates
+        one budget. Slots are reserved within an immediate transaction, which serializes reservations between processes
+        while they are chosen, but not while the reserved requests execute.
+
+        As the slots are compared between processes, they are stored as wall clock unix timestamps rather than monotonic
+        clock times.
+
+        :param path: The path of the database file, shared between all processes
+        :param busy_timeout: The number of seconds to wait for another process to finish its reservation
+        """
+        self.path = Path(path)
+        self.busy_timeout = busy_timeout
+        self._connections = threading.local()  # sqlite connections may only be used by the thread which created them
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection.executescript(_schema)
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._connections.connection = connection
+        return connection
+
+    def _transaction(self):
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    @staticmethod
+    def _blocked_until(connection: sqlite3.Connection, name: str) -> float:
+        row = connection.execute('SELECT blocked_until FROM penalties WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else float('-inf')
+
+    @staticmethod
+    def _block(connection: sqlite3.Connection, name: str, blocked_until: float):
+        connection.execute('INSERT INTO penalties (name, blocked_until) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET blocked_until = max(blocked_until, excluded.blocked_until)', (name, blocked_until))
+
+    @staticmethod
+    def _next_slot(connection: sqlite3.Connection, name: str, rules: Iterable[RatelimitRule], now: float, count: int = 1) -> Tuple[float, Optional[Union[RatelimitRule, str]]]:
+        slot, limit = now, None
+        blocked_until = SqliteRatelimitBackend._blocked_until(connection, name)
+        if blocked_until > slot:
+            slot, limit = blocked_until, PENALTY
+        for rule in rules:
+            interval = rule.interval.total_seconds()
+            # the (max_executions - count + 1)-th most recent slot is the one which must expire before count new slots are available
+            row = connection.execute('SELECT slot FROM slots WHERE name = ? AND interval = ? ORDER BY slot DESC LIMIT 1 OFFSET ?', (name, interval, max(rule.max_executions - count, 0))).fetchone()
+            if row is not None and row[0] + interval + rule.buffer_interval.total_seconds() > slot:
+                slot, limit = row[0] + interval + rule.buffer_interval.total_seconds(), rule
+        return slot, limit
+
+    def reserve(self, name: str, rules: Iterable[RatelimitRule]) -> float:
+        return self.reserve_detailed(name, rules)[0]
+
+    def reserve_detailed(self, name: str, rules: Iterable[RatelimitRule]) -> Tuple[float, Optional[Union[RatelimitRule, str]]]:
+        connection = self._transaction()
+        try:
+            now = time()
+            slot, limit = self._next_slot(connection, name, rules, now)
+            longest_interval = max((rule.interval.total_seconds() + rule.buffer_interval.total_seconds() for rule in rules), default=0)
+            connection.executemany('INSERT INTO slots (name, interval, slot) VALUES (?, ?, ?)', [(name, rule.interval.total_seconds(), slot) for rule in rules])
+            connection.execute('DELETE FROM slots WHERE name = ? AND slot < ?', (name, now - longest_interval))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return slot - now, limit
+
+    def peek(self, name: str, rules: Iterable[RatelimitRule], count: int = 1) -> float:
+        now = time()
+        return self._next_slot(self._connection, name, rules, now, count)[0] - now
+
+    def penalize(self, name: str, seconds: float):
+        connection = self._transaction()
+        try:
+            self._block(connection, name, time() + seconds)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def synchronize(self, name: str, rules: Iterable[RatelimitRule], states: Dict[int, Tuple[int, int]]):
+        connection = self._transaction()
+        try:
+            now = time()
+            for rule in rules:
+                interval = rule.interval.total_seconds()
+                hits, restricted = states.get(int(interval), (0, 0))
+                tracked = connection.execute('SELECT count(*) FROM slots WHERE name = ? AND interval = ? AND slot > ? AND slot <= ?', (name, interval, now - interval, now)).fetchone()[0]
+                if hits > tracked:
+                    connection.executemany('INSERT INTO slots (name, interval, slot) VALUES (?, ?, ?)', [(name, interval, now)] * (hits - tracked))
+                if restricted:
+                    self._block(connection, name, now + restricted)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
@@ -1,26 +1,54 @@
+import asyncio
 from collections import deque
-from datetime import timedelta, datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
 from functools import wraps
-from threading import Lock
-from time import sleep
-from typing import Union, Iterable
+from heapq import heapify, heappop, heappush
+from inspect import iscoroutinefunction
+from itertools import count
+from threading import Condition, Lock, Thread, local
+from time import monotonic, sleep
+from typing import Union, Iterable, Callable, List, Mapping, Tuple, Dict, Optional
 
 from Tools.API import API_Names
+from Tools.API.Metrics import metrics
 
 DEFAULT_RATELIMIT_NAME = 'default'
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = timedelta(seconds=2)  # doubled on every retry, when the server does not specify how long to wait
+DEFAULT_SCHEDULER_WORKERS = 4
 
 # to be formatted as {name: [_Ratelimit(rule), ...]}
 _ratelimits = {}
 
+# to be formatted as {name: rules_factory}, each factory is resolved into _ratelimits the first time it is needed
+_ratelimit_factories = {}
+_ratelimit_creation_lock = Lock()
+
+# to be formatted as {name: RatelimitBackend}, used in place of the in-process backend when the named ratelimit is created
+_ratelimit_backends = {}
+
+PENALTY = 'penalty'  # the limit reported for waits caused by a restriction or Retry-After, rather than by a rule
+
+_wait_seconds = metrics.histogram('ratelimit_wait_seconds', 'Time each execution waited for its ratelimit slot, including executions which did not wait', ('ratelimit',))
+_blocked_seconds = metrics.counter('ratelimit_blocked_seconds_total', 'Time spent waiting for ratelimit slots, by the rule which delayed the slot the most', ('ratelimit', 'limit'))
+_budget_utilization = metrics.gauge('ratelimit_budget_utilization', 'The proportion of each rule used, as last reported by the server', ('ratelimit', 'limit'))
+_rejections = metrics.counter('ratelimit_rejections_total', 'Requests rejected by the server for exceeding its ratelimit', ('ratelimit',))
+_scheduler_wait_seconds = metrics.histogram('scheduler_queue_seconds', 'Time each job spent queued on a scheduler before starting', ('scheduler',))
+_scheduler_queue_depth = metrics.gauge('scheduler_queue_depth', 'The number of jobs queued on a scheduler', ('scheduler',))
+
+_scheduled_jobs = local()  # the scheduler and job of the scheduled job running on the current thread, if any
+
 
 class RatelimitRule(object):
-    def __init__(self, max_executions: int, interval: Union[int, timedelta], buffer_interval: Union[int, timedelta] = timedelta(milliseconds=100)):
+    def __init__(self, max_executions: int, interval: Union[int, timedelta], buffer_interval: Union[int, timedelta] = timedelta(milliseconds=100), timeout: Union[int, timedelta] = None):
         """
         A decorator that ratelimits the decorated function, so that it may only be executed a specified number of times in the given interval
 
         :param max_executions: The maximum number of calls that can be made to the decorated function in the given interval
         :param interval: The interval in which to limit the rate of execution. Can be represented as a timedelta, or an integer representing the number of milliseconds in the interval
         :param buffer_interval: An interval added to the slept time in the original, so that inaccuracies in the OS sleep timing do not cause the ratelimit to be exceeded. This is defaulted to 100 milliseconds, and can be represented as a timedelta, or an integer representing the number of milliseconds in the interval
+        :param timeout: The penalty enforced by the server when the rule is exceeded, if known. Can be represented as a timedelta, or an integer representing the number of seconds in the timeout
 
         :return: The result of the decorated function
         """
@@ -28,18 +56,84 @@ class RatelimitRule(object):
             interval = timedelta(seconds=interval)
         if isinstance(buffer_interval, int):
             buffer_interval = timedelta(seconds=buffer_interval)
+        if isinstance(timeout, int):
+            timeout = timedelta(seconds=timeout)
 
         self.max_executions = max_executions
         self.interval = interval
         self.buffer_interval = buffer_interval
+        self.timeout = timeout
+
+    def __eq__(self, other):
+        return isinstance(other, RatelimitRule) and (self.max_executions, self.interval, self.timeout) == (other.max_executions, other.interval, other.timeout)
+
+    def __hash__(self):
+        return hash((self.max_executions, self.interval, self.timeout))
+
+    @property
+    def label(self) -> str:
+        """The rule formatted as 'max executions:interval seconds', as it is labelled in metrics"""
+        return f'{self.max_executions}:{self.interval.total_seconds():g}'
 
     def __str__(self):
-        return f"RatelimitRule(Max Requests: {self.max_executions}, Interval: {self.interval}, Buffer Interval: {self.buffer_interval})"
+        return f"RatelimitRule(Max Requests: {self.max_executions}, Interval: {self.interval}, Buffer Interval: {self.buffer_interval}, Timeout: {self.timeout})"
+
+
+class RatelimitExceededException(Exception):
+    def __init__(self, retry_after: float = None):
+        """
+        Raised by a ratelimited function when the server rejected its request for exceeding the ratelimit
+
+        :param retry_after: The number of seconds the server asked to wait before retrying, if given
+        """
+        super().__init__(f'Ratelimit exceeded, retry after {retry_after} seconds' if retry_after is not None else 'Ratelimit exceeded')
+        self.retry_after = retry_after
+
+
+def _parse_header_triples(value: str) -> List[Tuple[int, int, int]]:
+    # ratelimit headers hold comma separated triples, formatted as 'a:b:c'
+    return [tuple(int(part) for part in triple.split(':')) for triple in value.split(',') if triple]
+
+
+def parse_ratelimit_headers(headers: Mapping[str, str]) -> Tuple[List[RatelimitRule], Dict[int, Tuple[int, int]]]:
+    """
+    Parses the X-Rate-Limit-* headers of a response. Every rule type listed in X-Rate-Limit-Rules (e.g. Ip, Account)
+    describes its rules as 'max_requests:interval:timeout' triples in X-Rate-Limit-{type}, and the server's current
+    view of them as 'hits:interval:restricted_seconds' triples in X-Rate-Limit-{type}-State.
+    Rules of different types sharing the same interval are merged, keeping the strictest values.
+
+    :param headers: The (case insensitive) headers of the response
+    :return: (rules, states): The rules of the ratelimit, and a dict of {interval seconds: (hits, restricted seconds)}
+    """
+    rules = {}
+    states = {}
+    rule_types = [rule_type.strip() for rule_type in headers.get('X-Rate-Limit-Rules', '').split(',') if rule_type.strip()]
+    for rule_type in rule_types:
+        for max_requests, interval, timeout in _parse_header_triples(headers.get(f'X-Rate-Limit-{rule_type}', '')):
+            known_max, known_timeout = rules.get(interval, (max_requests, timeout))
+            rules[interval] = (min(known_max, max_requests), max(known_timeout, timeout))
+        for hits, interval, restricted in _parse_header_triples(headers.get(f'X-Rate-Limit-{rule_type}-State', '')):
+            known_hits, known_restricted = states.get(interval, (hits, restricted))
+            states[interval] = (max(known_hits, hits), max(known_restricted, restricted))
+
+    return [RatelimitRule(max_executions=max_requests, interval=interval, timeout=timeout) for interval, (max_requests, timeout) in sorted(rules.items())], states
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    :param headers: The (case insensitive) headers of the response
+    :return: The number of seconds requested by the Retry-After header, or None if it is missing or not a number of seconds
+    """
+    try:
+        return float(headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
 
 
 def ratelimit(name: Union[str, API_Names] = DEFAULT_RATELIMIT_NAME):
     """
-    A decorator that ratelimits the decorated function, so that it may only be executed a specified number of times in the given interval
+    A decorator that ratelimits the decorated function, so that it may only be executed a specified number of times in the given interval.
+    Coroutine functions are also supported, in which case waiting for the ratelimit does not block the event loop.
 
     :param interval: The interval in which to limit the rate of execution. Can be represented as a timedelta, or an integer representing the number of milliseconds in the interval
     :param max_executions: The maximum number of calls that can be made to the decorated function in the given interval
@@ -51,88 +145,580 @@ def ratelimit(name: Union[str, API_Names] = DEFAULT_RATELIMIT_NAME):
     name = name.value if isinstance(name, API_Names) else name
 
     def ratelimit_decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await get_ratelimit(name).execute_async(func, args, kwargs)
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            global _ratelimits
-            return _ratelimits[name].execute(func, args, kwargs)
+            return get_ratelimit(name).execute(func, args, kwargs)
 
         return wrapper
 
     return ratelimit_decorator
 
 
-def create_ratelimit(rules: Union[RatelimitRule, Iterable[RatelimitRule]], name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME):
+def create_ratelimit(rules: Union[RatelimitRule, Iterable[RatelimitRule]], name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME, backend: 'RatelimitBackend' = None):
+    """
+    Creates a ratelimit, which functions decorated with @ratelimit(name) are executed through
+
+    :param rules: The rules of the ratelimit
+    :param name: The name of the ratelimiter
+    :param backend: The backend storing the ratelimit's state, defaults to the backend registered through set_ratelimit_backend, or an in-process backend
+    """
     global _ratelimits
     name = name if isinstance(name, str) else name.value
-    _ratelimits[name] = _Ratelimit(rules)
+    _ratelimits[name] = _Ratelimit(rules, name=name, backend=backend if backend is not None else _ratelimit_backends.get(name))
+
+
+def create_ratelimit_from_headers(headers: Mapping[str, str], name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME, backend: 'RatelimitBackend' = None,
+                                  fallback_rules: Iterable[RatelimitRule] = None):
+    """
+    Creates a ratelimit from the X-Rate-Limit-* headers of a response, starting from the server's view of its state,
+    so that requests made before the ratelimit existed are accounted for
+
+    :param headers: The (case insensitive) headers of the response
+    :param name: The name of the ratelimiter
+    :param backend: The backend storing the ratelimit's state, defaults to the backend registered through set_ratelimit_backend, or an in-process backend
+    :param fallback_rules: The rules used when the response announces none, such as an error response, until a later response announces them
+    :raises ValueError: When the response announces no rules and there are no fallback rules, as the ratelimit would not limit anything
+    """
+    rules, _ = parse_ratelimit_headers(headers)
+    if not rules:
+        if fallback_rules is None:
+            raise ValueError('The response announces no ratelimit rules')
+        rules = list(fallback_rules)
+    create_ratelimit(rules, name=name, backend=backend)
+    get_ratelimit(name).update_from_headers(headers)
+
+
+def set_ratelimit_backend(backend: 'RatelimitBackend', name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME):
+    """
+    Sets the backend storing the state of a ratelimit, including ratelimits which are created lazily.
+    Pointing the ratelimits of several processes at one shared backend makes them coordinate a single budget.
+
+    :param backend: The backend to store the ratelimit's state in
+    :param name: The name of the ratelimiter
+    """
+    global _ratelimit_backends
+    name = name if isinstance(name, str) else name.value
+    _ratelimit_backends[name] = backend
+    if name in _ratelimits:
+        _ratelimits[name].backend = backend
+
+
+def update_ratelimit_from_response(status_code: int, headers: Mapping[str, str], name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME):
+    """
+    Resynchronizes a ratelimit with the state reported in a response, to be called by ratelimited functions on every response.
+    When the server rejected the request for exceeding its ratelimit, a RatelimitExceededException is raised, which the
+    ratelimiter handles by waiting out the penalty and retrying the request.
+
+    :param status_code: The HTTP status code of the response
+    :param headers: The (case insensitive) headers of the response
+    :param name: The name of the ratelimiter
+    """
+    ratelimit = get_ratelimit(name)
+    ratelimit.update_from_headers(headers)
+    if status_code == 429:
+        raise RatelimitExceededException(parse_retry_after(headers))
+
+
+def create_lazy_ratelimit(rules_factory: Callable[[], Optional[Union[RatelimitRule, Iterable[RatelimitRule]]]], name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME):
+    """
+    Registers a ratelimit whose rules are only created the first time a function limited by it is executed.
+    This allows rules that must be discovered over the network to be defined without any work at import time.
+
+    :param rules_factory: A callable returning the rules of the ratelimit, or creating the ratelimit itself (e.g. through create_ratelimit_from_headers) and returning None
+    :param name: The name of the ratelimiter
+    """
+    global _ratelimit_factories
+    name = name if isinstance(name, str) else name.value
+    _ratelimit_factories[name] = rules_factory
+
+
+def get_ratelimit(name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME) -> '_Ratelimit':
+    """
+    Retrieves a ratelimit by name, creating it from its registered factory if it has not been used before
+
+    :param name: The name of the ratelimiter
+    :return: The ratelimiter registered under the given name
+    """
+    global _ratelimits
+    name = name if isinstance(name, str) else name.value
+    if name not in _ratelimits:
+        with _ratelimit_creation_lock:
+            if name not in _ratelimits:
+                rules = _ratelimit_factories[name]()
+                if rules is not None:
+                    create_ratelimit(rules, name=name)
+    return _ratelimits[name]
 
 
 class _RequestTracker(object):
     def __init__(self, rule: RatelimitRule):
-        self.requests = deque()
+        """
+        Tracks the slots reserved under a single rule, as a sliding window of monotonic clock timestamps.
+        Only the most recent max_executions slots can ever restrict a new request, so older slots are discarded
+        automatically and finding the next available slot is a constant time operation.
+        """
         self.rule = rule
+        self.interval = rule.interval.total_seconds() + rule.buffer_interval.total_seconds()
+        self.slots = deque(maxlen=rule.max_executions)
 
-    def clean_requests(self):
-        # while tracker is not empty and the oldest request no longer matters
-        while self.requests and self.requests[0] + self.rule.interval + self.rule.buffer_interval < datetime.utcnow():
-            self.requests.popleft()
+    def next_available_slot(self, count: int = 1) -> float:
+        """
+        Finds the monotonic clock time when the next requests can be made, taking slots reserved in the future into account
 
-    def request_ratelimited_until(self) -> datetime:
+        :param count: The number of requests which must all be allowed at that time, at most the rule's max_executions
+        :return: The earliest time at which that many new requests may be executed under this rule
         """
-        Finds the UTC timestamp when the next request can be made
+        expiring = len(self.slots) + min(count, self.slots.maxlen) - self.slots.maxlen
+        if expiring > 0:
+            return self.slots[expiring - 1] + self.interval
+        return float('-inf')
+
+    def reserve_slot(self, slot: float):
+        self.slots.append(slot)
 
-        :return: Timestamp when a new request may be executed, None if the request may be executed immediately
+    def synchronize(self, hits: int, now: float):
         """
-        self.clean_requests()
-        if len(self.requests) == self.rule.max_executions:
-            return self.requests[0] + self.rule.interval
-        else:
-            return None
+        Accounts for requests the server has counted against this rule which were not made through this tracker,
+        such as requests from other clients sharing the same IP or account
 
-    def insert_request_timestamp(self, timestamp: datetime):
-        self.requests.append(timestamp)
+        :param hits: The number of requests the server has counted within the rule's interval
+        :param now: The current monotonic clock time
+        """
+        window_start = now - self.rule.interval.total_seconds()
+        tracked = sum(1 for slot in self.slots if window_start < slot <= now)
+        if hits > tracked:
+            self.slots = deque(sorted([*self.slots, *[now] * (hits - tracked)]), maxlen=self.rule.max_executions)
+
+
+class RatelimitBackend(object):
+    """
+    Stores the reserved slots and penalties of ratelimits. Each ratelimiter delegates its state to a backend, so the
+    same budget may be shared by every ratelimiter using the backend, including ratelimiters in other processes.
+    """
+
+    def reserve(self, name: str, rules: Iterable[RatelimitRule]) -> float:
+        """
+        Reserves the next execution slot allowed by every rule
+
+        :param name: The name of the ratelimiter
+        :param rules: The rules currently enforced by the ratelimiter
+        :return: The number of seconds to wait before the reserved slot begins
+        """
+        raise NotImplementedError()
+
+    def reserve_detailed(self, name: str, rules: Iterable[RatelimitRule]) -> Tuple[float, Optional[Union[RatelimitRule, str]]]:
+        """
+        Reserves the next execution slot like reserve, also reporting what delayed the slot
+
+        :param name: The name of the ratelimiter
+        :param rules: The rules currently enforced by the ratelimiter
+        :return: (wait, limit): The number of seconds to wait before the reserved slot begins, and the rule which delayed it the most, PENALTY when it was delayed by a penalty, or None when unknown
+        """
+        return self.reserve(name, rules), None
+
+    def peek(self, name: str, rules: Iterable[RatelimitRule], count: int = 1) -> float:
+        """
+        Finds how long it would take for the next slots to begin, without reserving them
+
+        :param name: The name of the ratelimiter
+        :param rules: The rules currently enforced by the ratelimiter
+        :param count: The number of slots which must be available together, at most the max_executions of every rule
+        :return: The number of seconds until that many slots are available, zero or less if they are available now
+        """
+        raise NotImplementedError()
+
+    def penalize(self, name: str, seconds: float):
+        """
+        Prevents any slot from starting within the given number of seconds
+
+        :param name: The name of the ratelimiter
+        :param seconds: The length of the penalty
+        """
+        raise NotImplementedError()
+
+    def synchronize(self, name: str, rules: Iterable[RatelimitRule], states: Dict[int, Tuple[int, int]]):
+        """
+        Accounts for requests the server has counted which were not reserved through this backend, and for
+        restrictions the server has placed on the ratelimit
+
+        :param name: The name of the ratelimiter
+        :param rules: The rules currently enforced by the ratelimiter
+        :param states: The state reported by the server, formatted as {interval seconds: (hits, restricted seconds)}
+        """
+        raise NotImplementedError()
+
+
+class MemoryRatelimitBackend(RatelimitBackend):
+    """Stores ratelimit state within the current process, this is the default backend"""
+
+    def __init__(self):
+        self._trackers = {}  # to be formatted as {name: (rules, {rule: _RequestTracker(rule)})}
+        self._blocked_until = {}  # to be formatted as {name: monotonic clock time at which a penalty ends}
+        self._lock = Lock()  # for handing out execution slots to concurrent callers
+
+    def _get_trackers(self, name: str, rules: Iterable[RatelimitRule]) -> Iterable[_RequestTracker]:
+        # the rules are only compared when a different list of rules is given, keeping the reservations of rules which are still enforced
+        known_rules, trackers = self._trackers.get(name, (None, {}))
+        if known_rules is not rules:
+            trackers = {rule: trackers.get(rule) or _RequestTracker(rule) for rule in rules}
+            self._trackers[name] = (rules, trackers)
+        return trackers.values()
+
+    def _next_slot(self, name: str, trackers: Iterable[_RequestTracker], now: float, count: int = 1) -> Tuple[float, Optional[Union[RatelimitRule, str]]]:
+        slot, limit = now, None
+        blocked_until = self._blocked_until.get(name, now)
+        if blocked_until > slot:
+            slot, limit = blocked_until, PENALTY
+        for tracker in trackers:
+            available_at = tracker.next_available_slot(count)
+            if available_at > slot:
+                slot, limit = available_at, tracker.rule
+        return slot, limit
+
+    def reserve(self, name: str, rules: Iterable[RatelimitRule]) -> float:
+        return self.reserve_detailed(name, rules)[0]
+
+    def reserve_detailed(self, name: str, rules: Iterable[RatelimitRule]) -> Tuple[float, Optional[Union[RatelimitRule, str]]]:
+        with self._lock:
+            trackers = self._get_trackers(name, rules)
+            now = monotonic()
+            slot, limit = self._next_slot(name, trackers, now)
+            for tracker in trackers:
+                tracker.reserve_slot(slot)
+        return slot - now, limit
+
+    def peek(self, name: str, rules: Iterable[RatelimitRule], count: int = 1) -> float:
+        with self._lock:
+            now = monotonic()
+            return self._next_slot(name, self._get_trackers(name, rules), now, count)[0] - now
+
+    def penalize(self, name: str, seconds: float):
+        with self._lock:
+            self._blocked_until[name] = max(self._blocked_until.get(name, float('-inf')), monotonic() + seconds)
+
+    def synchronize(self, name: str, rules: Iterable[RatelimitRule], states: Dict[int, Tuple[int, int]]):
+        with self._lock:
+            now = monotonic()
+            for tracker in self._get_trackers(name, rules):
+                hits, restricted = states.get(int(tracker.rule.interval.total_seconds()), (0, 0))
+                tracker.synchronize(hits, now)
+                if restricted:
+                    self._blocked_until[name] = max(self._blocked_until.get(name, float('-inf')), now + restricted)
 
 
 # An internal class designed to house API ratelimiting logic, meant for both individual and shared ratelimiting
 class _Ratelimit(object):
-    def __init__(self, rules: Union[RatelimitRule, Iterable[RatelimitRule]]):
-        # create list of trackers for handling timestamp logic based on rules
-        self.trackers = [_RequestTracker(rules)] if isinstance(rules, RatelimitRule) else [_RequestTracker(rule) for rule in rules]
-        self.execution_lock = Lock()  # for limiting the requests to one at a time
+    def __init__(self, rules: Union[RatelimitRule, Iterable[RatelimitRule]], name: str = DEFAULT_RATELIMIT_NAME, backend: RatelimitBackend = None, max_retries: int = DEFAULT_MAX_RETRIES):
+        self.rules = [rules] if isinstance(rules, RatelimitRule) else list(rules)
+        self.name = name
+        self.backend = MemoryRatelimitBackend() if backend is None else backend
+        self.max_retries = max_retries
+        self._wait_seconds = _wait_seconds.labels(name)
+
+    def reserve(self) -> float:
+        """
+        Reserves the next execution slot allowed by every rule of this ratelimiter. The reservation is recorded
+        immediately and no lock is held once the slot is chosen, so any number of callers may wait for their
+        slots and execute their requests concurrently.
+
+        :return: The number of seconds to wait before the reserved slot begins
+        """
+        return self.backend.reserve(self.name, self.rules)
+
+    def peek(self, count: int = 1) -> float:
+        """
+        :param count: The number of slots which must be available together, capped at the max_executions of the strictest rule
+        :return: The number of seconds until the next slots are available, zero or less if they are available now
+        """
+        return self.backend.peek(self.name, self.rules, min(count, self.max_burst))
 
     @property
-    def rules(self) -> Iterable[RatelimitRule]:
-        return [tracker.rule for tracker in self.trackers]
+    def max_burst(self) -> int:
+        """The most slots which can ever be available at once, the max_executions of the strictest rule"""
+        # rules allowing no executions, which a server could announce, hold no slots and so never restrict a request
+        return min((rule.max_executions for rule in self.rules if rule.max_executions > 0), default=1)
+
+    def penalize(self, seconds: float):
+        self.backend.penalize(self.name, seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """
+        Resynchronizes the ratelimiter with the X-Rate-Limit-* and Retry-After headers of a response.
+        Rules announced by the server replace the current rules, requests the server has counted but this ratelimiter
+        has not are added to its state, and any restriction reported by the server is waited out before the next slot.
+
+        :param headers: The (case insensitive) headers of the response
+        """
+        rules, states = parse_ratelimit_headers(headers)
+        if rules and set(rules) != set(self.rules):
+            self.rules = rules
+        self.backend.synchronize(self.name, self.rules, states)
+        for rule in self.rules:
+            hits, _ = states.get(int(rule.interval.total_seconds()), (None, None))
+            if hits is not None and rule.max_executions > 0:
+                _budget_utilization.labels(self.name, rule.label).set(hits / rule.max_executions)
+
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            self.penalize(retry_after)
+
+    def _retry_delay(self, exception: RatelimitExceededException, attempt: int) -> float:
+        if exception.retry_after is not None:
+            return exception.retry_after
+        return DEFAULT_RETRY_BACKOFF.total_seconds() * 2 ** attempt
+
+    def _reserve_recorded(self) -> float:
+        # reserves a slot for an execution, recording how long it waits and what it waited on
+        wait_time, limit = self.backend.reserve_detailed(self.name, self.rules)
+        scheduled = getattr(_scheduled_jobs, 'current', None)
+        if scheduled is not None and scheduled[0].name == self.name:
+            scheduled[0]._request_reserved(scheduled[1])
+        self._wait_seconds.observe(max(wait_time, 0))
+        if wait_time > 0:
+            _blocked_seconds.labels(self.name, limit.label if isinstance(limit, RatelimitRule) else limit or 'unknown').inc(wait_time)
+        return wait_time
 
     def execute(self, func, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            wait_time = self._reserve_recorded()
+            if wait_time > 0:
+                sleep(wait_time)
+            try:
+                return func(*args, **kwargs)
+            except RatelimitExceededException as exception:
+                _rejections.labels(self.name).inc()
+                if attempt == self.max_retries:
+                    raise
+                self.penalize(self._retry_delay(exception, attempt))
+
+    async def execute_async(self, func, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            wait_time = self._reserve_recorded()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            try:
+                return await func(*args, **kwargs)
+            except RatelimitExceededException as exception:
+                _rejections.labels(self.name).inc()
+                if attempt == self.max_retries:
+                    raise
+                self.penalize(self._retry_delay(exception, attempt))
+
+    def __str__(self):
+        return f"Ratelimit(Name: {self.name}, Rules: [{', '.join(str(rule) for rule in self.rules)}])"
+
 
-        # handle request
-        def execute_function(func, args, kwargs):
-
-            # sleep until all trackers are valid for this ratelimiter
-            for tracker in self.trackers:
-                target_time = tracker.request_ratelimited_until()
-                if target_time is not None:
-                    wait_time = target_time - datetime.utcnow()
-                    if wait_time < timedelta(0):
-                        wait_time = tracker.rule.buffer_interval
-                    else:
-                        wait_time = wait_time + tracker.rule.buffer_interval
-                    print(f'Waiting for {wait_time.total_seconds()} seconds on rule {tracker.rule}')
-                    sleep(wait_time.total_seconds())
-
-            # execute the request
-            execution_timestamp = datetime.utcnow()
-            result = func(*args, **kwargs)
-
-            # add the request to the trackers
-            for tracker in self.trackers:
-                tracker.insert_request_timestamp(execution_timestamp)
-
-            return result
-
-        # lock before handling request
-        self.execution_lock.acquire()
-        result = execute_function(func, args, kwargs)
-        self.execution_lock.release()
-        return result
+class DeadlineExceededException(Exception):
+    pass
+
+
+class _ScheduledJob(object):
+    def __init__(self, func, args, kwargs, priority: int, deadline: Optional[float], key, sequence: int, requests: int = 1):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.requests = requests  # the number of requests the job is expected to make through the ratelimit
+        self.outstanding = 0  # the expected requests of the running job which have not reserved their slots yet
+        self.priority = priority
+        self.deadline = deadline  # monotonic clock time by which the job must have started
+        self.key = key
+        self.sequence = sequence
+        self.submitted_at = monotonic()
+        self.future = Future()
+
+    @property
+    def sort_key(self):
+        # highest priority first, then earliest deadline, then first submitted
+        return -self.priority, self.deadline if self.deadline is not None else float('inf'), self.sequence
+
+    def __lt__(self, other: '_ScheduledJob'):
+        return self.sort_key < other.sort_key
+
+
+class RatelimitScheduler(object):
+    def __init__(self, name: Union[API_Names, str] = DEFAULT_RATELIMIT_NAME, max_workers: int = DEFAULT_SCHEDULER_WORKERS):
+        """
+        Queues jobs which make requests through a ratelimit, starting each job only once the ratelimit has a free slot
+        for each of its requests, besides those still to be made by the jobs already running, so a job never starts on
+        a slot another job is about to take. Jobs run in order of priority, then deadline, so urgent jobs are never
+        stuck behind slots already reserved by a large batch of less important jobs. Pending jobs submitted with the
+        same key are coalesced into one.
+
+        :param name: The name of the ratelimiter the jobs make their requests through
+        :param max_workers: The maximum number of jobs running at once
+        """
+        self.name = name if isinstance(name, str) else name.value
+        self.max_workers = max_workers
+        self._queue = []  # a heap of _ScheduledJob
+        self._pending = {}  # to be formatted as {key: _ScheduledJob}, for queued jobs submitted with a key
+        self._sequence = count()
+        self._running = 0
+        self._outstanding = 0  # the expected requests of running jobs which have not reserved their slots yet
+        self._wait_times = deque(maxlen=100)  # seconds spent queued by the most recently started jobs
+        self._condition = Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{self.name} scheduler')
+        self._dispatcher = None
+        self._shutdown = False
+        self._queue_seconds = _scheduler_wait_seconds.labels(self.name)
+        metrics.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        _scheduler_queue_depth.labels(self.name).set(len(self._queue))
+
+    def submit(self, func, *args, priority: int = 0, deadline: Union[float, timedelta] = None, key=None, requests: int = 1, **kwargs) -> Future:
+        """
+        Queues a job, returning a future for its result
+
+        :param func: The function to run, which makes its requests through this scheduler's ratelimit
+        :param priority: Jobs with a higher priority are started first
+        :param deadline: The time within which the job must start, as a timedelta or a number of seconds from now. Jobs which cannot start in time fail with a DeadlineExceededException
+        :param key: Identifies duplicate jobs, a job submitted with the key of a queued job is coalesced into it, raising its priority and deadline to the most urgent of the two
+        :param requests: The number of requests the job is expected to make, which must all have free slots before it starts, up to the strictest rule's max_executions
+        :return: A future which resolves to the result of the job
+        """
+        if isinstance(deadline, timedelta):
+            deadline = deadline.total_seconds()
+        deadline = monotonic() + deadline if deadline is not None else None
+
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit jobs to a scheduler which has been shut down')
+
+            job = self._pending.get(key) if key is not None else None
+            if job is not None:
+                job.priority = max(job.priority, priority)
+                if deadline is not None:
+                    job.deadline = deadline if job.deadline is None else min(job.deadline, deadline)
+                heapify(self._queue)
+            else:
+                job = _ScheduledJob(func, args, kwargs, priority, deadline, key, next(self._sequence), requests)
+                heappush(self._queue, job)
+                if key is not None:
+                    self._pending[key] = job
+
+            if self._dispatcher is None:
+                self._dispatcher = Thread(target=self._dispatch, name=f'{self.name} dispatcher', daemon=True)
+                self._dispatcher.start()
+            self._condition.notify_all()
+            return job.future
+
+    def _dispatch(self):
+        try:
+            # resolved outside of the condition, as lazy ratelimits may need to contact the server to discover their rules
+            ratelimit = get_ratelimit(self.name)
+        except BaseException as exception:
+            with self._condition:
+                while self._queue:
+                    job = self._queue[0]
+                    self._pop(job)
+                    job.future.set_exception(exception)
+                self._dispatcher = None
+            return
+
+        with self._condition:
+            while True:
+                if self._shutdown and not self._queue:
+                    return
+                if not self._queue or self._running >= self.max_workers:
+                    self._condition.wait()
+                    continue
+
+                job = self._queue[0]
+                now = monotonic()
+                if job.deadline is not None and now > job.deadline:
+                    self._pop(job)
+                    job.future.set_exception(DeadlineExceededException('Job was not started within its deadline'))
+                    continue
+
+                # wait for a free slot for each request, allowing a more urgent job submitted in the meantime to take them
+                needed = self._outstanding + max(job.requests, 1)
+                if self._outstanding and needed > ratelimit.max_burst:
+                    # the running jobs' requests and this job's cannot all fit in one window, so the running jobs make theirs first
+                    self._condition.wait(None if job.deadline is None else max(job.deadline - now, 0))
+                    continue
+                delay = ratelimit.peek(needed)
+                if delay > 0:
+                    # the wait also ends when a running job reserves one of its expected slots, or finishes without it
+                    self._condition.wait(delay if job.deadline is None else min(delay, max(job.deadline - now, 0)))
+                    continue
+
+                self._pop(job)
+                job.outstanding = max(job.requests, 1)
+                self._outstanding += job.outstanding
+                self._running += 1
+                self._wait_times.append(now - job.submitted_at)
+                self._queue_seconds.observe(now - job.submitted_at)
+                self._executor.submit(self._run, job)
+
+    def _pop(self, job: _ScheduledJob):
+        heappop(self._queue)
+        if job.key is not None:
+            self._pending.pop(job.key, None)
+
+    def _request_reserved(self, job: _ScheduledJob):
+        with self._condition:
+            if job.outstanding:
+                job.outstanding -= 1
+                self._outstanding -= 1
+                self._condition.notify_all()
+
+    def _run(self, job: _ScheduledJob):
+        _scheduled_jobs.current = (self, job)
+        try:
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.func(*job.args, **job.kwargs))
+                except BaseException as exception:
+                    job.future.set_exception(exception)
+        finally:
+            _scheduled_jobs.current = None
+            with self._condition:
+                # requests the job was expected to make but did not no longer hold back other jobs
+                self._outstanding -= job.outstanding
+                job.outstanding = 0
+                self._running -= 1
+                self._condition.notify_all()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def average_wait(self) -> float:
+        """The average number of seconds the most recently started jobs spent queued"""
+        wait_times = list(self._wait_times)
+        return sum(wait_times) / len(wait_times) if wait_times else 0
+
+    def estimate_wait(self, priority: int = 0) -> float:
+        """
+        Estimates how long a job submitted now would stay queued, from the requests of the jobs which would run before
+        it and the number of requests each rule allows per interval
+
+        :param priority: The priority of the job
+        :return: The estimated number of seconds before the job would start
+        """
+        with self._condition:
+            requests_ahead = sum(job.requests for job in self._queue if job.priority >= priority)
+        ratelimit = get_ratelimit(self.name)
+        window_wait = max((requests_ahead // rule.max_executions * (rule.interval + rule.buffer_interval).total_seconds() for rule in ratelimit.rules if rule.max_executions > 0), default=0)
+        return max(ratelimit.peek(), 0) + window_wait
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops accepting jobs, letting queued jobs finish
+
+        :param wait: Whether to wait for all queued and running jobs to finish
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait and self._dispatcher is not None:
+            self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
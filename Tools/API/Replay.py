@@ -0,0 +1,198 @@
+# Records the responses of every API request sent through Tools.API.Http, and replays them later without network access
+#
+# A cassette is a jsonl file holding one exchange per line. Requests are identified by their method, path and body,
+# ignoring the server they were sent to, so a cassette recorded against the live APIs can be replayed in process or
+# served by the local stub server. Json bodies are compared in canonical form, so key order does not matter.
+import json
+from contextlib import contextmanager
+from hashlib import sha1
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from Tools.API import Http
+
+# headers describing the encoding of the recorded body, which no longer apply once it has been decoded
+_transport_headers = frozenset(['content-encoding', 'content-length', 'transfer-encoding', 'connection'])
+
+
+class ReplayMissException(ConnectionError):
+    pass
+
+
+def _body_key(body: Union[str, bytes, None]) -> str:
+    if not body:
+        return ''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'))
+    except ValueError:
+        pass
+    return sha1(body.encode('utf-8')).hexdigest()
+
+
+def request_key(method: str, url: str, body: Union[str, bytes, None] = None) -> Tuple[str, str, str]:
+    """
+    :param method: The HTTP method of the request
+    :param url: The url of the request, the server it was sent to is ignored
+    :param body: The body of the request
+    :return: The key identifying the request within a cassette
+    """
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    return method.upper(), path, _body_key(body)
+
+
+class Cassette(object):
+    def __init__(self, path: Union[str, Path] = None):
+        """
+        A collection of recorded request and response exchanges. Requests recorded several times are replayed in the
+        order they were recorded, with the last response repeated once the others have been replayed.
+
+        :param path: The jsonl file to load the exchanges from, if any
+        """
+        self.path = Path(path) if path is not None else None
+        self._exchanges: Dict[Tuple[str, str, str], List[dict]] = {}
+        self._cursors = {}  # to be formatted as {request key: index of the next response to replay}
+        self._lock = Lock()
+        if self.path is not None and self.path.exists():
+            self.load(self.path)
+
+    def load(self, path: Union[str, Path]):
+        with open(path, 'r', encoding='utf-8') as cassette_file:
+            for line in cassette_file:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self._exchanges.setdefault(tuple(exchange['key']), []).append(exchange)
+
+    def save(self, path: Union[str, Path] = None):
+        path = Path(path) if path is not None else self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as cassette_file:
+            for exchanges in self._exchanges.values():
+                for exchange in exchanges:
+                    cassette_file.write(json.dumps(exchange) + '\n')
+
+    def add(self, method: str, url: str, request_body: Union[str, bytes, None], status: int, headers: Mapping[str, str], body: Union[str, bytes]):
+        """
+        Records an exchange
+        :param method: The HTTP method of the request
+        :param url: The url of the request
+        :param request_body: The body of the request
+        :param status: The status code of the response
+        :param headers: The headers of the response
+        :param body: The decoded body of the response
+        """
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        key = request_key(method, url, request_body)
+        exchange = {'key': list(key), 'status': status, 'headers': {name: value for name, value in headers.items() if name.lower() not in _transport_headers}, 'body': body}
+        with self._lock:
+            self._exchanges.setdefault(key, []).append(exchange)
+
+    def next_response(self, method: str, url: str, body: Union[str, bytes, None] = None) -> Optional[dict]:
+        """
+        :return: The next recorded exchange of the request, formatted as {'status', 'headers', 'body'}, or None if the request was never recorded
+        """
+        key = request_key(method, url, body)
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            return exchanges[min(cursor, len(exchanges) - 1)]
+
+    def rewind(self):
+        with self._lock:
+            self._cursors.clear()
+
+    def __len__(self):
+        return sum(len(exchanges) for exchanges in self._exchanges.values())
+
+    def __str__(self):
+        return f"Cassette(Path: {self.path}, Requests: {len(self._exchanges)}, Exchanges: {len(self)})"
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, cassette: Cassette, **kwargs):
+        """
+        A transport adapter which sends requests as normal, recording every response into the cassette
+        """
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        response = super().send(request, **kwargs)
+        self.cassette.add(request.method, request.url, request.body, response.status_code, response.headers, response.content)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, cassette: Cassette):
+        """
+        A transport adapter which answers every request from the cassette, without any network access. Requests which
+        were never recorded raise a ReplayMissException.
+        """
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        exchange = self.cassette.next_response(request.method, request.url, request.body)
+        if exchange is None:
+            raise ReplayMissException(f'No recorded response for {request.method} {request.url}')
+
+        response = Response()
+        response.status_code = exchange['status']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        response._content = exchange['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.reason = 'Replayed'
+        return response
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def _installed_adapter(adapter: BaseAdapter) -> Iterator[None]:
+    Http.set_adapter(adapter)
+    try:
+        yield
+    finally:
+        Http.set_adapter(None)
+
+
+@contextmanager
+def recording(path: Union[str, Path]) -> Iterator[Cassette]:
+    """
+    Records every request sent through Tools.API.Http while the context is active, saving the cassette when it exits
+    :param path: The jsonl file the cassette is saved to, any exchanges it already holds are kept
+    :return: The cassette being recorded
+    """
+    cassette = Cassette(path)
+    with _installed_adapter(RecordingAdapter(cassette, pool_connections=Http.DEFAULT_POOL_SIZE, pool_maxsize=Http.DEFAULT_POOL_SIZE)):
+        try:
+            yield cassette
+        finally:
+            cassette.save()
+
+
+@contextmanager
+def replaying(path: Union[str, Path, Cassette]) -> Iterator[Cassette]:
+    """
+    Answers every request sent through Tools.API.Http from a cassette while the context is active
+    :param path: The jsonl file of the cassette, or the cassette itself
+    :return: The cassette being replayed
+    """
+    cassette = path if isinstance(path, Cassette) else Cassette(path)
+    with _installed_adapter(ReplayAdapter(cassette)):
+        yield cassette
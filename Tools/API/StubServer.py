@@ -0,0 +1,192 @@
+# A local HTTP server standing in for the trade and poe.ninja APIs, serving recorded responses from a cassette while
+# emulating the trade API's X-Rate-Limit-* headers, so the whole fetch pipeline can be run and benchmarked offline
+import argparse
+import gzip
+import json
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, Iterable, Optional, Tuple
+
+from Tools.API import API_Names, Http
+from Tools.API.Replay import Cassette
+
+# formatted as (max hits, period seconds, restriction seconds), as the trade API reported them for searches
+DEFAULT_STUB_RULES = ((8, 10, 60), (15, 60, 120), (60, 300, 1800))
+DEFAULT_RATELIMITED_PATH = '/api/trade/'
+_ratelimit_headers = ('x-rate-limit-', 'retry-after')
+
+
+class RatelimitEmulator(object):
+    def __init__(self, rules: Iterable[Tuple[int, int, int]] = DEFAULT_STUB_RULES, rule_type: str = 'Ip'):
+        """
+        Tracks the hits of a single client against ratelimit rules, the way the trade API does. A client exceeding a
+        rule is restricted for the rule's restriction time, during which every request is rejected.
+
+        :param rules: The rules, formatted as (max hits, period seconds, restriction seconds)
+        :param rule_type: The rule type reported in X-Rate-Limit-Rules
+        """
+        self.rules = list(rules)
+        self.rule_type = rule_type
+        self._hits = [deque() for _ in self.rules]
+        self._restricted_until = [0.0 for _ in self.rules]
+        self._lock = Lock()
+
+    def hit(self) -> Tuple[bool, Dict[str, str]]:
+        """
+        Records a request
+        :return: (allowed, headers): Whether the request is within the ratelimit, and the ratelimit headers of its response
+        """
+        with self._lock:
+            now = monotonic()
+            allowed = all(restricted_until <= now for restricted_until in self._restricted_until)
+            states = []
+            for index, (max_hits, period, restriction) in enumerate(self.rules):
+                hits = self._hits[index]
+                while hits and hits[0] <= now - period:
+                    hits.popleft()
+                if allowed:
+                    hits.append(now)
+                if len(hits) > max_hits and self._restricted_until[index] <= now:
+                    self._restricted_until[index] = now + restriction
+                states.append((len(hits), period, max(self._restricted_until[index] - now, 0)))
+
+            if allowed and any(restricted > 0 for _, _, restricted in states):
+                allowed = False
+
+        headers = {
+            'X-Rate-Limit-Policy': 'trade-search-request-limit',
+            'X-Rate-Limit-Rules': self.rule_type,
+            f'X-Rate-Limit-{self.rule_type}': ','.join(f'{max_hits}:{period}:{restriction}' for max_hits, period, restriction in self.rules),
+            f'X-Rate-Limit-{self.rule_type}-State': ','.join(f'{hits}:{period}:{int(restricted + 0.999)}' for hits, period, restricted in states),
+        }
+        if not allowed:
+            headers['Retry-After'] = str(max(int(restricted + 0.999) for _, _, restricted in states))
+        return allowed, headers
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # allows connections to be kept alive
+    disable_nagle_algorithm = True  # otherwise the separately written headers and body of a response are delayed on a kept alive connection
+    server: '_StubHTTPServer'
+
+    def _respond(self):
+        body = self.rfile.read(int(self.headers.get('content-length', 0)))  # the request body must be consumed before the connection is reused
+        stub = self.server.stub
+        if stub.latency:
+            sleep(stub.latency)
+
+        headers = {}
+        status, response_body = None, None
+        if stub.ratelimit is not None and self.path.startswith(stub.ratelimited_path):
+            allowed, headers = stub.ratelimit.hit()
+            if not allowed:
+                status, response_body = 429, json.dumps({'error': {'code': 3, 'message': 'Rate limit exceeded'}})
+
+        if status is None:
+            exchange = stub.cassette.next_response(self.command, self.path, body)
+            if exchange is None:
+                status, response_body = 404, json.dumps({'error': {'code': 1, 'message': f'No recorded response for {self.command} {self.path}'}})
+            else:
+                status, response_body = exchange['status'], exchange['body']
+                # recorded ratelimit headers are replaced by the emulated ones
+                headers = {**{name: value for name, value in exchange['headers'].items() if not name.lower().startswith(_ratelimit_headers)}, **headers}
+        stub.record(status)
+
+        encoded = response_body.encode('utf-8')
+        gzipped = 'gzip' in self.headers.get('accept-encoding', '')
+        if gzipped:
+            encoded = gzip.compress(encoded, compresslevel=1)
+        self.send_response(status)
+        headers.setdefault('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(encoded)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], stub: 'StubServer'):
+        super().__init__(address, _StubHandler)
+        self.stub = stub
+
+
+class StubServer(object):
+    def __init__(self, cassette: Cassette, latency: float = 0, ratelimit: Optional[RatelimitEmulator] = None, ratelimited_path: str = DEFAULT_RATELIMITED_PATH,
+                 host: str = '127.0.0.1', port: int = 0):
+        """
+        Serves the responses recorded in a cassette. Requests which were never recorded are answered with a 404.
+        While the server is running as a context manager, every API is redirected to it through Tools.API.Http.
+
+        :param cassette: The recorded responses to serve
+        :param latency: The number of seconds each response is delayed by, emulating the round trip to the real servers
+        :param ratelimit: The ratelimit to emulate, requests exceeding it are answered with a 429. Defaults to no ratelimit headers
+        :param ratelimited_path: The path prefix of the requests subject to the ratelimit
+        :param host: The address to listen on
+        :param port: The port to listen on, a free port is chosen by default
+        """
+        self.cassette = cassette
+        self.latency = latency
+        self.ratelimit = ratelimit
+        self.ratelimited_path = ratelimited_path
+        self.status_counts = {}  # to be formatted as {status code: number of responses}
+        self._status_lock = Lock()
+        self._server = _StubHTTPServer((host, port), self)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def record(self, status: int):
+        with self._status_lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, name='Stub server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> 'StubServer':
+        self.start()
+        for api in API_Names:
+            Http.set_base_url(api, self.url)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for api in API_Names:
+            Http.set_base_url(api)
+        self.stop()
+
+    def __str__(self):
+        return f"StubServer(URL: {self.url}, Latency: {self.latency}, Responses: {self.status_counts})"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves a recorded cassette in place of the trade and poe.ninja APIs')
+    parser.add_argument('cassette', help='the jsonl cassette to serve')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='seconds each response is delayed by')
+    parser.add_argument('--no-ratelimit', action='store_true', help='do not emulate the trade API ratelimit')
+    arguments = parser.parse_args()
+
+    stub = StubServer(Cassette(arguments.cassette), latency=arguments.latency, ratelimit=None if arguments.no_ratelimit else RatelimitEmulator(), port=arguments.port)
+    print(f'Serving {stub.cassette} at {stub.url}')
+    stub._server.serve_forever()
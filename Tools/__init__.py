@@ -1,3 +1,7 @@
+from operator import attrgetter
+from typing import Iterable
+
+
 def to_chunks(lst: list, n: int):
     """
     Splits a list into a minimal number of chunks of up to size n.
@@ -12,12 +16,81 @@ def to_chunks(lst: list, n: int):
     return out
 
 
+# attributes of the wrapped class which are never delegated
+_undelegated = frozenset(['__class__', '__dict__', '__doc__', '__module__', '__slots__', '__weakref__', '__new__', '__init__', '__init_subclass__',
+                          '__subclasshook__', '__getattr__', '__getattribute__', '__setattr__', '__delattr__', '__dir__', '__reduce__', '__reduce_ex__',
+                          '__getstate__', '__setstate__', '__class_getitem__', '__dataclass_fields__', '__dataclass_params__', '__match_args__'])
+
+
+def _delegated_names(wrapped: type) -> Iterable[str]:
+    # instance attributes only appear on the class as slots, or as dataclass fields or annotations
+    names = set(dir(wrapped))
+    for cls in wrapped.__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        names.update([slots] if isinstance(slots, str) else slots)
+        names.update(getattr(cls, '__dataclass_fields__', {}).keys())
+        names.update(cls.__dict__.get('__annotations__', {}).keys())
+    return names - _undelegated
+
+
+def _make_dunder_proxy(path: str, name: str):
+    get_wrapped = attrgetter(path)
+
+    def proxy(self, *args, **kwargs):
+        # wrappers of the same class are unwrapped, so that binary operators such as __eq__ compare the wrapped objects
+        args = [get_wrapped(arg) if type(arg) is type(self) else arg for arg in args]
+        return getattr(get_wrapped(self), name)(*args, **kwargs)
+
+    proxy.__name__ = name
+    return proxy
+
+
+def _make_delegated_property(path: str) -> property:
+    owner_path, name = path.rsplit('.', 1)
+    get_owner = attrgetter(owner_path)
+
+    # assignments are written through to the wrapped object, so that they are seen by every wrapper sharing it
+    def setter(self, value):
+        setattr(get_owner(self), name, value)
+
+    return property(attrgetter(path), setter, doc=f'Delegated to {path}')
+
+
 class Wrapper(object):
-    """Wrapper class that provides proxy access to an instance of some
-       internal instance."""
+    """
+    Provides proxy access to the attributes of a wrapped instance of __wraps__.
+
+    When a subclass is created, a property is generated for every attribute of the wrapped class, each reading the
+    attribute through a C level attrgetter, so delegated reads cost about as much as reading a property rather than
+    falling back to __getattr__. Wrapping another Wrapper flattens the chain into a single dotted attrgetter, and the
+    special methods the wrapped class defines, such as __str__ or __eq__, are proxied as well. Assigning a delegated
+    attribute sets it on the wrapped object. Attributes which cannot be found on the wrapped class are still delegated
+    through __getattr__.
+    """
 
     __wraps__ = None
-    __ignore__ = "class mro new init setattr getattr getattribute"
+    __slots__ = ('_obj',)
+    _delegated = {}  # to be formatted as {attribute name: dotted path from the wrapper to the attribute}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        wrapped = cls.__dict__.get('__wraps__')
+        if wrapped is None:
+            return
+
+        inner_paths = wrapped._delegated if issubclass(wrapped, Wrapper) else {}
+        cls._delegated = dict(cls._delegated)
+        for name in _delegated_names(wrapped):
+            if name in cls.__dict__ or name in Wrapper.__dict__:
+                continue
+            path = f'_obj.{inner_paths.get(name, name)}'
+            if name.startswith('__') and name.endswith('__'):
+                attribute = getattr(wrapped, name, None)
+                if callable(attribute) and attribute is not getattr(object, name, None):
+                    setattr(cls, name, _make_dunder_proxy(path.rsplit('.', 1)[0], name))
+                continue
+            setattr(cls, name, _make_delegated_property(path))
+            cls._delegated[name] = path
 
     def __init__(self, obj):
         if self.__wraps__ is None:
@@ -27,24 +100,6 @@ class Wrapper(object):
         else:
             raise ValueError("wrapped object must be of %s" % self.__wraps__)
 
-    # provide proxy access to regular attributes of wrapped object
+    # provide proxy access to attributes which could not be found on the wrapped class, such as instance attributes
     def __getattr__(self, name):
         return getattr(self._obj, name)
-
-    # create proxies for wrapped object's double-underscore attributes
-    class __metaclass__(type):
-        def __init__(cls, name, bases, dct):
-
-            def make_proxy(name):
-                def proxy(self, *args):
-                    return getattr(self._obj, name)
-
-                return proxy
-
-            type.__init__(cls, name, bases, dct)
-            if cls.__wraps__:
-                ignore = set("__%s__" % n for n in cls.__ignore__.split())
-                for name in dir(cls.__wraps__):
-                    if name.startswith("__"):
-                        if name not in ignore and name not in dct:
-                            setattr(cls, name, property(make_proxy(name)))
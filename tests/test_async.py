@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from Tools.API.POE import TRADE_API_NAME
+from Tools.API.POE.Async import AsyncTradeClient, _client_timeout, fetch_many_query_results
+from Tools.API.Ratelimiting import RatelimitRule, _ratelimits, create_ratelimit
+from Tools.API.Replay import Cassette, replaying
+from Tools.API.StubServer import StubServer
+
+_query = {'query': {'type': 'Astral Plate'}, 'sort': {'price': 'asc'}}
+_trade_ids = [f'{index:064x}' for index in range(12)]
+
+
+def _listing_json(trade_id: str, amount: int) -> dict:
+    return {'id': trade_id, 'listing': {'indexed': '2021-01-24T03:41:08Z', 'account': {'name': 'seller'}, 'price': {'type': '~price', 'amount': amount, 'currency': 'chaos'}},
+            'item': {'name': '', 'typeLine': 'Astral Plate', 'ilvl': 86}}
+
+
+@pytest.fixture
+def cassette():
+    cassette = Cassette()
+    cassette.add('POST', '/api/trade/search/Ritual', json.dumps(_query), 200, {}, json.dumps({'id': 'search', 'result': _trade_ids}))
+    for first in range(0, len(_trade_ids), 10):
+        chunk = _trade_ids[first:first + 10]
+        body = json.dumps({'result': [_listing_json(trade_id, amount) for amount, trade_id in enumerate(chunk, first + 1)]})
+        cassette.add('GET', f'/api/trade/fetch/{",".join(chunk)}?query=search', None, 200, {}, body)
+    return cassette
+
+
+@pytest.fixture(autouse=True)
+def trade_ratelimit():
+    create_ratelimit([RatelimitRule(100, 1, buffer_interval=0)], name=TRADE_API_NAME)
+    yield
+    _ratelimits.pop(TRADE_API_NAME.value, None)
+
+
+def test_the_default_league_is_not_looked_up_on_construction():
+    assert AsyncTradeClient().league is None
+
+
+def test_client_timeout_follows_the_shared_session():
+    timeout = _client_timeout((5, 30))
+    assert (timeout.sock_connect, timeout.sock_read) == (5, 30)
+    assert _client_timeout(10).sock_read == 10
+
+
+def test_fetches_from_the_configured_server(cassette):
+    with StubServer(cassette) as stub:
+        results = fetch_many_query_results([_query], league='Ritual')
+    assert [listing.amount for listing in results[0]] == list(range(1, 13))
+    assert stub.status_counts == {200: 3}
+
+
+def test_fetches_through_an_installed_adapter(cassette):
+    with replaying(cassette):
+        results = fetch_many_query_results([_query, _query], league='Ritual')
+    assert [[listing.amount for listing in listings] for listings in results] == [list(range(1, 13))] * 2
@@ -0,0 +1,31 @@
+from time import sleep
+
+from Tools.API.Cache import TTLCache
+from Tools.API.POE import query_fingerprint
+
+
+def test_entries_expire_after_the_ttl():
+    cache = TTLCache(max_size=10, ttl=1)
+    cache.ttl = cache.ttl / 20
+    cache.set('search', 1)
+    assert cache.get('search') == 1 and 'search' in cache
+    sleep(0.1)
+    assert cache.get('search') is None and 'search' not in cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_the_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache and 'b' not in cache and 'c' in cache
+    assert len(cache) == 2
+
+
+def test_equivalent_queries_share_a_fingerprint():
+    query = {'query': {'type': 'Astral Plate', 'status': {'option': 'online'}}, 'sort': {'price': 'asc'}}
+    reformatted = '{"sort": {"price": "asc"},\n "query": {"status": {"option": "online"}, "type": "Astral Plate"}}'
+    assert query_fingerprint(query, 'Ritual') == query_fingerprint(reformatted, 'Ritual')
+    assert query_fingerprint(query, 'Ritual') != query_fingerprint(query, 'Standard')
@@ -0,0 +1,63 @@
+import random
+from copy import copy
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from POE.Trade.CurrencyGraph import CurrencyGraph
+from Tools.API.POE_Ninja import Currency
+
+
+def _currencies(count: int = 30, seed: int = 0):
+    rng = random.Random(seed)
+    currencies = {'chaos': Currency(id=1, icon='', name='Chaos Orb', tradeId='chaos', chaos_value=1)}
+    for index in range(1, count):
+        chaos_value, spread = 10 ** rng.uniform(-2, 3), rng.uniform(0.01, 0.1)
+        currencies[f'currency{index}'] = Currency(id=index + 1, icon='', name=f'Currency {index}', tradeId=f'currency{index}', chaos_value=chaos_value,
+                                                  pay_value=1 / (chaos_value * (1 - spread)), receive_value=chaos_value * (1 + spread))
+    return currencies
+
+
+def _assert_matches_recompute(graph: CurrencyGraph, currencies):
+    recomputed = CurrencyGraph(currencies)
+    np.testing.assert_allclose(graph.best_rates(), recomputed.best_rates(), rtol=1e-9)
+    for sold in graph.codes[:5]:
+        for bought in graph.codes[-5:]:
+            path = graph.best_path(sold, bought)
+            assert path is not None and np.isclose(path.rate, recomputed.best_rates()[graph.indices[sold], graph.indices[bought]])
+
+
+def test_incremental_update_matches_a_full_recompute(monkeypatch):
+    currencies = _currencies()
+    graph = CurrencyGraph(currencies)
+    assert graph.profitable_cycles() == []
+
+    # improved rates are relaxed into the existing paths
+    improved = dict(currencies)
+    for code in list(currencies)[1:6]:
+        improved[code] = replace(currencies[code], receive_value=currencies[code].receive_value * 0.98)
+    updated = copy(graph)
+    with monkeypatch.context() as patch:
+        patch.setattr(updated, '_compute_paths', lambda: pytest.fail('improved rates should not recompute every path'))
+        updated.update(improved)
+    _assert_matches_recompute(updated, improved)
+
+    # worsened rates need every path recomputed
+    worsened = {code: replace(currency, pay_value=currency.pay_value and currency.pay_value * 1.05) for code, currency in improved.items()}
+    updated.update(worsened)
+    _assert_matches_recompute(updated, worsened)
+
+
+def test_profitable_cycles_are_found_and_their_paths_unbounded():
+    currencies = _currencies()
+    # selling currency1 for more chaos than it costs to buy makes a profitable cycle through chaos
+    currencies['currency1'] = replace(currencies['currency1'], pay_value=1 / (currencies['currency1'].receive_value * 1.1))
+    graph = CurrencyGraph(currencies)
+
+    cycles = graph.profitable_cycles()
+    assert len(cycles) == 1 and set(cycles[0].codes) == {'chaos', 'currency1'}
+    assert np.isclose(cycles[0].profit, 0.1)
+    assert graph.profitable_cycles(min_profit=0.2) == []
+    assert graph.best_path('chaos', 'currency2') is None
+    assert np.isnan(graph.best_rates()[graph.indices['chaos'], graph.indices['currency2']])
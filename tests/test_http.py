@@ -0,0 +1,31 @@
+from requests.adapters import HTTPAdapter
+
+from Tools.API import Http
+from Tools.API.Replay import Cassette, ReplayAdapter
+
+
+def test_set_adapter_after_first_use_replaces_session():
+    session = Http.get_session()
+    adapter = ReplayAdapter(Cassette())
+    try:
+        Http.set_adapter(adapter)
+        replaced = Http.get_session()
+        assert replaced is not session
+        assert replaced.get_adapter('https://www.pathofexile.com') is adapter
+    finally:
+        Http.set_adapter(None)
+    assert isinstance(Http.get_session().get_adapter('https://www.pathofexile.com'), HTTPAdapter)
+
+
+def test_configure_applies_pool_size_after_first_use():
+    Http.get_session()
+    try:
+        Http.configure(pool_size=3)
+        assert Http.get_session().get_adapter('https://poe.ninja')._pool_maxsize == 3
+    finally:
+        Http.configure()
+
+
+def test_endpoint_name_drops_ids():
+    assert Http.endpoint_name('https://www.pathofexile.com/api/trade/fetch/abc,def?query=xyz') == '/api/trade/fetch'
+    assert Http.endpoint_name('https://www.pathofexile.com/api/trade/search/Standard') == '/api/trade/search'
@@ -0,0 +1,105 @@
+import importlib
+import sys
+from datetime import timedelta
+from time import time
+
+import pytest
+
+from Tools.API.POE import Items
+from Tools.API.POE.ItemCache import InvalidItemCacheException, ItemCacheFile, write_item_cache
+
+_items_json = [
+    {'label': 'Prophecies', 'entries': [{'type': 'Fated Connections', 'text': 'Fated Connections', 'flags': {'prophecy': True}}]},
+    {'label': 'Armour', 'entries': [{'type': 'Vaal Regalia', 'text': 'Shavronne\'s Wrappings Occultist\'s Vestment', 'name': 'Shavronne\'s Wrappings', 'flags': {'unique': True}}]},
+]
+
+
+@pytest.fixture
+def item_cache(tmp_path, monkeypatch):
+    path = tmp_path / 'items.bin'
+    monkeypatch.setattr(Items, 'ITEM_CATALOGUE_CACHE', path)
+    monkeypatch.setattr(Items, '_item_catalogue', None)
+    monkeypatch.setattr(Items, '_categorized_items', None)
+    monkeypatch.setattr(Items, '_items_by_name', None)
+    yield path
+    if Items._item_catalogue is not None:
+        Items._item_catalogue.close()
+
+
+def test_empty_and_truncated_caches_are_invalid(tmp_path):
+    path = tmp_path / 'items.bin'
+    path.write_bytes(b'')
+    with pytest.raises(InvalidItemCacheException):
+        ItemCacheFile(path)
+
+    write_item_cache(path, _items_json)
+    contents = path.read_bytes()
+    for length in (10, len(contents) // 2):
+        path.write_bytes(contents[:length])
+        with pytest.raises(InvalidItemCacheException):
+            ItemCacheFile(path)
+
+
+def test_refresh_keeps_the_stale_catalogue_readable_and_rebuilds_derived_items(item_cache, monkeypatch):
+    refreshes = []
+
+    def refresh(max_age):
+        # stands in for the trade API, each download of the catalogue adding a category
+        refreshes.append(max_age)
+        write_item_cache(item_cache, _items_json[:len(refreshes)], fetched_at=time())
+
+    monkeypatch.setattr(Items, '_refresh_item_cache', refresh)
+
+    catalogue = Items.get_item_catalogue()
+    assert list(Items.get_categorized_items()) == ['Prophecies']
+    assert Items.get_item_catalogue() is catalogue and len(refreshes) == 1
+
+    search_index = catalogue.search_index
+    refreshed = Items.get_item_catalogue(max_age=timedelta(0))
+    assert refreshed is not catalogue and len(refreshed) == 2
+    # callers still holding the previous catalogue keep reading the catalogue they were given
+    assert catalogue.item(search_index.resolve('Fated Connections')).type == 'Fated Connections' and len(catalogue) == 1
+    assert list(Items.get_categorized_items()) == ['Prophecies', 'Armour']
+    assert Items.get_items_by_name()['Shavronne\'s Wrappings'].unique
+
+
+def test_resolve_corrects_misspellings_within_a_category_and_logs_them(tmp_path, caplog):
+    path = tmp_path / 'items.bin'
+    write_item_cache(path, [
+        {'label': 'Prophecies', 'entries': [{'type': 'A Rift in Time', 'text': 'A Rift in Time', 'flags': {'prophecy': True}}]},
+        {'label': 'Cards', 'entries': [{'type': 'A Rift in Tim', 'text': 'A Rift in Tim'}]},
+    ])
+    catalogue = Items.ItemCatalogue(path)
+    try:
+        assert catalogue.resolve('A Rift in Tim').type == 'A Rift in Tim' and not caplog.records
+        with caplog.at_level('WARNING'):
+            assert catalogue.resolve('A Rift in Tim', category='Prophecies').type == 'A Rift in Time'
+        assert 'A Rift in Time' in caplog.text
+    finally:
+        catalogue.close()
+
+
+def test_item_str_omits_empty_flags():
+    assert 'Flags' not in str(Items.Item(type='Vaal Regalia', text='Vaal Regalia'))
+    assert 'Flags' in str(Items.Item(type='Vaal Regalia', text='Vaal Regalia', name='Shavronne\'s Wrappings', flags={'unique': True}))
+
+
+def test_search_within_a_category_ranks_only_its_items(tmp_path):
+    path = tmp_path / 'items.bin'
+    write_item_cache(path, [
+        {'label': 'Cards', 'entries': [{'type': f'The Wolf {index}', 'text': f'The Wolf {index}'} for index in range(20)]},
+        {'label': 'Prophecies', 'entries': [{'type': 'The Wolfs Den', 'text': 'The Wolfs Den', 'flags': {'prophecy': True}}]},
+    ])
+    catalogue = Items.ItemCatalogue(path)
+    try:
+        assert [item.type for item in catalogue.search('The Wolf', limit=3)] == ['The Wolf 0', 'The Wolf 1', 'The Wolf 2']
+        assert [item.type for item in catalogue.search('The Wolf', limit=3, category='Prophecies')] == ['The Wolfs Den']
+    finally:
+        catalogue.close()
+
+
+def test_importing_prophecies_does_not_load_the_catalogue(monkeypatch):
+    monkeypatch.setattr(Items, 'get_item_catalogue', lambda *args, **kwargs: pytest.fail('the catalogue was loaded on import'))
+    monkeypatch.delitem(sys.modules, 'POE.Trade.Prophecies', raising=False)
+    prophecies = importlib.import_module('POE.Trade.Prophecies')
+    assert prophecies._upgrade_prophecies is None
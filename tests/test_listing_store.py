@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+import pytest
+
+from POE.Trade.ListingStore import ListingStore, PricePoint
+from POE.Trade.Pricing import ExchangeRateTable
+from Tools.API.POE.Listings import Listing
+from Tools.API.POE_Ninja import Currency
+
+HOUR = 3_600
+NOW = 1_700_000_000 // HOUR * HOUR
+
+
+def _listing(trade_id: str, amount: float, currency: str = 'chaos', indexed: int = NOW, name: str = 'Tabula Rasa', type: str = 'Simple Robe') -> Listing:
+    return Listing(id=trade_id, name=name, type=type, ilvl=None, links=6, amount=amount, currency=currency, indexed=indexed, seller='seller')
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ListingStore(tmp_path / 'listings.db')
+
+
+@pytest.fixture
+def table():
+    return ExchangeRateTable({'chaos': Currency(id=1, icon='', name='Chaos Orb', tradeId='chaos', chaos_value=1),
+                              'divine': Currency(id=2, icon='', name='Divine Orb', tradeId='divine', chaos_value=150)})
+
+
+def test_listings_are_stored_once_and_read_back_after_reopening(tmp_path, store, table):
+    listings = [_listing('a', 10), _listing('b', 1, 'divine'), None, _listing('c', 5, 'mirror'), _listing('d', None, None)]
+    assert store.ingest(listings, league='Ritual', table=table) == 4
+    # relisted prices are not stored again, the first price seen is kept
+    assert store.ingest([_listing('a', 20), _listing('e', 12)], league='Ritual', table=table) == 1
+    assert len(store) == 5
+
+    reopened = ListingStore(tmp_path / 'listings.db')
+    # listings in unknown currencies, or without a price, are stored without a chaos value
+    assert sorted(reopened.prices(name='Tabula Rasa')) == [10, 12, 150]
+    assert list(reopened.prices(league='Standard')) == []
+
+
+def test_prices_are_filtered_by_item_and_time(store, table):
+    store.ingest([_listing('a', 10, indexed=NOW), _listing('b', 20, indexed=NOW + HOUR), _listing('c', 30, indexed=NOW + 2 * HOUR),
+                  _listing('d', 1, 'divine', name='', type='Astral Plate')], league='Ritual', table=table)
+
+    assert sorted(store.prices(name='Tabula Rasa', start=NOW + HOUR)) == [20, 30]
+    # the end of the range is exclusive
+    assert sorted(store.prices(name='Tabula Rasa', end=NOW + 2 * HOUR)) == [10, 20]
+    assert list(store.prices(type='Astral Plate')) == [150]
+
+
+def test_price_history_and_summaries_aggregate_per_bucket_and_item(store, table):
+    store.ingest([_listing('a', 10, indexed=NOW), _listing('b', 20, indexed=NOW + 60), _listing('c', 30, indexed=NOW + 3 * HOUR),
+                  _listing('d', 1, 'divine', name='', type='Astral Plate', indexed=NOW + HOUR)], league='Ritual', table=table)
+
+    assert store.price_history('Tabula Rasa', bucket=timedelta(hours=1)) == [PricePoint(NOW, 2, 10, 15, 20), PricePoint(NOW + 3 * HOUR, 1, 30, 30, 30)]
+    assert store.item_summaries(league='Ritual') == {('Tabula Rasa', 'Simple Robe'): PricePoint(NOW, 3, 10, 20, 30),
+                                                     ('', 'Astral Plate'): PricePoint(NOW + HOUR, 1, 150, 150, 150)}
@@ -0,0 +1,72 @@
+import gc
+
+from Tools.API.Cache import TTLCache
+from Tools.API.Metrics import MetricsRegistry, metrics
+
+
+def _value(registry: MetricsRegistry, name: str, **labels) -> float:
+    for sample in registry.to_json()[name]['samples']:
+        if sample['labels'] == labels:
+            return sample.get('value', sample.get('count'))
+    return None
+
+
+def test_cached_samples_are_exported_after_clear():
+    registry = MetricsRegistry()
+    waits = registry.histogram('waits', 'Waits', ('rule',)).labels('8:10')
+    requests = registry.counter('requests', 'Requests').labels()
+    waits.observe(0.5)
+    requests.inc(3)
+    registry.clear()
+    assert _value(registry, 'requests') == 0
+    assert _value(registry, 'waits', rule='8:10') == 0
+
+    waits.observe(0.25)
+    requests.inc()
+    assert _value(registry, 'requests') == 1
+    assert _value(registry, 'waits', rule='8:10') == 1
+
+
+class _Collected(object):
+    def __init__(self, registry: MetricsRegistry):
+        self.gauge = registry.gauge('collected', 'Collected')
+        registry.add_collector(self.collect)
+
+    def collect(self):
+        self.gauge.set(1)
+
+
+def test_collectors_do_not_keep_their_objects_alive():
+    registry = MetricsRegistry()
+    collected = _Collected(registry)
+    registry.to_json()
+    assert _value(registry, 'collected') == 1
+
+    registry.clear()
+    del collected
+    gc.collect()
+    registry.to_json()
+    assert _value(registry, 'collected') == 0
+
+
+def test_remove_collector():
+    registry = MetricsRegistry()
+    collected = _Collected(registry)
+    registry.remove_collector(collected.collect)
+    registry.to_json()
+    assert _value(registry, 'collected') is None
+
+
+def test_cache_counters_only_increase():
+    cache = TTLCache(10, 60, name='test_cache_counters')
+    cache.set('key', 'value')
+    cache.get('key')
+    cache.get('missing')
+    assert _value(metrics, 'cache_hits_total', cache='test_cache_counters') == 1
+
+    metrics.clear()
+    cache.get('key')
+    assert _value(metrics, 'cache_hits_total', cache='test_cache_counters') == 1
+    assert _value(metrics, 'cache_misses_total', cache='test_cache_counters') == 0
+    cache.get('key')
+    assert _value(metrics, 'cache_hits_total', cache='test_cache_counters') == 2
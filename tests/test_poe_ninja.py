@@ -0,0 +1,23 @@
+from dataclasses import replace
+
+from Tools.API import POE_Ninja
+from Tools.API.POE_Ninja import Currency, ExchangeRateStore
+
+_divine = Currency(id=2, icon='https://web.poecdn.com/divine.png', name='Divine Orb', tradeId='divine', chaos_value=150, pay_value=1 / 148, receive_value=152)
+
+
+def test_history_keeps_whole_currencies(tmp_path, monkeypatch):
+    store = ExchangeRateStore(path=tmp_path)
+    rates = [{'divine': _divine}, {'divine': replace(_divine, chaos_value=160)}]
+    monkeypatch.setattr(POE_Ninja, '_fetch_exchange_rates', lambda league: rates.pop(0))
+    monkeypatch.setattr(POE_Ninja, 'time', iter([200, 300]).__next__)
+    store.refresh('Ritual')
+
+    assert store.get_historical('Ritual', 150) is None
+    assert store.get_historical('Ritual', 250) == {'divine': _divine}
+
+    # entries appended after the history was indexed are found by later lookups
+    store.refresh('Ritual')
+    assert store.get_historical('Ritual', 250) == {'divine': _divine}
+    assert store.get_historical('Ritual', 350)['divine'].chaos_value == 160
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == '.tmp'] == []
@@ -0,0 +1,62 @@
+import math
+import random
+import statistics
+
+import pytest
+
+from POE.Trade.Pricing import ExchangeRateTable, price_listings, summarize_listings, summarize_prices
+from Tools.API.POE.Listings import Listing
+from Tools.API.POE_Ninja import Currency
+
+_chaos_values = {'chaos': 1, 'alch': 0.3, 'exalted': 95, 'divine': 150}
+
+
+def _table() -> ExchangeRateTable:
+    return ExchangeRateTable({code: Currency(id=index, icon='', name=code, tradeId=code, chaos_value=chaos_value) for index, (code, chaos_value) in enumerate(_chaos_values.items())})
+
+
+def _listings(count: int, seed: int):
+    rng = random.Random(seed)
+    # a few listings are priced in currencies the table does not know of, and a few are not priced at all
+    currencies = [*_chaos_values, 'mirror']
+    return [Listing(id=f'{seed}-{index}', name='', type='Astral Plate', ilvl=86, links=6, amount=round(rng.uniform(1, 50), 1) if index % 7 else None,
+                    currency=rng.choice(currencies), indexed=0, seller='seller') if index % 11 else None for index in range(count)]
+
+
+def _plain_prices(listings):
+    return [listing.amount * _chaos_values[listing.currency] for listing in listings if listing is not None and listing.amount is not None and listing.currency in _chaos_values]
+
+
+def _plain_summary(prices, trim, percentiles):
+    prices = sorted(prices)
+    cut = math.floor(len(prices) * trim)
+    quantiles = statistics.quantiles(prices, n=100, method='inclusive')
+    return (len(prices), statistics.fmean(prices), statistics.median(prices), statistics.fmean(prices[cut:len(prices) - cut]),
+            {percentile: quantiles[percentile - 1] for percentile in percentiles})
+
+
+def test_prices_match_a_plain_conversion_and_skip_unknown_currencies():
+    table = _table()
+    listings = _listings(200, seed=0)
+    assert list(price_listings(listings, table)) == pytest.approx(_plain_prices(listings))
+    assert table.code_indices(['divine', 'mirror', 'chaos']).tolist() == [3, -1, 0]
+
+
+def test_summaries_match_a_plain_computation():
+    table = _table()
+    groups = {f'item{seed}': _listings(count, seed) for seed, count in enumerate((1, 2, 30, 200))}
+    groups['unpriced'] = [listing for listing in _listings(50, seed=9) if listing is None or listing.currency == 'mirror']
+
+    summaries = summarize_listings(groups, table, trim=0.1, percentiles=(10, 90))
+    for name, listings in groups.items():
+        prices = _plain_prices(listings)
+        summary = summaries[name]
+        if not prices:
+            assert summary.count == 0 and math.isnan(summary.mean) and math.isnan(summary.median) and math.isnan(summary.percentiles[10])
+            continue
+        count, mean, median, trimmed_mean, percentiles = _plain_summary(prices, 0.1, (10, 90)) if len(prices) > 1 else (1, prices[0], prices[0], prices[0], {10: prices[0], 90: prices[0]})
+        assert summary.count == count
+        assert (summary.mean, summary.median, summary.trimmed_mean) == pytest.approx((mean, median, trimmed_mean))
+        assert summary.percentiles == pytest.approx(percentiles)
+
+    assert summarize_prices([]) == []
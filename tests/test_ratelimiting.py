@@ -0,0 +1,135 @@
+from datetime import timedelta
+from threading import Event
+from time import monotonic, sleep
+
+import pytest
+
+from Tools.API import POE
+from Tools.API.POE import TRADE_API_FALLBACK_RULES, TRADE_API_NAME
+from Tools.API.RatelimitBackends import SqliteRatelimitBackend
+from Tools.API.Ratelimiting import MemoryRatelimitBackend, RatelimitRule, RatelimitScheduler, _ratelimits, create_ratelimit, create_ratelimit_from_headers, get_ratelimit, \
+    parse_ratelimit_headers, ratelimit
+from Tools.API.Replay import Cassette
+from Tools.API.StubServer import RatelimitEmulator, StubServer
+
+_headers = {
+    'X-Rate-Limit-Rules': 'Ip,Account',
+    'X-Rate-Limit-Ip': '8:10:60,15:60:120',
+    'X-Rate-Limit-Ip-State': '3:10:0,4:60:0',
+    'X-Rate-Limit-Account': '6:10:90',
+    'X-Rate-Limit-Account-State': '5:10:0',
+}
+
+
+@pytest.fixture
+def trade_ratelimit():
+    _ratelimits.pop(TRADE_API_NAME.value, None)
+    yield
+    _ratelimits.pop(TRADE_API_NAME.value, None)
+
+
+def test_parse_ratelimit_headers_keeps_strictest_rules():
+    rules, states = parse_ratelimit_headers(_headers)
+    assert [(rule.max_executions, rule.interval.total_seconds(), rule.timeout.total_seconds()) for rule in rules] == [(6, 10, 90), (15, 60, 120)]
+    assert states == {10: (5, 0), 60: (4, 0)}
+
+
+def test_create_ratelimit_from_headers_without_rules():
+    with pytest.raises(ValueError):
+        create_ratelimit_from_headers({}, name='test_no_rules')
+    create_ratelimit_from_headers({}, name='test_no_rules', fallback_rules=[RatelimitRule(2, 10)])
+    assert get_ratelimit('test_no_rules').rules == [RatelimitRule(2, 10)]
+
+
+def test_memory_backend_spaces_reservations():
+    backend = MemoryRatelimitBackend()
+    rules = [RatelimitRule(2, 10, buffer_interval=0)]
+    waits = [backend.reserve('test_spacing', rules) for _ in range(3)]
+    assert waits[0] <= 0 and waits[1] <= 0
+    assert 9 < waits[2] <= 10
+
+
+def test_discovery_reads_rules_from_the_server(trade_ratelimit):
+    with StubServer(Cassette(), ratelimit=RatelimitEmulator(((5, 10, 30),))):
+        rules = POE.get_trade_api_ratelimit_rules()
+    assert rules == [RatelimitRule(5, 10, timeout=30)]
+
+
+def test_discovery_falls_back_without_ratelimit_headers(trade_ratelimit, monkeypatch):
+    monkeypatch.setattr(POE, 'RATELIMIT_DISCOVERY_ATTEMPTS', 1)
+    with StubServer(Cassette()) as stub:
+        rules = POE.get_trade_api_ratelimit_rules()
+    assert stub.status_counts == {404: 1}
+    assert rules == list(TRADE_API_FALLBACK_RULES)
+
+
+def test_memory_backend_peeks_for_several_slots():
+    backend = MemoryRatelimitBackend()
+    rules = [RatelimitRule(3, 10, buffer_interval=0)]
+    backend.reserve('test_peek', rules)
+    assert backend.peek('test_peek', rules, count=2) <= 0
+    assert 9 < backend.peek('test_peek', rules, count=3) <= 10
+
+
+def test_scheduler_holds_slots_for_the_requests_of_running_jobs():
+    create_ratelimit([RatelimitRule(3, timedelta(milliseconds=300), buffer_interval=0)], name='test_scheduler')
+    scheduler = RatelimitScheduler('test_scheduler', max_workers=2)
+    proceed = Event()
+    started = []
+
+    @ratelimit('test_scheduler')
+    def request():
+        return monotonic()
+
+    def job(name: str, wait: bool):
+        started.append(name)
+        if wait:
+            proceed.wait()
+        return [request(), request()]
+
+    try:
+        first = scheduler.submit(job, 'first', True, requests=2)
+        second = scheduler.submit(job, 'second', False, requests=2)
+        sleep(0.1)
+        # one slot is free, but the first job's two requests are still to be made
+        assert started == ['first']
+        proceed.set()
+        first_times, second_times = first.result(5), second.result(5)
+        assert started == ['first', 'second']
+        # the second job only starts once two slots are free, so its requests never wait on the ratelimit
+        assert second_times[1] - second_times[0] < 0.05
+        assert second_times[0] - first_times[0] >= 0.3
+    finally:
+        scheduler.shutdown()
+        _ratelimits.pop('test_scheduler', None)
+
+
+def test_rules_allowing_no_requests_are_ignored_when_estimating_waits():
+    create_ratelimit_from_headers({'X-Rate-Limit-Rules': 'Ip', 'X-Rate-Limit-Ip': '0:10:60,2:60:120', 'X-Rate-Limit-Ip-State': '0:10:0,0:60:0'}, name='test_empty_rule')
+    assert get_ratelimit('test_empty_rule').max_burst == 2
+    scheduler = RatelimitScheduler('test_empty_rule', max_workers=1)
+    proceed = Event()
+    try:
+        running = scheduler.submit(proceed.wait, requests=0)
+        queued = scheduler.submit(lambda: None, requests=4)
+        sleep(0.1)
+        # the queued job's requests fill the rule of two requests per minute twice over
+        assert 120 <= scheduler.estimate_wait() < 130
+        proceed.set()
+        running.result(5), queued.result(5)
+    finally:
+        scheduler.shutdown()
+        _ratelimits.pop('test_empty_rule', None)
+
+
+def test_sqlite_backend_shares_one_budget_between_instances(tmp_path):
+    first, second = SqliteRatelimitBackend(tmp_path / 'ratelimits.db'), SqliteRatelimitBackend(tmp_path / 'ratelimits.db')
+    rules = [RatelimitRule(3, 10, buffer_interval=0)]
+    assert first.reserve('test_shared', rules) <= 0
+    assert second.peek('test_shared', rules, count=2) <= 0
+    assert 9 < second.peek('test_shared', rules, count=3) <= 10
+    assert second.reserve('test_shared', rules) <= 0 and first.reserve('test_shared', rules) <= 0
+    assert 9 < second.reserve('test_shared', rules) <= 10
+
+    second.penalize('test_shared', 30)
+    assert 29 < first.peek('test_shared', rules) <= 30
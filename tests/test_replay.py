@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from Tools.API import API_Names, Http
+from Tools.API.Replay import Cassette, ReplayMissException, recording, replaying
+from Tools.API.StubServer import RatelimitEmulator, StubServer
+
+_query = {'query': {'type': 'Astral Plate'}, 'sort': {'price': 'asc'}}
+
+
+def _search(query=_query):
+    return Http.post(Http.api_url(API_Names.PATH_OF_EXILE_TRADE, '/api/trade/search/Ritual'), json=query)
+
+
+def test_recorded_exchanges_are_replayed_without_a_server(tmp_path):
+    served = Cassette()
+    served.add('POST', '/api/trade/search/Ritual', json.dumps(_query), 200, {'X-Served-By': 'stub'}, json.dumps({'id': 'first', 'result': ['a']}))
+    served.add('POST', '/api/trade/search/Ritual', json.dumps(_query), 200, {'X-Served-By': 'stub'}, json.dumps({'id': 'second', 'result': ['b']}))
+    served.add('GET', '/api/trade/fetch/a?query=first', None, 200, {}, json.dumps({'result': [{'id': 'a'}]}))
+
+    path = tmp_path / 'cassette.jsonl'
+    with StubServer(served), recording(path) as recorded:
+        searches = [_search().json()['id'] for _ in range(2)]
+        fetched = Http.get(Http.api_url(API_Names.PATH_OF_EXILE_TRADE, '/api/trade/fetch/a?query=first')).json()
+    assert searches == ['first', 'second'] and len(recorded) == 3
+
+    # the default servers are never contacted while replaying, and reordered json keys identify the same request
+    reordered = json.loads(json.dumps(_query, sort_keys=True))
+    with replaying(path):
+        first, second = _search(reordered), _search()
+        assert (first.json()['id'], second.json()['id']) == ('first', 'second')
+        assert first.headers['X-Served-By'] == 'stub' and 'Content-Length' not in first.headers
+        assert Http.get(Http.api_url(API_Names.PATH_OF_EXILE_TRADE, '/api/trade/fetch/a?query=first')).json() == fetched
+        with pytest.raises(ReplayMissException):
+            _search({'query': {'type': 'Vaal Regalia'}})
+
+
+def test_the_stub_server_rejects_requests_beyond_the_emulated_ratelimit():
+    cassette = Cassette()
+    cassette.add('POST', '/api/trade/search/Ritual', json.dumps(_query), 200, {'X-Rate-Limit-Ip-State': '1:10:0'}, json.dumps({'id': 'search', 'result': []}))
+
+    with StubServer(cassette, ratelimit=RatelimitEmulator([(2, 10, 30)])) as stub:
+        responses = [_search() for _ in range(3)]
+        assert stub.status_counts == {200: 2, 429: 1}
+
+    allowed, rejected = responses[1], responses[2]
+    # recorded ratelimit headers are replaced by the emulated state
+    assert allowed.status_code == 200 and allowed.headers['X-Rate-Limit-Ip-State'] == '2:10:0'
+    assert rejected.status_code == 429
+    assert rejected.headers['X-Rate-Limit-Rules'] == 'Ip' and rejected.headers['X-Rate-Limit-Ip'] == '2:10:30'
+    assert rejected.headers['X-Rate-Limit-Ip-State'] == '3:10:30' and rejected.headers['Retry-After'] == '30'
@@ -0,0 +1,19 @@
+from concurrent.futures import Future
+
+import numpy as np
+
+from POE.Trade.Pricing import ExchangeRateTable, summarize_prices
+from POE.Trade.Scanner import _search_prices
+from Tools.API.POE.Listings import Listing
+from Tools.API.POE_Ninja import Currency
+
+
+def test_failed_searches_are_priced_as_nan():
+    table = ExchangeRateTable({'chaos': Currency(id=1, icon='', name='Chaos Orb', tradeId='chaos', chaos_value=1)})
+    succeeded, failed = Future(), Future()
+    succeeded.set_result([Listing(id='a', name='', type='Astral Plate', ilvl=86, links=6, amount=5, currency='chaos', indexed=0, seller='seller')])
+    failed.set_exception(ConnectionError('connection reset'))
+
+    priced, unpriced = summarize_prices([_search_prices(succeeded, table, 'Astral Plate'), _search_prices(failed, table, 'Tabula Rasa')])
+    assert priced.median == 5
+    assert np.isnan(unpriced.median)
@@ -0,0 +1,113 @@
+import pickle
+
+import numpy as np
+
+from POE.Trade import Statistics
+from POE.Trade.Pricing import ExchangeRateTable
+from POE.Trade.Statistics import KLLSketch, PriceSketches, merge_sketches
+from Tools.API.POE.Listings import Listing
+from Tools.API.POE_Ninja import Currency
+
+NOW = 1_700_000_000
+DAY = 86_400
+
+
+def _listing(trade_id: str, amount: float) -> Listing:
+    return Listing(id=trade_id, name='', type='Astral Plate', ilvl=86, links=6, amount=amount, currency='chaos', indexed=NOW, seller='seller')
+
+
+def _table() -> ExchangeRateTable:
+    return ExchangeRateTable({'chaos': Currency(id=1, icon='', name='Chaos Orb', tradeId='chaos', chaos_value=1)})
+
+
+def test_kll_sketch_is_exact_below_capacity():
+    sketch = KLLSketch()
+    sketch.update([5, 1, 4, 2, 3])
+    assert list(sketch.quantiles([0, 0.5, 1])) == [1, 3, 5]
+
+
+def test_kll_merge_accuracy():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(4, 0.5, 200_000)
+    merged = KLLSketch()
+    for part in np.array_split(values, 8):
+        sketch = KLLSketch()
+        for chunk in np.array_split(part, 50):
+            sketch.update(chunk)
+        merged.merge(sketch)
+
+    assert merged.count == len(values)
+    assert len(merged) < 2_000
+    quantiles = [0.1, 0.5, 0.9]
+    ranks = [np.mean(values <= estimate) for estimate in merged.quantiles(quantiles)]
+    assert np.allclose(ranks, quantiles, atol=0.02)
+
+
+def test_kll_json_round_trip():
+    sketch = KLLSketch()
+    sketch.update(np.arange(10_000))
+    restored = KLLSketch.from_json(sketch.to_json())
+    assert restored.count == sketch.count
+    assert list(restored.quantiles([0.25, 0.5, 0.75])) == list(sketch.quantiles([0.25, 0.5, 0.75]))
+
+
+def test_outliers_are_rejected():
+    sketches = PriceSketches()
+    accepted = sketches.add('item', [1, 48, 50, 52, 55, 47, 60, 51, 500], now=NOW)
+    assert sorted(accepted) == [47, 48, 50, 51, 52, 55, 60]
+    assert sketches.summary('item', now=NOW).rejected == 2
+
+
+def test_price_moves_are_accepted_once_they_persist():
+    rng = np.random.default_rng(1)
+    sketches = PriceSketches()
+    for second in range(500):
+        sketches.add('item', [rng.normal(100, 3)], now=NOW + second)
+    for second in range(500):
+        sketches.add('item', [rng.normal(20, 1)], now=NOW + 1_000 + second)
+    assert sketches.summary('item', now=NOW + 2_000).count > 750
+
+    # a day later the old prices no longer count
+    sketches.add('item', rng.normal(20, 1, 10), now=NOW + 2 * DAY)
+    summary = sketches.summary('item', now=NOW + 2 * DAY)
+    assert summary.count == 10
+    assert 18 < summary.median < 22
+
+
+def test_listings_are_added_once_per_price():
+    sketches = PriceSketches()
+    table = _table()
+    assert list(sketches.add_listings('item', [_listing('a', 10), _listing('b', 11), None], table, now=NOW)) == [10, 11]
+    assert list(sketches.add_listings('item', [_listing('a', 10), _listing('b', 12)], table, now=NOW + 60)) == [12]
+    assert sketches.summary('item', now=NOW + 60).count == 3
+
+
+def test_listings_are_priced_at_the_rates_of_the_sketches_league(tmp_path, monkeypatch):
+    leagues = []
+
+    def for_league(league=None):
+        leagues.append(league)
+        return _table()
+
+    monkeypatch.setattr(Statistics, 'PRICE_SKETCH_PATH', tmp_path)
+    monkeypatch.setattr(ExchangeRateTable, 'for_league', staticmethod(for_league))
+    sketches = PriceSketches.for_league('Hardcore Ritual')
+    assert list(sketches.add_listings('item', [_listing('a', 10)], now=NOW)) == [10]
+    assert leagues == ['Hardcore Ritual']
+    assert merge_sketches([sketches]).league == 'Hardcore Ritual'
+
+
+def test_save_load_and_merge(tmp_path):
+    sketches = PriceSketches()
+    sketches.add_listings('item', [_listing('a', 10), _listing('b', 11)], _table(), now=NOW)
+    sketches.save(tmp_path / 'sketches.json')
+
+    loaded = PriceSketches(tmp_path / 'sketches.json')
+    assert loaded.summary('item', now=NOW).count == 2
+    assert len(loaded.add_listings('item', [_listing('a', 10)], _table(), now=NOW + 60)) == 0
+
+    worker = pickle.loads(pickle.dumps(sketches))
+    worker.add('other', [5, 6], now=NOW)
+    merged = merge_sketches([sketches, worker])
+    assert merged.summary('item', now=NOW).count == 4
+    assert merged.summary('other', now=NOW).count == 2
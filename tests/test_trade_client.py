@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from Tools.API.POE import TRADE_API_NAME, TradeClient
+from Tools.API.Ratelimiting import RatelimitRule, _ratelimits, create_ratelimit
+from Tools.API.Replay import Cassette
+from Tools.API.StubServer import StubServer
+
+_query = {'query': {'type': 'Astral Plate'}, 'sort': {'price': 'asc'}}
+_trade_ids = [f'{index:064x}' for index in range(25)]
+
+
+def _listing_json(trade_id: str, amount: int) -> dict:
+    return {'id': trade_id, 'listing': {'indexed': '2021-01-24T03:41:08Z', 'account': {'name': 'seller'}, 'price': {'type': '~price', 'amount': amount, 'currency': 'chaos'}},
+            'item': {'name': '', 'typeLine': 'Astral Plate', 'ilvl': 86}}
+
+
+@pytest.fixture
+def cassette():
+    cassette = Cassette()
+    cassette.add('POST', '/api/trade/search/Ritual', json.dumps(_query), 200, {}, json.dumps({'id': 'search', 'result': _trade_ids}))
+    for first in range(0, len(_trade_ids), 10):
+        chunk = _trade_ids[first:first + 10]
+        body = json.dumps({'result': [_listing_json(trade_id, amount) for amount, trade_id in enumerate(chunk, first + 1)]})
+        cassette.add('GET', f'/api/trade/fetch/{",".join(chunk)}?query=search', json.dumps({'query': 'search'}), 200, {}, body)
+    return cassette
+
+
+@pytest.fixture(autouse=True)
+def trade_ratelimit():
+    create_ratelimit([RatelimitRule(100, 1, buffer_interval=0)], name=TRADE_API_NAME)
+    yield
+    _ratelimits.pop(TRADE_API_NAME.value, None)
+
+
+def test_stopping_early_fetches_no_further_listings(cassette):
+    client = TradeClient('Ritual')
+    with StubServer(cassette) as stub:
+        # the search, and only the first of the three fetches
+        assert [listing.amount for listing in client.iter_query_results(_query, stop_when=lambda listing: listing.amount > 4, use_cache=False)] == [1, 2, 3, 4]
+        assert stub.status_counts == {200: 2}
+
+        assert len(list(client.iter_query_results(_query, max_priced_listings=12, use_cache=False))) == 12
+        assert stub.status_counts == {200: 5}
+
+        # abandoning the iterator part way through a chunk fetches nothing more
+        results = client.iter_query_results(_query, use_cache=False)
+        assert [next(results).amount for _ in range(10)] == list(range(1, 11))
+        results.close()
+        assert stub.status_counts == {200: 7}
+
+        assert [listing.amount for listing in client.iter_query_results(_query, use_cache=False)] == list(range(1, 26))
+        assert stub.status_counts == {200: 11}
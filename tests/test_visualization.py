@@ -0,0 +1,42 @@
+import matplotlib
+import numpy as np
+
+matplotlib.use('Agg')
+
+from POE.Trade.Visualization import ChartRenderer, chart_name, downsample  # noqa: E402
+
+
+def test_downsampling_keeps_spikes_and_endpoints():
+    values = np.random.default_rng(0).normal(100, 1, 10_000)
+    values[1234], values[8765] = 1_000, -1_000
+    kept = downsample(values, max_points=100)
+
+    assert len(kept) <= 102 and list(kept) == sorted(set(kept))
+    assert {0, 1234, 8765, len(values) - 1} <= set(kept)
+    assert list(downsample(values[:50], max_points=100)) == list(range(50))
+
+
+def test_charts_are_skipped_while_their_data_is_unchanged(tmp_path):
+    timestamps = np.arange(0, 5_000 * 3_600, 3_600)
+    values = np.linspace(10, 20, len(timestamps))
+    prices = np.array([5, 3, 4, 10, 7])
+
+    with ChartRenderer(tmp_path, max_points=200) as renderer:
+        assert renderer.histogram('prices', prices)
+        assert renderer.time_series('history', timestamps, values, low=values - 1, high=values + 1)
+    assert (tmp_path / 'prices.png').exists() and (tmp_path / 'history.png').exists()
+
+    # the manifest saved by the previous renderer is read back, and only changed or missing charts are rendered
+    renderer = ChartRenderer(tmp_path, max_points=200)
+    assert not renderer.histogram('prices', prices[::-1])
+    assert not renderer.time_series('history', timestamps, values, low=values - 1, high=values + 1)
+    assert renderer.time_series('history', timestamps, values * 2, low=values - 1, high=values + 1)
+    (tmp_path / 'prices.png').unlink()
+    assert renderer.histogram('prices', prices)
+    renderer.close()
+    assert (renderer.rendered, renderer.skipped) == (2, 2)
+
+
+def test_chart_names_are_safe_file_names():
+    assert chart_name('Shavronne\'s Wrappings', 'Occultist\'s Vestment', 'prices') == 'Shavronne_s_Wrappings_Occultist_s_Vestment_prices'
+    assert chart_name('', 'Astral Plate', 'history') == 'Astral_Plate_history'
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from Tools.API.POE import TRADE_API_NAME
+from Tools.API.POE.Watcher import NEW, PRICE_CHANGED, REMOVED, ListingWatcher, WatchedQuery, moved_ids
+from Tools.API.Ratelimiting import RatelimitRule, _ratelimits, create_ratelimit
+from Tools.API.Replay import Cassette
+from Tools.API.StubServer import StubServer
+
+_query = {'query': {'type': 'Astral Plate'}, 'sort': {'price': 'asc'}}
+
+
+def _listing_json(trade_id: str, amount: int) -> dict:
+    return {'id': trade_id, 'listing': {'indexed': '2021-01-24T03:41:08Z', 'account': {'name': 'seller'}, 'price': {'type': '~price', 'amount': amount, 'currency': 'chaos'}},
+            'item': {'name': '', 'typeLine': 'Astral Plate', 'ilvl': 86}}
+
+
+def _add_search(cassette: Cassette, trade_ids):
+    cassette.add('POST', '/api/trade/search/Ritual', json.dumps(_query), 200, {}, json.dumps({'id': 'search', 'result': trade_ids}))
+
+
+def _add_fetch(cassette: Cassette, listings):
+    trade_ids = ','.join(trade_id for trade_id, _ in listings)
+    body = json.dumps({'result': [_listing_json(trade_id, amount) if amount is not None else None for trade_id, amount in listings]})
+    cassette.add('GET', f'/api/trade/fetch/{trade_ids}?query=search', json.dumps({'query': 'search'}), 200, {}, body)
+
+
+@pytest.fixture(autouse=True)
+def trade_ratelimit():
+    create_ratelimit([RatelimitRule(100, 1, buffer_interval=0)], name=TRADE_API_NAME)
+    yield
+    _ratelimits.pop(TRADE_API_NAME.value, None)
+
+
+def test_moved_ids_ignores_listings_shifted_by_others():
+    previous = {trade_id: rank for rank, trade_id in enumerate('abcde')}
+    assert moved_ids(previous, list('abxcde')) == []
+    assert moved_ids(previous, list('bcde')) == []
+    assert moved_ids(previous, list('acdbe')) == ['b']
+    assert moved_ids(previous, list('eabcd')) == ['e']
+    assert moved_ids({}, list('abc')) == []
+
+
+def test_watcher_fetches_only_changed_listings():
+    cassette = Cassette()
+    # each poll's search returns the next recorded results, the last being repeated
+    for trade_ids in (['a', 'b', 'c'], ['a', 'b', 'c'], ['a', 'b', 'c'], ['b', 'a', 'd'], ['b', 'a', 'd']):
+        _add_search(cassette, trade_ids)
+    _add_fetch(cassette, [('a', 1), ('b', None), ('c', 3)])
+    _add_fetch(cassette, [('b', 2)])
+    _add_fetch(cassette, [('a', 4), ('b', 2)])
+    # the fourth poll fetches the new listing, and the one which moved ahead of another
+    _add_fetch(cassette, [('d', 5), ('b', 2)])
+
+    watcher = ListingWatcher([WatchedQuery('plates', _query, league='Ritual', refetch_top=2, refetch_every=3)])
+    with StubServer(cassette) as stub:
+        polls = [[(event.kind, event.listing.id, event.listing.amount) for event in watcher.poll('plates')] for _ in range(4)]
+        # a steady state poll only searches
+        assert watcher.poll('plates') == []
+        assert stub.status_counts == {200: 9}
+
+    assert polls == [
+        [],
+        # the listing which could not be fetched is fetched again, and reported once available
+        [(NEW, 'b', 2)],
+        # the third poll fetches the first two results again, catching a price change which kept their order
+        [(PRICE_CHANGED, 'a', 4)],
+        [(NEW, 'd', 5), (REMOVED, 'c', 3)],
+    ]
+
+
+def test_polls_reserve_the_requests_they_are_known_to_make():
+    watcher = ListingWatcher([WatchedQuery('plates', _query, league='Ritual', num_trades=25, refetch_top=12, refetch_every=3)])
+    state = watcher._states['plates']
+    assert watcher._expected_requests('plates') == 4
+    state.initialized, state.polls = True, 1
+    assert watcher._expected_requests('plates') == 1
+    state.polls = 2
+    assert watcher._expected_requests('plates') == 3
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+
+import pytest
+
+from Tools import Wrapper
+
+
+@dataclass
+class _Point(object):
+    x: int
+    y: int
+
+    @property
+    def norm(self) -> int:
+        return abs(self.x) + abs(self.y)
+
+    def moved(self, dx: int) -> '_Point':
+        return _Point(self.x + dx, self.y)
+
+    def __len__(self):
+        return 2
+
+
+class _WrappedPoint(Wrapper):
+    __wraps__ = _Point
+
+
+class _LabelledPoint(Wrapper):
+    __wraps__ = _WrappedPoint
+
+    def __init__(self, point: _WrappedPoint, label: str):
+        super().__init__(point)
+        self.label = label
+
+    @property
+    def x(self) -> int:
+        return -self._obj.x
+
+
+def test_attributes_are_delegated_through_generated_properties():
+    point = _Point(3, -4)
+    wrapped = _WrappedPoint(point)
+    assert isinstance(_WrappedPoint.__dict__['x'], property) and isinstance(_WrappedPoint.__dict__['norm'], property)
+    assert (wrapped.x, wrapped.y, wrapped.norm) == (3, -4, 7)
+    assert wrapped.moved(1) == _Point(4, -4)
+
+    # chains of wrappers read through a single flattened path
+    labelled = _LabelledPoint(wrapped, 'origin')
+    assert _LabelledPoint._delegated['y'] == '_obj._obj.y' and labelled.y == -4 and labelled.norm == 7
+    assert labelled.label == 'origin'
+
+    # attributes missing from the wrapped class still fall back to __getattr__
+    point.z = 5
+    assert labelled.z == 5
+    with pytest.raises(AttributeError):
+        _ = wrapped.w
+
+
+def test_special_methods_are_proxied_and_unwrap_wrappers():
+    wrapped = _WrappedPoint(_Point(1, 2))
+    assert len(wrapped) == 2
+    assert str(wrapped) == str(_Point(1, 2))
+    assert wrapped == _WrappedPoint(_Point(1, 2)) and wrapped != _WrappedPoint(_Point(2, 1))
+    with pytest.raises(TypeError):
+        Wrapper(_Point(1, 2))
+    with pytest.raises(ValueError):
+        _WrappedPoint(object())
+
+
+def test_assignments_are_written_through_to_the_wrapped_object():
+    point = _Point(1, 2)
+    wrapped = _WrappedPoint(point)
+    labelled = _LabelledPoint(wrapped, 'origin')
+
+    labelled.y = 5
+    assert (point.y, wrapped.y, labelled.y) == (5, 5, 5)
+    wrapped.x = 4
+    assert point.x == 4 and labelled.norm == 9
+
+
+def test_subclasses_override_delegated_names():
+    labelled = _LabelledPoint(_WrappedPoint(_Point(3, 4)), 'origin')
+    assert labelled.x == -3 and 'x' not in _LabelledPoint._delegated
+    with pytest.raises(AttributeError):
+        labelled.x = 1